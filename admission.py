@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional
+
+import streamlit as st
+
+from config import get_float_setting, get_int_setting
+
+class AuthRejected(Exception):
+    """Raised when admission control sheds an authentication request before hashing."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class RateLimiter:
+    """Per-key token buckets, keeping at most max_keys recently used keys."""
+
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def try_acquire(self, key: str) -> bool:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.try_acquire()
+
+class AuthAdmission:
+    """Admission control for bcrypt-heavy authentication work.
+
+    Requests are first checked against per-username and per-client token
+    buckets, which is cheap and happens before any database lookup or hashing.
+    Admitted requests then wait for one of max_concurrency hashing slots; at
+    most max_queue requests may wait, each for at most queue_timeout seconds,
+    so a burst of logins can't occupy every core and starve chat reruns.
+    Batch work such as bulk user creation hashes in the same slots through
+    run_background, but never holds more than max_concurrency - 1 of them
+    (at least one), so logins always have a slot left.
+    """
+
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 32, queue_timeout: float = 2.0,
+                 user_rate_per_minute: float = 10, user_burst: int = 5,
+                 client_rate_per_minute: float = 30, client_burst: int = 10):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.background_slots = threading.BoundedSemaphore(max(1, max_concurrency - 1))
+        self.max_concurrency = max_concurrency
+        self.user_limiter = RateLimiter(user_rate_per_minute, user_burst)
+        self.client_limiter = RateLimiter(client_rate_per_minute, client_burst)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        self.wait_times = deque(maxlen=1000)
+        self.counters = {"admitted": 0, "admitted_background": 0, "rejected_user_rate": 0, "rejected_client_rate": 0,
+                         "rejected_queue_full": 0, "rejected_queue_timeout": 0}
+
+    def _reject(self, reason: str):
+        with self.lock:
+            self.counters[f"rejected_{reason}"] += 1
+        raise AuthRejected(reason)
+
+    def check_limits(self, username: str, client_id: Optional[str] = None) -> None:
+        """Consume a token for the username and client, raising AuthRejected if either is exhausted."""
+        with self.lock:
+            user_ok = self.user_limiter.try_acquire(username or "")
+            client_ok = client_id is None or self.client_limiter.try_acquire(client_id)
+        if not user_ok:
+            self._reject("user_rate")
+        if not client_ok:
+            self._reject("client_rate")
+
+    def run(self, fn: Callable, *args):
+        """Run fn(*args) in a hashing slot, raising AuthRejected if none frees up in time."""
+        with self.lock:
+            if self.waiting >= self.max_queue:
+                self.counters["rejected_queue_full"] += 1
+                raise AuthRejected("queue_full")
+            self.waiting += 1
+        started = time.monotonic()
+        acquired = self.slots.acquire(timeout=self.queue_timeout)
+        waited = time.monotonic() - started
+        with self.lock:
+            self.waiting -= 1
+            self.wait_times.append(waited)
+            if not acquired:
+                self.counters["rejected_queue_timeout"] += 1
+                raise AuthRejected("queue_timeout")
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+    def run_background(self, fn: Callable, *args):
+        """Run fn(*args) in a hashing slot for batch work, waiting for one as long as it takes."""
+        with self.background_slots, self.slots:
+            with self.lock:
+                self.in_flight += 1
+                self.counters["admitted_background"] += 1
+            try:
+                return fn(*args)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+    def metrics(self) -> Dict:
+        """Queue depth, wait times and rejection counters for admin views."""
+        with self.lock:
+            waits = sorted(self.wait_times)
+            metrics = dict(self.counters)
+            metrics.update({
+                "queue_depth": self.waiting,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "wait_ms_p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0
+            })
+        return metrics
+
+@st.cache_resource
+def get_auth_admission() -> AuthAdmission:
+    """Return the authentication admission controller shared by this server process."""
+    return AuthAdmission(
+        max_concurrency=get_int_setting("AUTH_MAX_CONCURRENCY", 2),
+        max_queue=get_int_setting("AUTH_MAX_QUEUE", 32),
+        queue_timeout=get_float_setting("AUTH_QUEUE_TIMEOUT_SECONDS", 2.0),
+        user_rate_per_minute=get_float_setting("AUTH_USER_RATE_PER_MINUTE", 10),
+        user_burst=get_int_setting("AUTH_USER_BURST", 5),
+        client_rate_per_minute=get_float_setting("AUTH_CLIENT_RATE_PER_MINUTE", 30),
+        client_burst=get_int_setting("AUTH_CLIENT_BURST", 10)
+    )
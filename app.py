@@ -1,9 +1,46 @@
 import streamlit as st
-from datetime import datetime
 import os
-from database import db_manager
+from collections import deque
+from admission import AuthRejected
+from async_database import create_concurrent_reader
+from broker import conversation_channel, room_channel
+from commands import CHAT, LOBBY, CommandUsageError, registry as commands
+from config import get_float_setting, get_int_setting, get_setting
+from database import STARTUP_METRICS, db_manager, start_warm_up
+from metrics import get_metrics, start_metrics_exporter
+from presence import LOBBY_LOCATION, get_presence_tracker, start_presence_sync
+from renderer import TerminalRenderer, format_message
+from resilience import ResilientBackend
+from scheduler import start_maintenance_scheduler
+from session_memory import get_session_registry
+from storage import conversation_key
+
+# Connect to the database in the background while the first page renders
+start_warm_up()
+
+# Latency of database calls and rerun phases, exported for Prometheus if configured
+metrics = get_metrics()
+start_metrics_exporter(metrics)
+
+# Runs the independent reads of each rerun concurrently
+reader = create_concurrent_reader(db_manager)
+
+# Periodic maintenance (message cleanup) runs once per server process
+maintenance_scheduler = None
+if str(get_setting("MAINTENANCE_ENABLED", "true")).lower() == "true":
+    maintenance_scheduler = start_maintenance_scheduler(db_manager)
+
+# Bounded per-session message and command history, tracked for admin views
+session_registry = get_session_registry()
+
+# Who is in which room or DM, kept current by every session's heartbeats
+presence = get_presence_tracker()
+start_presence_sync(presence, db_manager)
 
 # Initialize session state variables
+if 'session_memory' not in st.session_state:
+    st.session_state.session_memory = session_registry.create()
+
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
     
@@ -17,16 +54,68 @@ if 'direct_message_target' not in st.session_state:
     st.session_state.direct_message_target = None
     
 if 'messages' not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = st.session_state.session_memory.messages
+    
+if 'last_message_id' not in st.session_state:
+    st.session_state.last_message_id = None
+    
+if 'history_exhausted' not in st.session_state:
+    st.session_state.history_exhausted = False
     
 if 'rooms' not in st.session_state:
     st.session_state.rooms = []
     
+if 'dm_inbox' not in st.session_state:
+    st.session_state.dm_inbox = []
+    
+if 'renderer' not in st.session_state:
+    st.session_state.renderer = TerminalRenderer(window_size=get_int_setting("RENDER_WINDOW_LINES", 100))
+    
 if 'command_history' not in st.session_state:
-    st.session_state.command_history = []
+    st.session_state.command_history = st.session_state.session_memory.commands
     
 if 'show_reset_password' not in st.session_state:
     st.session_state.show_reset_password = False
+    
+if 'subscription' not in st.session_state:
+    st.session_state.subscription = None
+
+if 'last_search' not in st.session_state:
+    st.session_state.last_search = None
+
+# Queued messages that failed to store, shown in the message pane until the next command
+if 'failed_sends' not in st.session_state:
+    st.session_state.failed_sends = deque(maxlen=5)
+
+# Confirmations of commands that switch context, kept to show again after the rerun that switch causes
+if 'pending_notices' not in st.session_state:
+    st.session_state.pending_notices = []
+
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 200
+SEARCH_PAGE_SIZE = get_int_setting("SEARCH_PAGE_SIZE", 10)
+
+# How often the message pane checks its channel for new messages (0 disables live updates)
+LIVE_REFRESH_SECONDS = get_float_setting("LIVE_REFRESH_SECONDS", 0.5)
+
+AUTH_THROTTLED_MESSAGE = "Too many attempts. Please wait a moment and try again."
+
+def get_client_id():
+    """Identify the requesting client for per-client auth rate limits.
+
+    Clients can put anything in X-Forwarded-For, so it is only used behind
+    AUTH_TRUSTED_PROXIES proxies, taking the address the outermost of them
+    appended (counted from the right); otherwise the peer address is used.
+    """
+    try:
+        trusted_proxies = get_int_setting("AUTH_TRUSTED_PROXIES", 0)
+        if trusted_proxies > 0:
+            hops = [hop.strip() for hop in (st.context.headers.get("X-Forwarded-For") or "").split(",") if hop.strip()]
+            if len(hops) >= trusted_proxies:
+                return hops[-trusted_proxies]
+        return getattr(st.context, "ip_address", None)
+    except Exception:
+        return None
 
 def login_page():
     """Display the login page."""
@@ -45,29 +134,40 @@ def login_page():
         
         if st.button("Reset Password"):
             if reset_username and reset_old_password and reset_new_password:
-                if db_manager.reset_user_password_unauthenticated(reset_username, reset_old_password, reset_new_password):
-                    st.success("Password reset successfully! You can now login with your new password.")
-                    st.session_state.show_reset_password = False
+                try:
+                    reset_ok = db_manager.reset_user_password_unauthenticated(
+                        reset_username, reset_old_password, reset_new_password, get_client_id()
+                    )
+                except AuthRejected:
+                    st.error(AUTH_THROTTLED_MESSAGE)
                 else:
-                    st.error("Failed to reset password. Please check your credentials.")
+                    if reset_ok:
+                        st.success("Password reset successfully! You can now login with your new password.")
+                        st.session_state.show_reset_password = False
+                    else:
+                        st.error("Failed to reset password. Please check your credentials.")
             else:
                 st.error("Please fill in all fields.")
         
         if st.button("Back to Login"):
             st.session_state.show_reset_password = False
-            st.experimental_rerun()
+            st.rerun()
     else:
         username = st.text_input("Username")
         password = st.text_input("Password", type="password")
         
         if st.button("Login"):
-            user_data = db_manager.authenticate_user(username, password)
+            try:
+                user_data = db_manager.authenticate_user(username, password, get_client_id())
+            except AuthRejected:
+                st.error(AUTH_THROTTLED_MESSAGE)
+                return
             if user_data:
                 st.session_state.logged_in = True
                 st.session_state.user_data = user_data
                 st.session_state.rooms = db_manager.get_user_rooms(username)
                 st.success(f"Welcome, {username}!")
-                st.experimental_rerun()
+                st.rerun()
             else:
                 st.error("Invalid username or password")
         
@@ -78,7 +178,14 @@ def login_page():
             
             if st.button("Change Password"):
                 if change_new_password:
-                    if db_manager.change_user_password_authenticated(st.session_state.user_data['username'], change_new_password):
+                    try:
+                        changed = db_manager.change_user_password_authenticated(
+                            st.session_state.user_data.username, change_new_password, get_client_id()
+                        )
+                    except AuthRejected:
+                        st.error(AUTH_THROTTLED_MESSAGE)
+                        return
+                    if changed:
                         st.success("Password changed successfully!")
                     else:
                         st.error("Failed to change password.")
@@ -91,77 +198,195 @@ def logout():
     st.session_state.user_data = None
     st.session_state.current_room = None
     st.session_state.direct_message_target = None
-    st.session_state.messages = []
+    reset_message_buffer()
+    st.session_state.command_history.clear()
+    presence.leave(st.session_state.session_memory.session_key)
+    st.session_state.session_memory.touch(None)
     st.session_state.rooms = []
+    st.session_state.last_search = None
+    st.session_state.pending_notices = []
     st.session_state.show_reset_password = False
     st.success("You have been logged out successfully.")
-    st.experimental_rerun()
+    st.rerun()
+
+def report_failed_send(content: str):
+    """Failure callback for a queued message; it runs on the write-behind thread, so it only touches the deque."""
+    failed_sends = st.session_state.failed_sends
+    preview = content if len(content) <= 40 else content[:37] + "..."
+    return lambda error: failed_sends.append(f"Error: message not delivered ({error}): {preview}")
 
 def send_message(room: str, username: str, content: str):
     """Send a message to a room."""
-    if db_manager.save_message(room, username, content):
-        # Add to session state for immediate display
-        new_message = {
-            "username": username,
-            "content": content,
-            "timestamp": datetime.now().strftime("%H:%M:%S")
-        }
-        st.session_state.messages.append(new_message)
+    if db_manager.save_message(room, username, content, on_failure=report_failed_send(content)):
+        # Pull the stored row (and anything else new) into the session buffer
+        load_room_messages(room)
         return True
     return False
 
 def send_direct_message(sender: str, recipient: str, content: str):
     """Send a direct message."""
-    if db_manager.save_direct_message(sender, recipient, content):
-        # Add to session state for immediate display
-        new_message = {
-            "username": sender,
-            "content": content,
-            "timestamp": datetime.now().strftime("%H:%M:%S")
-        }
-        st.session_state.messages.append(new_message)
+    if db_manager.save_direct_message(sender, recipient, content, on_failure=report_failed_send(content)):
+        # Pull the stored row (and anything else new) into the session buffer
+        load_direct_messages(recipient)
         return True
     return False
 
+def reset_message_buffer():
+    """Clear the session message buffer and its polling cursor."""
+    st.session_state.messages.clear()
+    st.session_state.last_message_id = None
+    st.session_state.history_exhausted = False
+    st.session_state.renderer.reset()
+
+def merge_messages(messages):
+    """Append messages newer than the polling cursor to the session buffer."""
+    for message in messages:
+        if st.session_state.last_message_id is not None and message.id <= st.session_state.last_message_id:
+            continue
+        # The records are shared with the timeline cache rather than copied per session
+        st.session_state.messages.append(message)
+        st.session_state.last_message_id = message.id
+
 def load_room_messages(room_name: str):
-    """Load messages for the current room."""
-    # In a real implementation, you would fetch from database
-    # For now, we'll keep messages in session state
-    pass
+    """Load messages for the current room that this session has not seen yet."""
+    merge_messages(db_manager.get_room_messages_since(room_name, st.session_state.last_message_id))
+
+def load_direct_messages(target_user: str):
+    """Load direct messages with target_user that this session has not seen yet."""
+    merge_messages(db_manager.get_direct_messages_since(
+        st.session_state.user_data.username,
+        target_user,
+        st.session_state.last_message_id
+    ))
+
+def refresh_messages():
+    """Fetch only the new messages for the current room or DM."""
+    if st.session_state.current_room:
+        load_room_messages(st.session_state.current_room)
+    elif st.session_state.direct_message_target:
+        load_direct_messages(st.session_state.direct_message_target)
+
+def load_older_messages(count: int):
+    """Prepend up to count messages older than the oldest one in the session buffer."""
+    if not st.session_state.current_room and not st.session_state.direct_message_target:
+        st.text("Error: Not in a room or direct message. Use /join <room> or /dm <user> first.")
+        return
+    hidden = st.session_state.renderer.hidden_count(st.session_state.messages)
+    if hidden:
+        # Older messages are already buffered, just outside the visible window
+        shown = min(count, hidden)
+        st.session_state.renderer.expand(shown)
+        st.text(f"Showing {shown} older messages.")
+        return
+    if st.session_state.history_exhausted:
+        st.text("No older messages.")
+        return
+    if st.session_state.messages.is_full:
+        st.text(f"Scrollback is limited to {st.session_state.messages.capacity} messages.")
+        return
+    
+    oldest_id = st.session_state.messages[0].id if st.session_state.messages else None
+    if st.session_state.current_room:
+        rows = db_manager.get_room_messages(st.session_state.current_room, count, before_id=oldest_id)
+    else:
+        rows = db_manager.get_direct_messages(
+            st.session_state.user_data.username,
+            st.session_state.direct_message_target,
+            count,
+            before_id=oldest_id
+        )
+    
+    # Rows arrive newest first
+    loaded = st.session_state.messages.prepend(list(reversed(rows)))
+    st.session_state.renderer.expand(loaded)
+    if oldest_id is None and rows:
+        st.session_state.last_message_id = rows[0].id
+    if len(rows) < count:
+        st.session_state.history_exhausted = True
+    if loaded < len(rows):
+        st.text(f"Loaded {loaded} older messages (scrollback is limited to {st.session_state.messages.capacity}).")
+    else:
+        st.text(f"Loaded {loaded} older messages.")
+
+def current_channel():
+    """The channel of the current room or DM, or None in the lobby."""
+    if st.session_state.current_room:
+        return room_channel(st.session_state.current_room)
+    if st.session_state.direct_message_target:
+        return conversation_channel(conversation_key(
+            st.session_state.user_data.username, st.session_state.direct_message_target
+        ))
+    return None
+
+def send_heartbeat():
+    """Tell the presence tracker that this session is still here, and where."""
+    presence.heartbeat(
+        st.session_state.session_memory.session_key,
+        st.session_state.user_data.username,
+        current_channel() or LOBBY_LOCATION
+    )
+
+def sync_subscription():
+    """Subscribe this session to the channel of its current room or DM."""
+    if db_manager.broker is None:
+        return None
+    channel = current_channel()
+    
+    subscription = st.session_state.subscription
+    if channel is None:
+        subscription = None
+    elif subscription is None or subscription.channel != channel:
+        subscription = db_manager.broker.subscribe(channel)
+    st.session_state.subscription = subscription
+    return subscription
+
+def fetch_rerun_data():
+    """Fetch the room list, new messages and DM inbox for this rerun in one concurrent round."""
+    try:
+        data = reader.fetch_rerun_data(
+            st.session_state.user_data.username,
+            st.session_state.current_room,
+            st.session_state.direct_message_target,
+            st.session_state.last_message_id
+        )
+    except Exception as e:
+        print(f"Error fetching rerun data: {e}")
+        refresh_messages()
+        return
+    st.session_state.rooms = data["rooms"]
+    st.session_state.dm_inbox = data["inbox"]
+    merge_messages(data["messages"])
+
+def recent_dm_partners(limit: int = 5):
+    """Names of the users this user most recently exchanged DMs with."""
+    username = st.session_state.user_data.username
+    partners = []
+    for dm in st.session_state.dm_inbox:
+        partner = dm.recipient if dm.sender == username else dm.sender
+        if partner not in partners:
+            partners.append(partner)
+        if len(partners) >= limit:
+            break
+    return partners
+
+def current_role():
+    """The role that decides which commands this session may run."""
+    return "admin" if st.session_state.user_data.is_admin else "user"
+
+def current_context():
+    """Whether the session is in the lobby or in a room or DM."""
+    if st.session_state.current_room or st.session_state.direct_message_target:
+        return CHAT
+    return LOBBY
 
 def show_help():
     """Display help information."""
-    help_text = """TCA v2.0 Terminal Commands:
-========================
-/help                                          - Show this help
-/login <username>                              - Login
-/listrooms                                     - List available rooms
-/join <room>                                   - Join a room
-/users                                         - List users in current room
-/dm <username>                                 - Start direct message
-/exit                                          - Exit DM or leave room
-/logout                                        - Logout
-/changepass <newpass>                          - Change your password (authenticated users)
-/resetpass <username> <oldpass> <newpass>      - Reset password (unauthenticated users)
-/adduser <username> <password> <securitykey>   - (Admin) Create new user
-/createroom <roomname> <securitykey>           - (Admin) Create new room
-/deleteroom <roomname> <securitykey>           - (Admin) Delete a room
-/deletemessage <message_id> <securitykey>      - (Admin) Delete a message
-/cleanup <securitykey>                         - (Admin) Cleanup old messages
-/giveaccess <user1,user2,...> <roomname> <securitykey> - (Admin) Grant room access to users
-/quit                                          - Quit the app
-
-Additional Information:
-- All commands start with '/'
-- Administrative commands require a security key
-- Direct messages are private between two users
-- Rooms can be public or private (access controlled)
-"""
-    st.text(help_text)
+    st.text(commands.help_text())
+    show_command_suggestions()
 
 def list_rooms():
     """List available rooms."""
-    rooms = db_manager.get_user_rooms(st.session_state.user_data['username'])
+    rooms = db_manager.get_user_rooms(st.session_state.user_data.username)
     if rooms:
         st.text("Available rooms:")
         for room in rooms:
@@ -169,41 +394,119 @@ def list_rooms():
     else:
         st.text("No rooms available.")
 
+def notice(text):
+    """Show a command's confirmation now and again after the page reruns for a context switch."""
+    st.text(text)
+    st.session_state.pending_notices.append(text)
+
 def join_room(room_name):
     """Join a room."""
-    rooms = db_manager.get_user_rooms(st.session_state.user_data['username'])
-    if room_name in rooms:
+    if db_manager.has_room_access(st.session_state.user_data.username, room_name):
         st.session_state.current_room = room_name
         st.session_state.direct_message_target = None
-        st.session_state.messages = []  # Clear messages when switching rooms
-        st.text(f"Joined room: {room_name}")
+        reset_message_buffer()  # Clear messages when switching rooms
+        notice(f"Joined room: {room_name}")
     else:
         st.text(f"Error: Room '{room_name}' not found or access denied.")
 
+def room_occupancy():
+    """(room, users present) for the accessible rooms that anyone is in, busiest first."""
+    occupancy = presence.occupancy()
+    rooms = [(room, occupancy.get(room_channel(room), 0)) for room in st.session_state.rooms]
+    return sorted([(room, count) for room, count in rooms if count], key=lambda item: item[1], reverse=True)
+
 def list_users():
-    """List users in current room."""
+    """List the users present in the current room or DM, or who is online when in the lobby."""
+    username = st.session_state.user_data.username
+    channel = current_channel()
+    if channel is None:
+        st.text(f"Users online: {presence.online_count()}")
+        lobby = presence.occupants(LOBBY_LOCATION)
+        if lobby:
+            st.text(f"  - in the lobby: {', '.join(lobby)}")
+        for room, count in room_occupancy():
+            st.text(f"  - {room}: {count} present")
+        return
     st.text("Users in current context:")
-    st.text(f"  - {st.session_state.user_data['username']} (you)")
+    for name in presence.occupants(channel):
+        st.text(f"  - {name} (you)" if name == username else f"  - {name}")
 
 def start_dm(target_user):
     """Start direct messaging with a user."""
     st.session_state.direct_message_target = target_user
     st.session_state.current_room = None
-    st.session_state.messages = []
-    st.text(f"Started direct message with: {target_user}")
+    reset_message_buffer()
+    notice(f"Started direct message with: {target_user}")
 
 def exit_room_or_dm():
     """Exit current room or DM."""
     if st.session_state.direct_message_target:
-        st.text(f"Exited direct message with: {st.session_state.direct_message_target}")
+        notice(f"Exited direct message with: {st.session_state.direct_message_target}")
         st.session_state.direct_message_target = None
+        reset_message_buffer()
     elif st.session_state.current_room:
-        st.text(f"Left room: {st.session_state.current_room}")
+        notice(f"Left room: {st.session_state.current_room}")
         st.session_state.current_room = None
-        st.session_state.messages = []
+        reset_message_buffer()
     else:
         st.text("Not in any room or direct message.")
 
+def show_history(count=None):
+    """Load a page of older messages, HISTORY_PAGE_SIZE unless a count is given."""
+    load_older_messages(max(1, min(count or HISTORY_PAGE_SIZE, MAX_HISTORY_PAGE_SIZE)))
+
+def show_search_page(terms, room, page):
+    """Run a search and print one page of hits, remembering it for /more."""
+    username = st.session_state.user_data.username
+    hits, has_more = db_manager.search_messages(username, terms, room, page, SEARCH_PAGE_SIZE)
+    st.session_state.last_search = (terms, room, page) if has_more else None
+    if not hits:
+        st.text("No more results." if page > 1 else "No messages found.")
+        return
+    lines = [f"Results for '{terms}'" + (f" in {room}" if room else "") + f" (page {page}):"]
+    for message in hits:
+        if message.is_direct:
+            other = message.recipient if message.username == username else message.username
+            where = f"@{other}"
+        else:
+            where = f"#{message.room}"
+        lines.append(f"  {where:<16} {format_message(message)}  (id {message.id})")
+    if has_more:
+        lines.append("Type /more for the next page.")
+    st.text("\n".join(lines))
+
+def search_messages(query):
+    """Search your rooms and direct messages; one #room word limits the search to that room."""
+    words = query.split()
+    rooms = [word[1:] for word in words if word.startswith("#") and len(word) > 1]
+    terms = " ".join(word for word in words if not word.startswith("#"))
+    if not terms.strip() or len(rooms) > 1:
+        # One #room at most: searching several rooms at once isn't supported
+        st.text(f"Error: Usage: {commands.resolve('/search', current_role()).usage}")
+        return
+    show_search_page(terms, rooms[0] if rooms else None, 1)
+
+def show_more_results():
+    """Show the next page of the last search."""
+    if st.session_state.last_search is None:
+        st.text("No further search results. Use /search <terms> first.")
+        return
+    terms, room, page = st.session_state.last_search
+    show_search_page(terms, room, page + 1)
+
+def quit_app():
+    """Quit the app."""
+    st.text("Goodbye! Thanks for using TCA v2.0.")
+    presence.leave(st.session_state.session_memory.session_key)
+    st.session_state.logged_in = False
+    st.session_state.user_data = None
+    st.session_state.current_room = None
+    st.session_state.direct_message_target = None
+    reset_message_buffer()
+    st.session_state.rooms = []
+    st.session_state.pending_notices = []
+    st.rerun()
+
 def validate_security_key(security_key):
     """Validate the security key for admin operations."""
     # Use Streamlit secrets instead of hardcoded value
@@ -216,14 +519,26 @@ def validate_security_key(security_key):
 
 def change_password(new_pass):
     """Change user password for authenticated users."""
-    if db_manager.change_user_password_authenticated(st.session_state.user_data['username'], new_pass):
+    try:
+        changed = db_manager.change_user_password_authenticated(
+            st.session_state.user_data.username, new_pass, get_client_id()
+        )
+    except AuthRejected:
+        st.text(f"Error: {AUTH_THROTTLED_MESSAGE}")
+        return
+    if changed:
         st.text("Password changed successfully.")
     else:
         st.text("Error: Failed to change password.")
 
 def reset_password(username, old_pass, new_pass):
     """Reset user password for unauthenticated users."""
-    if db_manager.reset_user_password_unauthenticated(username, old_pass, new_pass):
+    try:
+        reset_ok = db_manager.reset_user_password_unauthenticated(username, old_pass, new_pass, get_client_id())
+    except AuthRejected:
+        st.text(f"Error: {AUTH_THROTTLED_MESSAGE}")
+        return
+    if reset_ok:
         st.text(f"Password for user '{username}' reset successfully.")
     else:
         st.text(f"Error: Failed to reset password for user '{username}'. Please check credentials.")
@@ -239,15 +554,47 @@ def add_user(username, password, security_key):
     else:
         st.text(f"Error: Failed to create user '{username}'. Username may already exist.")
 
+def add_users_batch(arg_lists):
+    """Create the users of several /adduser commands with one hashing pass and one insert.
+    
+    Prints one result per command, in order; a name repeated in the batch fails after its first use.
+    """
+    valid = [validate_security_key(security_key) for _, _, security_key in arg_lists]
+    users_data, seen = [], set()
+    for (username, password, _), key_ok in zip(arg_lists, valid):
+        if key_ok and username not in seen:
+            seen.add(username)
+            users_data.append({"username": username, "password": password})
+    results = db_manager.create_multiple_users(users_data, "user") if users_data else {}
+    seen = set()
+    for (username, _, _), key_ok in zip(arg_lists, valid):
+        if not key_ok:
+            st.text(f"Error: Invalid security key for user '{username}'.")
+        elif username not in seen and results.get(username):
+            st.text(f"User '{username}' created successfully.")
+        else:
+            st.text(f"Error: Failed to create user '{username}'. Username may already exist.")
+        seen.add(username)
+
+def add_multiple_users_command(users_str, security_key):
+    """Parse username:password pairs separated by commas and create the users."""
+    users_data = []
+    for user_pair in users_str.split(','):
+        if ':' in user_pair:
+            username, password = user_pair.split(':', 1)
+            users_data.append({"username": username, "password": password})
+    add_multiple_users(users_data, security_key)
+
 def add_multiple_users(users_data, security_key):
     """Add multiple users (admin only)."""
     if not validate_security_key(security_key):
         st.text("Error: Invalid security key.")
         return
         
-    results = db_manager.create_multiple_users(users_data, "user")
     st.text("Batch user creation results:")
-    for username, success in results.items():
+    progress = st.progress(0.0)
+    for username, success, completed, total in db_manager.create_multiple_users_iter(users_data, "user"):
+        progress.progress(completed / total)
         if success:
             st.text(f"  ✓ User '{username}' created successfully.")
         else:
@@ -259,13 +606,33 @@ def create_room(room_name, security_key):
         st.text("Error: Invalid security key.")
         return
         
-    if db_manager.create_room(room_name, [st.session_state.user_data['username']], False):
+    if db_manager.create_room(room_name, [st.session_state.user_data.username], False):
         st.text(f"Room '{room_name}' created successfully.")
         # Refresh rooms list
-        st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data['username'])
+        st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data.username)
     else:
         st.text(f"Error: Failed to create room '{room_name}'. Room may already exist.")
 
+def create_rooms_batch(arg_lists):
+    """Create the rooms of several /createroom commands with one lookup and one insert.
+    
+    Prints one result per command, in order; a name repeated in the batch fails after its first use.
+    """
+    username = st.session_state.user_data.username
+    valid = [validate_security_key(security_key) for _, security_key in arg_lists]
+    rooms = [(room_name, [username], False) for (room_name, _), key_ok in zip(arg_lists, valid) if key_ok]
+    results = db_manager.create_rooms(rooms) if rooms else {}
+    seen = set()
+    for (room_name, _), key_ok in zip(arg_lists, valid):
+        if not key_ok:
+            st.text(f"Error: Invalid security key for room '{room_name}'.")
+        elif room_name not in seen and results.get(room_name):
+            st.text(f"Room '{room_name}' created successfully.")
+        else:
+            st.text(f"Error: Failed to create room '{room_name}'. Room may already exist.")
+        seen.add(room_name)
+    st.session_state.rooms = db_manager.get_user_rooms(username)
+
 def delete_room(room_name, security_key):
     """Delete a room (admin only)."""
     if not validate_security_key(security_key):
@@ -275,7 +642,10 @@ def delete_room(room_name, security_key):
     if db_manager.delete_room(room_name):
         st.text(f"Room '{room_name}' deleted successfully.")
         # Refresh rooms list
-        st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data['username'])
+        st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data.username)
+    elif room_name in db_manager.retention.pending_rooms():
+        st.text(f"Room '{room_name}' deleted; removing its messages is pending until cleanup resumes.")
+        st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data.username)
     else:
         st.text(f"Error: Failed to delete room '{room_name}'.")
 
@@ -311,69 +681,119 @@ def give_access(users_str, room_name, security_key):
     else:
         st.text(f"Error: Failed to grant access to {users_str} for room {room_name}.")
 
+def give_access_batch(arg_lists):
+    """Apply several /giveaccess commands with one read and one write of the rooms involved.
+    
+    Prints one result per command, in order.
+    """
+    valid = [validate_security_key(security_key) for _, _, security_key in arg_lists]
+    grants = {}
+    for (users_str, room_name, _), key_ok in zip(arg_lists, valid):
+        if key_ok:
+            grants.setdefault(room_name, []).extend(users_str.split(','))
+    results = db_manager.grant_room_access_many(grants) if grants else {}
+    for (users_str, room_name, _), key_ok in zip(arg_lists, valid):
+        if not key_ok:
+            st.text(f"Error: Invalid security key for room {room_name}.")
+        elif results.get(room_name):
+            st.text(f"Access granted to {users_str} for room {room_name}.")
+        else:
+            st.text(f"Error: Failed to grant access to {users_str} for room {room_name}.")
+
 def send_regular_message(message):
     """Send a regular message."""
     if st.session_state.current_room:
         send_message(
             st.session_state.current_room, 
-            st.session_state.user_data['username'], 
+            st.session_state.user_data.username, 
             message
         )
     elif st.session_state.direct_message_target:
         send_direct_message(
-            st.session_state.user_data['username'],
+            st.session_state.user_data.username,
             st.session_state.direct_message_target,
             message
         )
     else:
         st.text("Error: Not in a room or direct message. Use /join <room> or /dm <user> first.")
 
-def get_contextual_commands():
-    """Get contextual command suggestions based on current state."""
-    commands = []
+def show_stats():
+    """Display latency percentiles, error counts and returned row counts of instrumented operations."""
+    rows = metrics.summary()
+    if not rows:
+        st.text("No operations recorded yet.")
+        return
+    lines = [f"{'operation':<40} {'count':>7} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'avg rows':>8}"]
+    for row in rows:
+        # Calls that don't return a collection have no row count
+        avg_rows = "-" if row['avg_rows'] is None else row['avg_rows']
+        lines.append(
+            f"{row['operation']:<40} {row['count']:>7} {row['errors']:>6} {row['p50_ms']:>8} "
+            f"{row['p95_ms']:>8} {row['p99_ms']:>8} {avg_rows:>8}"
+        )
+    st.text("\n".join(lines))
+
+def show_command_suggestions():
+    """Display the contextual command suggestions, prebuilt per role and context."""
+    st.text(commands.suggestions_text(current_role(), current_context()))
+
+def run_batch(batch_text):
+    """Run several ';'-separated commands from one submit.
     
-    if not st.session_state.current_room and not st.session_state.direct_message_target:
-        # In lobby/main context
-        commands.extend([
-            ("/dm <username>", "Start a direct message with a user"),
-            ("/join <room>", "Join a chat room"),
-            ("/listrooms", "List available rooms"),
-            ("/help", "Show help information"),
-            ("/logout", "Log out of the application")
-        ])
-    else:
-        # In room or DM context
-        commands.extend([
-            ("/quit", "Leave the current room or DM"),
-            ("/help", "Show help information"),
-            ("/logout", "Log out of the application")
-        ])
-        
-        # Add admin commands if user is admin
-        if st.session_state.user_data.get('role') == 'admin':
-            commands.extend([
-                ("/adduser <username> <password> <securitykey>", "Create a new user"),
-                ("/createroom <roomname> <securitykey>", "Create a new room"),
-                ("/deleteroom <roomname> <securitykey>", "Delete a room"),
-                ("/deletemessage <message_id> <securitykey>", "Delete a message"),
-                ("/cleanup <securitykey>", "Cleanup old messages"),
-                ("/giveaccess <user1,user2,...> <roomname> <securitykey>", "Grant room access")
-            ])
+    Commands run in the order given. Consecutive /adduser, /createroom or
+    /giveaccess commands are coalesced into one database call per run; the
+    rest run one by one.
+    """
+    try:
+        parsed = commands.split_batch(batch_text, current_role())
+    except CommandUsageError as e:
+        st.text(f"Error: {e}")
+        return
+    groups = []
+    for command, args in parsed:
+        if groups and groups[-1][0] == command.name and command.name in BATCH_HANDLERS:
+            groups[-1][1].append(args)
         else:
-            # Add user command for changing password
-            commands.extend([
-                ("/changepass <newpass>", "Change your password")
-            ])
-    
-    return commands
+            groups.append((command.name, [args]))
+    for name, arg_lists in groups:
+        if name in BATCH_HANDLERS:
+            BATCH_HANDLERS[name](arg_lists)
+        else:
+            for args in arg_lists:
+                COMMAND_HANDLERS[name](*args)
 
-def show_command_suggestions():
-    """Display contextual command suggestions."""
-    commands = get_contextual_commands()
-    if commands:
-        st.text("\nAvailable commands in current context:")
-        for cmd, desc in commands:
-            st.text(f"  {cmd:<50} - {desc}")
+# Handler of each command in commands.py, called with its parsed arguments
+COMMAND_HANDLERS = {
+    "/help": show_help,
+    "/listrooms": list_rooms,
+    "/join": join_room,
+    "/users": list_users,
+    "/dm": start_dm,
+    "/exit": exit_room_or_dm,
+    "/history": show_history,
+    "/search": search_messages,
+    "/more": show_more_results,
+    "/logout": logout,
+    "/changepass": change_password,
+    "/resetpass": reset_password,
+    "/adduser": add_user,
+    "/addmultipleusers": add_multiple_users_command,
+    "/createroom": create_room,
+    "/deleteroom": delete_room,
+    "/deletemessage": delete_message,
+    "/cleanup": cleanup_old_messages,
+    "/giveaccess": give_access,
+    "/stats": show_stats,
+    "/batch": run_batch,
+    "/quit": quit_app
+}
+
+# Handlers that take every occurrence of a command in a /batch at once
+BATCH_HANDLERS = {
+    "/adduser": add_users_batch,
+    "/createroom": create_rooms_batch,
+    "/giveaccess": give_access_batch
+}
 
 def process_command(command_str):
     """Process terminal commands."""
@@ -381,74 +801,28 @@ def process_command(command_str):
     
     # Check if it's a command (starts with /) or regular message
     if command_str.startswith('/'):
-        # Parse command
-        parts = command_str.split()
-        if not parts:
+        name, _, arguments = command_str.partition(" ")
+        command = commands.resolve(name, current_role())
+        if command is None:
+            st.text(f"Unknown command: {name.lower()}. Type /help for available commands.")
             return
-            
-        command = parts[0].lower()
-        
-        # Process different commands
-        if command == "/help":
-            show_help()
-            show_command_suggestions()
-        elif command == "/listrooms":
-            list_rooms()
-        elif command == "/join" and len(parts) > 1:
-            join_room(parts[1])
-        elif command == "/users":
-            list_users()
-        elif command == "/dm" and len(parts) > 1:
-            start_dm(parts[1])
-        elif command == "/exit":
-            exit_room_or_dm()
-        elif command == "/logout":
-            logout()
-        elif command == "/quit":
-            st.text("Goodbye! Thanks for using TCA v2.0.")
-            st.session_state.logged_in = False
-            st.session_state.user_data = None
-            st.session_state.current_room = None
-            st.session_state.direct_message_target = None
-            st.session_state.messages = []
-            st.session_state.rooms = []
-            st.experimental_rerun()
-        elif command == "/changepass" and len(parts) > 1:
-            change_password(parts[1])
-        elif command == "/resetpass" and len(parts) > 3:
-            reset_password(parts[1], parts[2], parts[3])
-        elif command == "/adduser" and len(parts) > 3 and st.session_state.user_data.get('role') == 'admin':
-            add_user(parts[1], parts[2], parts[3])
-        elif command == "/addmultipleusers" and len(parts) > 2 and st.session_state.user_data.get('role') == 'admin':
-            # Parse users data from command (format: username1:password1,username2:password2,...)
-            users_str = parts[1]
-            security_key = parts[2]
-            users_list = users_str.split(',')
-            users_data = []
-            for user_pair in users_list:
-                if ':' in user_pair:
-                    username, password = user_pair.split(':', 1)
-                    users_data.append({"username": username, "password": password})
-            add_multiple_users(users_data, security_key)
-        elif command == "/createroom" and len(parts) > 2 and st.session_state.user_data.get('role') == 'admin':
-            create_room(parts[1], parts[2])
-        elif command == "/deleteroom" and len(parts) > 2 and st.session_state.user_data.get('role') == 'admin':
-            delete_room(parts[1], parts[2])
-        elif command == "/deletemessage" and len(parts) > 2 and st.session_state.user_data.get('role') == 'admin':
-            delete_message(parts[1], parts[2])
-        elif command == "/cleanup" and len(parts) > 1 and st.session_state.user_data.get('role') == 'admin':
-            cleanup_old_messages(parts[1])
-        elif command == "/giveaccess" and len(parts) > 3 and st.session_state.user_data.get('role') == 'admin':
-            # Parse users list (comma separated)
-            give_access(parts[1], parts[2], parts[3])
-        else:
-            st.text(f"Unknown command: {command}. Type /help for available commands.")
+        try:
+            args = command.parse(arguments)
+        except CommandUsageError as e:
+            st.text(f"Error: {e}")
+            return
+        COMMAND_HANDLERS[command.name](*args)
     else:
         # Treat as regular message if not a recognized command
         send_regular_message(command_str)
 
+@st.fragment
 def admin_panel():
-    """Display simplified admin panel for user and room management."""
+    """Display simplified admin panel for user and room management.
+    
+    The panel is a fragment, so its forms rerun only the panel and chat
+    activity doesn't rebuild it.
+    """
     st.title("Admin Panel")
     
     # User management section
@@ -482,9 +856,10 @@ def admin_panel():
                     users_data.append({"username": username.strip(), "password": password.strip()})
             
             if users_data:
-                results = db_manager.create_multiple_users(users_data, "user")
                 st.write("Batch user creation results:")
-                for username, success in results.items():
+                progress = st.progress(0.0)
+                for username, success, completed, total in db_manager.create_multiple_users_iter(users_data, "user"):
+                    progress.progress(completed / total, text=f"{completed}/{total} processed")
                     if success:
                         st.success(f"✓ User '{username}' created successfully.")
                     else:
@@ -502,11 +877,11 @@ def admin_panel():
         create_room_button = st.form_submit_button("Create Room")
         
         if create_room_button and room_name:
-            allowed_users = [st.session_state.user_data['username']] if not is_public else []
+            allowed_users = [st.session_state.user_data.username] if not is_public else []
             if db_manager.create_room(room_name, allowed_users, is_public):
                 st.success(f"Room {room_name} created successfully!")
                 # Refresh rooms list
-                st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data['username'])
+                st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data.username)
             else:
                 st.error("Failed to create room. Room name may already exist.")
     
@@ -520,24 +895,93 @@ def admin_panel():
             if db_manager.delete_room(room_to_delete):
                 st.success(f"Room {room_to_delete} deleted successfully!")
                 # Refresh rooms list
-                st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data['username'])
+                st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data.username)
+            elif room_to_delete in db_manager.retention.pending_rooms():
+                st.warning(f"Room {room_to_delete} deleted; removing its messages is pending until cleanup resumes.")
+                st.session_state.rooms = db_manager.get_user_rooms(st.session_state.user_data.username)
             else:
                 st.error(f"Failed to delete room {room_to_delete}.")
     
     # Database management section
     st.header("Database Management")
     
-    st.info("Automatic message cleanup runs daily to remove messages older than 3 days.")
+    if maintenance_scheduler is not None:
+        st.info("Automatic message cleanup runs periodically to remove messages older than 3 days"
+                + (", archiving them first." if db_manager.archive is not None else "."))
+        st.dataframe(maintenance_scheduler.status(), hide_index=True)
+    else:
+        st.warning("Automatic maintenance is disabled (MAINTENANCE_ENABLED).")
     
     if st.button("Run Manual Cleanup Now"):
         deleted_count = db_manager.cleanup_old_messages()
         st.success(f"Manual cleanup completed. {deleted_count} old messages deleted.")
+    
+    retention_status = db_manager.retention.status()
+    if retention_status["paused"]:
+        st.warning("Message cleanup is paused. Unfinished purges resume from their checkpoint.")
+        if st.button("Resume Cleanup"):
+            db_manager.resume_cleanup()
+    elif st.button("Pause Cleanup"):
+        db_manager.retention.pause()
+    if retention_status["pending"]:
+        st.caption("Unfinished purges:")
+        st.json(retention_status["pending"])
+    if db_manager.archive is not None:
+        st.caption("Message archive:")
+        st.json(db_manager.archive.stats())
+    
+    if db_manager.auth_admission is not None:
+        st.subheader("Authentication Load")
+        st.json(db_manager.auth_admission.metrics())
+    
+    if isinstance(db_manager.backend, ResilientBackend):
+        st.subheader("Storage Health")
+        st.json(db_manager.backend.stats())
+    if STARTUP_METRICS:
+        st.caption(f"Startup timings (ms): {STARTUP_METRICS}")
+    
+    if db_manager.broker is not None:
+        st.subheader("Live Delivery")
+        st.json(db_manager.broker.stats())
+    st.caption(f"Presence: {presence.stats()}")
+    
+    st.subheader("Operation Latency")
+    st.dataframe(metrics.summary(), hide_index=True)
+    
+    st.subheader("Session Memory")
+    totals = session_registry.totals()
+    st.caption(f"{totals['sessions']} live sessions holding {totals['messages']} messages (~{totals['kb']} KB)")
+    st.dataframe(session_registry.heaviest(), hide_index=True)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS or None)
+def message_pane():
+    """Message pane that reruns on its own and fetches only when its channel has new messages."""
+    if not st.session_state.logged_in:
+        return
+    send_heartbeat()
+    subscription = st.session_state.subscription
+    if subscription is not None and subscription.has_new():
+        subscription.mark_seen()
+        refresh_messages()
+    
+    # Display messages in terminal format, as one preformatted block
+    if st.session_state.messages:
+        with metrics.timed("app.render"):
+            block = st.session_state.renderer.render(st.session_state.messages)
+        st.text(block)
+    else:
+        st.text("System: Welcome to TCA v2.0!")
+        st.text("Type /help for available commands or start chatting!")
+    for failure in list(st.session_state.failed_sends):
+        st.text(failure)
 
 def terminal_interface():
     """Display the main terminal interface."""
     # Header
-    st.title(f"TCA v2.0 - User: {st.session_state.user_data['username']}")
-    if st.session_state.user_data.get('role') == 'admin':
+    st.session_state.session_memory.touch(st.session_state.user_data.username)
+    send_heartbeat()
+    st.title(f"TCA v2.0 - User: {st.session_state.user_data.username}")
+    if st.session_state.user_data.is_admin:
         st.caption("🛡️ Administrator Mode")
     
     # Display current context
@@ -548,17 +992,32 @@ def terminal_interface():
     else:
         st.caption("💬 Lobby - Not in any room or DM")
     
-    # Display messages in terminal format
-    message_container = st.container()
+    # Pull rooms, the DM inbox and only the messages newer than the last one
+    # this session has seen, concurrently
+    subscription = sync_subscription()
+    if subscription is not None:
+        subscription.mark_seen()
+    with metrics.timed("app.fetch"):
+        fetch_rerun_data()
+    if not st.session_state.current_room and not st.session_state.direct_message_target:
+        partners = recent_dm_partners()
+        if partners:
+            st.caption(f"📨 Recent DMs: {', '.join(partners)}")
+        busiest = ", ".join(f"{room} ({count})" for room, count in room_occupancy()[:5])
+        st.caption(f"👥 Online: {presence.online_count()}" + (f" · {busiest}" if busiest else ""))
     
-    with message_container:
-        if st.session_state.messages:
-            for message in st.session_state.messages:
-                st.text(f"[{message['timestamp']}] {message['username']}: {message['content']}")
-        else:
-            st.text("System: Welcome to TCA v2.0!")
-            st.text("Type /help for available commands or start chatting!")
+    message_pane()
+    command_prompt()
+
+@st.fragment
+def command_prompt():
+    """Command suggestions and input; submitting a command reruns only this fragment.
     
+    Chat lines and most commands only touch the session buffer, which the
+    message pane picks up on its next tick. Commands that switch the room or
+    DM rerun the whole page so the header, inbox and subscription follow;
+    their confirmations are shown again on that run.
+    """
     # Show contextual command suggestions
     show_command_suggestions()
     
@@ -568,7 +1027,17 @@ def terminal_interface():
         submit_button = st.form_submit_button("Send")
         
         if submit_button and command_input.strip():
-            process_command(command_input.strip())
+            st.session_state.failed_sends.clear()
+            context = (st.session_state.current_room, st.session_state.direct_message_target)
+            with metrics.timed("app.command"):
+                process_command(command_input.strip())
+            if (st.session_state.current_room, st.session_state.direct_message_target) != context:
+                st.rerun()
+            st.session_state.pending_notices = []
+        else:
+            for text in st.session_state.pending_notices:
+                st.text(text)
+            st.session_state.pending_notices = []
 
 def main():
     """Main application function."""
@@ -626,7 +1095,7 @@ def main():
         login_page()
     else:
         # Show admin panel for admin users only
-        if st.session_state.user_data.get('role') == 'admin':
+        if st.session_state.user_data.is_admin:
             # Single page with all admin functions
             admin_panel()
             st.markdown("---")
@@ -0,0 +1,145 @@
+import heapq
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from config import get_int_setting, get_setting
+
+# Index record of one block: first id, last id, byte offset and length in its day's segment, and the day
+INDEX_RECORD = struct.Struct("<qqQI10s")
+
+# Name of the per-partition index file
+INDEX_FILE = "blocks.idx"
+
+# Column each archived table is partitioned by, next to the day
+PARTITION_COLUMNS = {"messages": "room", "direct_messages": "conversation"}
+
+class MessageArchive:
+    """Append-only, compressed store of expired messages, partitioned by room (or conversation) and day.
+
+    Each partition keeps one segment file per day holding zlib-compressed
+    NDJSON blocks, one block per archived batch, and a single index file
+    with a fixed-size (first id, last id, offset, length, day) record per
+    block. A read memory-maps only that index, uses the id ranges to pick
+    the few blocks that can hold the requested ids and decompresses just
+    those, sliced out of their memory-mapped day segments, so its cost
+    doesn't grow with the number of days kept. A block is synced before its
+    index record is appended, so a crash never leaves a record pointing at
+    missing data; a batch archived again after a crash is deduplicated by
+    id on read. Archived rows are read by id only; they are not full-text
+    searchable.
+    """
+
+    def __init__(self, root: str, level: int = 6):
+        self.root = root
+        self.level = level
+        self.lock = threading.Lock()
+        self.counters = {"rows_written": 0, "blocks_written": 0, "bytes_written": 0, "blocks_read": 0}
+
+    def _partition_dir(self, table: str, partition: str) -> str:
+        # Escape dots too, so no partition name can point outside the table directory
+        return os.path.join(self.root, table, quote(partition, safe="").replace(".", "%2E"))
+
+    def append(self, table: str, rows: List[Dict]) -> int:
+        """Archive rows of table (oldest first), one block per partition and day; returns the rows written."""
+        column = PARTITION_COLUMNS[table]
+        groups: Dict[Tuple[str, str], List[Dict]] = {}
+        for row in rows:
+            day = str(row.get("timestamp") or "")[:10] or "undated"
+            groups.setdefault((row[column], day), []).append(row)
+        with self.lock:
+            for (partition, day), group in groups.items():
+                self._write_block(self._partition_dir(table, partition), day, group)
+        return len(rows)
+
+    def _write_block(self, directory: str, day: str, rows: List[Dict]) -> None:
+        os.makedirs(directory, exist_ok=True)
+        ndjson = "".join(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n" for row in rows)
+        block = zlib.compress(ndjson.encode("utf-8"), self.level)
+        with open(os.path.join(directory, f"{day}.seg"), "ab") as segment:
+            offset = segment.seek(0, os.SEEK_END)
+            segment.write(block)
+            segment.flush()
+            os.fsync(segment.fileno())
+        ids = [row["id"] for row in rows]
+        with open(os.path.join(directory, INDEX_FILE), "ab") as index:
+            index.write(INDEX_RECORD.pack(min(ids), max(ids), offset, len(block), day.encode("ascii")))
+            index.flush()
+            os.fsync(index.fileno())
+        self.counters["rows_written"] += len(rows)
+        self.counters["blocks_written"] += 1
+        self.counters["bytes_written"] += len(block)
+
+    @staticmethod
+    def _blocks(directory: str, before_id: Optional[int]) -> List[Tuple[int, int, int, int, str]]:
+        """(first id, last id, offset, length, day) of every block that may hold ids below before_id, newest first."""
+        try:
+            f = open(os.path.join(directory, INDEX_FILE), "rb")
+        except FileNotFoundError:
+            return []
+        blocks = []
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size < INDEX_RECORD.size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                for first_id, last_id, offset, length, day in INDEX_RECORD.iter_unpack(
+                        index[:size - size % INDEX_RECORD.size]):
+                    if before_id is None or first_id < before_id:
+                        blocks.append((first_id, last_id, offset, length, day.rstrip(b"\0").decode("ascii")))
+        return sorted(blocks, key=lambda block: block[1], reverse=True)
+
+    def read_before(self, table: str, partition: str, before_id: Optional[int], limit: int) -> List[Dict]:
+        """Return up to limit archived rows of a partition with id below before_id, newest first."""
+        directory = self._partition_dir(table, partition)
+        found: Dict[int, Dict] = {}
+        segments = {}
+        try:
+            for _, last_id, offset, length, day in self._blocks(directory, before_id):
+                if len(found) >= limit and last_id < heapq.nlargest(limit, found)[-1]:
+                    # Every remaining block ends below the oldest row already in the page
+                    break
+                if day not in segments:
+                    with open(os.path.join(directory, f"{day}.seg"), "rb") as f:
+                        segments[day] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                ndjson = zlib.decompress(segments[day][offset:offset + length]).decode("utf-8")
+                self.counters["blocks_read"] += 1
+                for line in ndjson.splitlines():
+                    row = json.loads(line)
+                    if before_id is None or row["id"] < before_id:
+                        found[row["id"]] = row
+        finally:
+            for segment in segments.values():
+                segment.close()
+        return [found[row_id] for row_id in sorted(found, reverse=True)[:limit]]
+
+    def retire(self, table: str, partition: str) -> None:
+        """Keep a deleted partition's archive under <root>/deleted, out of reach of a new partition of that name."""
+        directory = self._partition_dir(table, partition)
+        retired = os.path.join(self.root, "deleted", table, os.path.basename(directory), str(time.time_ns()))
+        with self.lock:
+            if os.path.isdir(directory):
+                os.makedirs(os.path.dirname(retired), exist_ok=True)
+                os.replace(directory, retired)
+
+    def drop(self, table: str, partition: str) -> None:
+        """Remove everything archived for a partition."""
+        with self.lock:
+            shutil.rmtree(self._partition_dir(table, partition), ignore_errors=True)
+
+    def stats(self) -> Dict:
+        return dict(self.counters, root=self.root)
+
+def create_archive() -> Optional[MessageArchive]:
+    """Build the message archive if ARCHIVE_PATH is set; without one expired messages are simply deleted."""
+    path = get_setting("ARCHIVE_PATH")
+    if not path:
+        return None
+    return MessageArchive(path, level=get_int_setting("ARCHIVE_COMPRESSION_LEVEL", 6))
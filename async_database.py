@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import streamlit as st
+
+from config import get_float_setting, get_int_setting
+from database import DatabaseManager
+from models import Message
+
+class EventLoopThread:
+    """An asyncio event loop running on its own daemon thread, shared by all sessions."""
+
+    def __init__(self, max_workers: int = 16):
+        self.loop = asyncio.new_event_loop()
+        # Blocking backend calls run here so independent reads overlap
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-read"))
+        self.thread = threading.Thread(target=self.loop.run_forever, name="db-event-loop", daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the loop from a synchronous caller and return its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+class AsyncDatabaseManager:
+    """Async variant of the DatabaseManager read API.
+
+    Each method awaits the matching DatabaseManager call on the loop's
+    executor, so the timeline cache, room access index and the rest of the
+    synchronous layer keep serving every read.
+    """
+
+    def __init__(self, manager: DatabaseManager):
+        self.manager = manager
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: method(*args, **kwargs))
+
+    async def get_user_rooms(self, username: str) -> List[str]:
+        return await self._call(self.manager.get_user_rooms, username)
+
+    async def get_room_messages(self, room_name: str, limit: int = 50, before_id: Optional[int] = None) -> List[Message]:
+        return await self._call(self.manager.get_room_messages, room_name, limit, before_id)
+
+    async def get_room_messages_since(self, room_name: str, after_id: Optional[int] = None, limit: int = 100) -> List[Message]:
+        return await self._call(self.manager.get_room_messages_since, room_name, after_id, limit)
+
+    async def get_direct_messages(self, user1: str, user2: str, limit: int = 50, before_id: Optional[int] = None) -> List[Message]:
+        return await self._call(self.manager.get_direct_messages, user1, user2, limit, before_id)
+
+    async def get_direct_messages_since(self, user1: str, user2: str, after_id: Optional[int] = None, limit: int = 100) -> List[Message]:
+        return await self._call(self.manager.get_direct_messages_since, user1, user2, after_id, limit)
+
+    async def get_dm_inbox(self, username: str, limit: int = 20) -> List[Message]:
+        return await self._call(self.manager.get_dm_inbox, username, limit)
+
+    async def fetch_rerun_data(self, username: str, room: Optional[str], dm_target: Optional[str],
+                               after_id: Optional[int], inbox_limit: int = 20) -> Dict:
+        """Fetch the room list, new messages and DM inbox of a rerun concurrently."""
+        if room:
+            messages = self.get_room_messages_since(room, after_id)
+        elif dm_target:
+            messages = self.get_direct_messages_since(username, dm_target, after_id)
+        else:
+            messages = asyncio.sleep(0, result=[])
+        rooms, new_messages, inbox = await asyncio.gather(
+            self.get_user_rooms(username),
+            messages,
+            self.get_dm_inbox(username, inbox_limit)
+        )
+        return {"rooms": rooms, "messages": new_messages, "inbox": inbox}
+
+class ConcurrentReader:
+    """Synchronous façade that app.py calls once per rerun.
+
+    The independent reads of a rerun run concurrently on the shared event
+    loop thread, so the rerun waits for the slowest query rather than the
+    sum of all of them.
+    """
+
+    def __init__(self, manager: DatabaseManager, loop_thread: EventLoopThread, timeout: float = 10.0):
+        self.async_manager = AsyncDatabaseManager(manager)
+        self.loop_thread = loop_thread
+        self.timeout = timeout
+
+    def fetch_rerun_data(self, username: str, room: Optional[str], dm_target: Optional[str],
+                         after_id: Optional[int]) -> Dict:
+        return self.loop_thread.run(
+            self.async_manager.fetch_rerun_data(username, room, dm_target, after_id),
+            self.timeout
+        )
+
+@st.cache_resource
+def get_event_loop_thread() -> EventLoopThread:
+    """Return the event loop thread shared by all sessions of this server process."""
+    return EventLoopThread(max_workers=get_int_setting("DB_READ_WORKERS", 16))
+
+def create_concurrent_reader(manager: DatabaseManager) -> ConcurrentReader:
+    """Build the per-rerun concurrent reader on top of the shared event loop."""
+    return ConcurrentReader(manager, get_event_loop_thread(), get_float_setting("DB_READ_TIMEOUT_SECONDS", 10.0))
@@ -0,0 +1,469 @@
+"""Load generator and benchmark for the chat hot paths.
+
+Simulates concurrent users logging in, joining rooms, sending messages,
+polling and sending DMs against an embedded SQLite backend, then reports
+throughput, latency percentiles and memory per operation and saves the
+results as JSON so runs can be compared:
+
+    python benchmark.py --users 50 --duration 30 --mix login=1,join=1,send=5,poll=10,dm=2
+    python benchmark.py --mode app --users 10 --duration 20
+    python benchmark.py --compare baseline.json --output current.json
+
+The "manager" mode calls DatabaseManager (and the concurrent per-rerun
+reader) from one thread per user, as app.py does. The "app" mode runs
+app.py itself through Streamlit's AppTest harness, so every operation
+includes command dispatch and rendering; the harness can't run scripts in
+parallel, so its reruns are serialized and its latencies are service times.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+OPERATIONS = ("login", "join", "send", "poll", "dm")
+DEFAULT_MIX = "login=1,join=1,send=5,poll=10,dm=2"
+PASSWORD = "bench-password"
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# AppTest keeps one global Streamlit runtime, so only one script run at a time
+APP_RUN_LOCK = threading.Lock()
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse "op=weight,..." into operation weights."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}' (expected one of {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("The operation mix needs at least one positive weight")
+    return mix
+
+class OperationFailed(Exception):
+    """An operation completed but did not do what it was asked to."""
+
+class SimulatedUser:
+    """One simulated user; each operation times only its measured part."""
+
+    def __init__(self, username: str, rooms: List[str], peers: List[str], rng: random.Random):
+        self.username = username
+        self.rooms = rooms
+        self.peers = peers
+        self.rng = rng
+        self.elapsed = 0.0
+        self.waited = 0.0
+        self.sent = 0
+
+    @contextmanager
+    def measure(self):
+        """Time a block, leaving out time spent queued for the shared app runner."""
+        started, waited = time.perf_counter(), self.waited
+        try:
+            yield
+        finally:
+            self.elapsed = time.perf_counter() - started - (self.waited - waited)
+
+    def next_text(self) -> str:
+        self.sent += 1
+        return f"{self.username} message {self.sent}"
+
+    def run(self, operation: str) -> None:
+        getattr(self, operation)()
+
+class ManagerUser(SimulatedUser):
+    """Calls DatabaseManager the way app.py does for each user action."""
+
+    def __init__(self, manager, reader, username: str, rooms: List[str], peers: List[str], rng: random.Random):
+        super().__init__(username, rooms, peers, rng)
+        self.manager = manager
+        self.reader = reader
+        self.room: Optional[str] = None
+        self.dm_target: Optional[str] = None
+        self.last_message_id: Optional[int] = None
+
+    def _merge(self, messages) -> None:
+        for message in messages:
+            if self.last_message_id is None or message.id > self.last_message_id:
+                self.last_message_id = message.id
+
+    def login(self) -> None:
+        with self.measure():
+            user = self.manager.authenticate_user(self.username, PASSWORD, f"bench-{self.username}")
+            if user is None:
+                raise OperationFailed("authentication failed")
+            self.manager.get_user_rooms(self.username)
+
+    def join(self) -> None:
+        room = self.rng.choice(self.rooms)
+        with self.measure():
+            if not self.manager.has_room_access(self.username, room):
+                raise OperationFailed(f"no access to {room}")
+            self.room, self.dm_target, self.last_message_id = room, None, None
+            self._merge(self.manager.get_room_messages_since(room, None))
+
+    def send(self) -> None:
+        if self.room is None:
+            self.join()
+        text = self.next_text()
+        with self.measure():
+            if not self.manager.save_message(self.room, self.username, text):
+                raise OperationFailed("message not stored")
+
+    def poll(self) -> None:
+        with self.measure():
+            data = self.reader.fetch_rerun_data(self.username, self.room, self.dm_target, self.last_message_id)
+            self._merge(data["messages"])
+
+    def dm(self) -> None:
+        peer = self.rng.choice(self.peers)
+        text = self.next_text()
+        with self.measure():
+            if not self.manager.save_direct_message(self.username, peer, text):
+                raise OperationFailed("direct message not stored")
+            self.manager.get_direct_messages_since(self.username, peer, None)
+
+class AppUser(SimulatedUser):
+    """Drives app.py through Streamlit's AppTest harness, like one browser session."""
+
+    def __init__(self, username: str, rooms: List[str], peers: List[str], rng: random.Random, timeout: float):
+        super().__init__(username, rooms, peers, rng)
+        from streamlit.testing.v1 import AppTest
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self._rerun()
+
+    def _rerun(self) -> None:
+        queued = time.perf_counter()
+        with APP_RUN_LOCK:
+            self.waited += time.perf_counter() - queued
+            self.app.run()
+        if self.app.exception:
+            raise OperationFailed(self.app.exception[0].message)
+
+    def _click(self, label: str) -> None:
+        buttons = [button for button in self.app.button if button.label == label]
+        if not buttons:
+            raise OperationFailed(f"no '{label}' button on the page")
+        buttons[0].click()
+        self._rerun()
+
+    def _command(self, text: str) -> None:
+        inputs = [field for field in self.app.text_input if field.key == "command_input"]
+        if not inputs:
+            raise OperationFailed("not logged in")
+        inputs[0].input(text)
+        self._click("Send")
+
+    def _state(self, key: str):
+        return self.app.session_state[key] if key in self.app.session_state else None
+
+    def login(self) -> None:
+        if self._state("logged_in"):
+            self._command("/logout")
+        self.app.text_input[0].input(self.username)
+        self.app.text_input[1].input(PASSWORD)
+        with self.measure():
+            self._click("Login")
+            if not self._state("logged_in"):
+                raise OperationFailed("authentication failed")
+
+    def join(self) -> None:
+        room = self.rng.choice(self.rooms)
+        with self.measure():
+            self._command(f"/join {room}")
+            if self._state("current_room") != room:
+                raise OperationFailed(f"could not join {room}")
+
+    def send(self) -> None:
+        if not self._state("current_room"):
+            self.join()
+        text = self.next_text()
+        with self.measure():
+            self._command(text)
+
+    def poll(self) -> None:
+        with self.measure():
+            self._rerun()
+
+    def dm(self) -> None:
+        peer = self.rng.choice(self.peers)
+        text = self.next_text()
+        with self.measure():
+            self._command(f"/dm {peer}")
+            self._command(text)
+
+class OperationStats:
+    """Latencies and outcomes of one operation type."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+
+    def summary(self, elapsed: float) -> Dict:
+        from metrics import percentile
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "throughput_per_s": round(count / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(ordered) / count * 1000, 3) if count else 0.0,
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3) if count else 0.0,
+            "last_error": self.last_error
+        }
+
+class Benchmark:
+    """Seeds a fresh SQLite store, runs the simulated users and collects results."""
+
+    def __init__(self, args):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.stats = {name: OperationStats() for name in self.mix}
+        self.lock = threading.Lock()
+        self.usernames = [f"bench{index:04d}" for index in range(args.users)]
+        self.rooms = [f"bench-room-{index}" for index in range(args.rooms)]
+
+    def setup(self) -> None:
+        import database
+        database.BCRYPT_ROUNDS = self.args.bcrypt_rounds
+        self.manager = database.get_db_manager()
+        results = self.manager.create_multiple_users([
+            {"username": username, "password": PASSWORD} for username in self.usernames
+        ])
+        if not all(results.values()):
+            raise RuntimeError("Could not create the benchmark users")
+        for room in self.rooms:
+            self.manager.create_room(room, [], True)
+            for index in range(self.args.seed_messages):
+                # Waiting on the last one lets the write-behind queue drain before the run
+                self.manager.save_message(room, self.usernames[index % len(self.usernames)], f"seed {index}",
+                                          wait=index == self.args.seed_messages - 1)
+
+    def make_user(self, index: int) -> SimulatedUser:
+        username = self.usernames[index]
+        peers = [name for name in self.usernames if name != username] or [username]
+        rng = random.Random(self.args.seed + index)
+        if self.args.mode == "app":
+            user = AppUser(username, self.rooms, peers, rng, self.args.app_timeout)
+        else:
+            from async_database import create_concurrent_reader
+            user = ManagerUser(self.manager, create_concurrent_reader(self.manager), username, self.rooms, peers, rng)
+        user.login()
+        return user
+
+    def record(self, operation: str, seconds: Optional[float], error: Optional[Exception] = None) -> None:
+        from admission import AuthRejected
+        with self.lock:
+            stats = self.stats[operation]
+            if error is None:
+                stats.latencies.append(seconds)
+            elif isinstance(error, AuthRejected):
+                stats.rejected += 1
+            else:
+                stats.errors += 1
+                stats.last_error = str(error)
+
+    def run_user(self, user: SimulatedUser, deadline: float, start: threading.Barrier) -> None:
+        operations = list(self.mix)
+        weights = [self.mix[name] for name in operations]
+        start.wait()
+        performed = 0
+        while time.perf_counter() < deadline and (not self.args.operations or performed < self.args.operations):
+            operation = user.rng.choices(operations, weights)[0]
+            try:
+                user.run(operation)
+            except Exception as e:
+                self.record(operation, None, e)
+            else:
+                self.record(operation, user.elapsed)
+            performed += 1
+            if self.args.think_ms:
+                time.sleep(user.rng.uniform(0, 2 * self.args.think_ms) / 1000)
+
+    def run_load(self) -> float:
+        users = [self.make_user(index) for index in range(self.args.users)]
+        start = threading.Barrier(len(users) + 1)
+        deadline = time.perf_counter() + self.args.warmup + self.args.duration
+        threads = [
+            threading.Thread(target=self.run_user, args=(user, deadline, start), name=f"bench-{user.username}")
+            for user in users
+        ]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        if self.args.warmup:
+            time.sleep(self.args.warmup)
+            with self.lock:
+                self.stats = {name: OperationStats() for name in self.mix}
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        self.users = users
+        return time.perf_counter() - started
+
+    def measure_memory(self) -> Dict[str, Dict]:
+        """Allocation per operation, measured sequentially on one user under tracemalloc."""
+        if not self.args.memory_samples:
+            return {}
+        user = self.users[0]
+        memory = {}
+        tracemalloc.start()
+        try:
+            for operation in self.mix:
+                peaks, retained = [], 0
+                baseline = tracemalloc.get_traced_memory()[0]
+                for _ in range(self.args.memory_samples):
+                    before = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    try:
+                        user.run(operation)
+                    except Exception:
+                        continue
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+                retained = tracemalloc.get_traced_memory()[0] - baseline
+                memory[operation] = {
+                    "peak_alloc_kb": round(sum(peaks) / len(peaks) / 1024, 2) if peaks else None,
+                    "retained_kb": round(retained / max(1, len(peaks)) / 1024, 3) if peaks else None
+                }
+        finally:
+            tracemalloc.stop()
+        return memory
+
+    def run(self) -> Dict:
+        setup_started = time.perf_counter()
+        self.setup()
+        setup_seconds = time.perf_counter() - setup_started
+        elapsed = self.run_load()
+        operations = {name: stats.summary(elapsed) for name, stats in self.stats.items()}
+        for name, usage in self.measure_memory().items():
+            operations[name].update(usage)
+        total = sum(summary["count"] for summary in operations.values())
+        from metrics import get_metrics
+        return {
+            "started_at": datetime.utcnow().isoformat(),
+            "config": dict(vars(self.args), mix=self.mix),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "backend": self.manager.backend.name
+            },
+            "setup_seconds": round(setup_seconds, 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "total": {
+                "count": total,
+                "errors": sum(summary["errors"] for summary in operations.values()),
+                "throughput_per_s": round(total / elapsed, 2) if elapsed else 0.0,
+                "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            },
+            "operations": operations,
+            # Per-layer breakdown from the app's own instrumentation (db.*, backend.*, app.*)
+            "layers": get_metrics().summary()
+        }
+
+def print_report(results: Dict) -> None:
+    print(f"\n{results['config']['mode']} mode, {results['config']['users']} users, "
+          f"{results['elapsed_seconds']} s on {results['environment']['backend']}")
+    print(f"{'operation':<8} {'count':>7} {'err':>5} {'rej':>5} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'peak KB':>8} {'kept KB':>8}")
+    for name, summary in results["operations"].items():
+        print(f"{name:<8} {summary['count']:>7} {summary['errors']:>5} {summary['rejected']:>5} "
+              f"{summary['throughput_per_s']:>9} {summary['p50_ms']:>9} {summary['p99_ms']:>9} "
+              f"{str(summary.get('peak_alloc_kb', '-')):>8} {str(summary.get('retained_kb', '-')):>8}")
+        if summary["last_error"]:
+            print(f"         last error: {summary['last_error']}")
+    total = results["total"]
+    print(f"{'total':<8} {total['count']:>7} {total['errors']:>5} {'':>5} {total['throughput_per_s']:>9}   "
+          f"max RSS {round(total['max_rss_kb'] / 1024, 1)} MB")
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Print per-operation changes against a baseline run; return the regressions beyond threshold."""
+    regressions = []
+    print(f"\nAgainst baseline from {baseline.get('started_at')}:")
+    if baseline.get("config", {}).get("mode") != results["config"]["mode"]:
+        print(f"  (baseline ran in {baseline.get('config', {}).get('mode')} mode; figures are not comparable)")
+    for name, summary in results["operations"].items():
+        before = baseline.get("operations", {}).get(name)
+        if not before or not before["count"] or not summary["count"]:
+            continue
+        p99_change = (summary["p99_ms"] - before["p99_ms"]) / before["p99_ms"] if before["p99_ms"] else 0.0
+        throughput_change = ((summary["throughput_per_s"] - before["throughput_per_s"]) / before["throughput_per_s"]
+                             if before["throughput_per_s"] else 0.0)
+        print(f"  {name:<8} p99 {before['p99_ms']} -> {summary['p99_ms']} ms ({p99_change:+.0%}), "
+              f"throughput {before['throughput_per_s']} -> {summary['throughput_per_s']}/s ({throughput_change:+.0%})")
+        if p99_change > threshold:
+            regressions.append(f"{name} p99 {p99_change:+.0%}")
+        if -throughput_change > threshold:
+            regressions.append(f"{name} throughput {throughput_change:+.0%}")
+    return regressions
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the TCA chat hot paths against an embedded SQLite store.")
+    parser.add_argument("--mode", choices=("manager", "app"), default="manager",
+                        help="call DatabaseManager directly, or drive app.py through AppTest")
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--rooms", type=int, default=5, help="public rooms to spread users over")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before measuring")
+    parser.add_argument("--operations", type=int, default=0, help="stop each user after this many operations")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a user's operations")
+    parser.add_argument("--seed-messages", type=int, default=200, help="messages stored per room before the run")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="bcrypt cost for the benchmark users")
+    parser.add_argument("--memory-samples", type=int, default=20,
+                        help="operations per type measured under tracemalloc after the run (0 to skip)")
+    parser.add_argument("--sqlite-path", default=":memory:", help="SQLite database file (default in memory)")
+    parser.add_argument("--app-timeout", type=float, default=30.0, help="seconds allowed per app rerun")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to save the JSON results")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative p99/throughput change counted as a regression (default 0.2)")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # Settings are read on first use, so they must be in place before the app modules build anything
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = args.sqlite_path
+    os.environ.setdefault("MAINTENANCE_ENABLED", "false")
+    os.environ.setdefault("BROKER_BACKEND", "memory")
+    # Simulated users log in far more often than people do; unless these are set
+    # explicitly, lift the per-user/per-client login rate limits so login latency
+    # measures hashing and admission slots rather than rejections
+    for name, value in (("AUTH_USER_RATE_PER_MINUTE", "100000"), ("AUTH_USER_BURST", "100000"),
+                        ("AUTH_CLIENT_RATE_PER_MINUTE", "100000"), ("AUTH_CLIENT_BURST", "100000")):
+        os.environ.setdefault(name, value)
+
+    results = Benchmark(args).run()
+    print_report(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
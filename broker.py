@@ -0,0 +1,229 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import streamlit as st
+
+from config import get_setting
+from models import Message
+
+NOTIFY_CHANNEL = "tca_messages"
+
+def room_channel(room_name: str) -> str:
+    return f"room:{room_name}"
+
+def conversation_channel(conversation: str) -> str:
+    return f"dm:{conversation}"
+
+def message_channel(message: Message) -> str:
+    """The channel a stored message is published on."""
+    if message.is_direct:
+        return conversation_channel(message.conversation)
+    return room_channel(message.room)
+
+class Subscription:
+    """One session's view of a channel: whether anything was published since it last looked."""
+
+    def __init__(self, broker: "MessageBroker", channel: str):
+        self.broker = broker
+        self.channel = channel
+        self.seen = broker.version(channel)
+
+    def has_new(self) -> bool:
+        return self.broker.version(self.channel) != self.seen
+
+    def mark_seen(self) -> None:
+        """Acknowledge everything published so far; call before fetching so nothing slips past."""
+        self.seen = self.broker.version(self.channel)
+
+    def wait(self, timeout: float) -> bool:
+        """Block until something new is published or timeout passes; returns whether it was."""
+        return self.broker.wait(self.channel, self.seen, timeout)
+
+class MessageBroker:
+    """In-process publish/subscribe of "channel has new messages" notifications.
+
+    Publishing bumps a per-channel version number and wakes any waiters;
+    subscribers compare versions in memory, so checking for new messages
+    costs no database query. Messages themselves are still read through
+    DatabaseManager, which keeps cursors, caches and access checks in one
+    place.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self.versions: Dict[str, int] = {}
+        self.condition = threading.Condition()
+        self.published = 0
+        self.received = 0
+
+    def publish(self, channel: str, message_id: Optional[int] = None) -> None:
+        """Announce a newly stored message on a channel."""
+        with self.condition:
+            self.published += 1
+        self._deliver(channel)
+
+    def _deliver(self, channel: str) -> None:
+        with self.condition:
+            self.versions[channel] = self.versions.get(channel, 0) + 1
+            self.condition.notify_all()
+
+    def version(self, channel: str) -> int:
+        with self.condition:
+            return self.versions.get(channel, 0)
+
+    def wait(self, channel: str, seen: int, timeout: float) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: self.versions.get(channel, 0) != seen, timeout)
+
+    def subscribe(self, channel: str) -> Subscription:
+        return Subscription(self, channel)
+
+    def stats(self) -> Dict:
+        with self.condition:
+            return {"broker": self.name, "channels": len(self.versions),
+                    "published": self.published, "received": self.received}
+
+class PostgresNotifyBroker(MessageBroker):
+    """Fans notifications out to every server process through Postgres LISTEN/NOTIFY.
+
+    Publishing delivers locally right away and sends a NOTIFY; a listener
+    thread applies notifications from other processes. Needs the psycopg
+    package and a direct Postgres connection string.
+    """
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, reconnect_seconds: float = 5.0):
+        super().__init__()
+        import psycopg
+        self.psycopg = psycopg
+        self.dsn = dsn
+        self.reconnect_seconds = reconnect_seconds
+        self.publish_lock = threading.Lock()
+        self.publish_conn = None
+        # Tags our own notifications so the listener doesn't deliver them twice
+        self.origin = uuid.uuid4().hex[:8]
+        self.thread = threading.Thread(target=self._listen, name="broker-listen", daemon=True)
+        self.thread.start()
+
+    def publish(self, channel: str, message_id: Optional[int] = None) -> None:
+        super().publish(channel, message_id)
+        try:
+            with self.publish_lock:
+                if self.publish_conn is None or self.publish_conn.closed:
+                    self.publish_conn = self.psycopg.connect(self.dsn, autocommit=True)
+                self.publish_conn.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, f"{self.origin}|{channel}"))
+        except Exception as e:
+            print(f"Error publishing to {channel}: {e}")
+            self.publish_conn = None
+
+    def _listen(self):
+        while True:
+            try:
+                with self.psycopg.connect(self.dsn, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    for notify in conn.notifies():
+                        origin, _, channel = notify.payload.partition("|")
+                        if origin == self.origin:
+                            continue
+                        with self.condition:
+                            self.received += 1
+                        self._deliver(channel)
+            except Exception as e:
+                print(f"Broker listener error, reconnecting: {e}")
+            time.sleep(self.reconnect_seconds)
+
+class SupabaseRealtimeBroker(MessageBroker):
+    """Learns about messages stored by other server processes from Supabase Realtime.
+
+    Subscribes to INSERTs on messages and direct_messages (both tables must
+    be added to the supabase_realtime publication). Local publishes are
+    delivered directly; the inserts themselves reach the other processes.
+    The echo of a locally published insert is recognised by its message id
+    and skipped, so every send refreshes subscribers once.
+    """
+
+    name = "supabase_realtime"
+
+    def __init__(self, url: str, key: str, reconnect_seconds: float = 5.0, max_pending_echoes: int = 10000):
+        super().__init__()
+        self.url = url
+        self.key = key
+        self.reconnect_seconds = reconnect_seconds
+        # (channel, message id) of local publishes whose Realtime echo hasn't arrived yet, oldest first
+        self.pending_echoes: "OrderedDict[Tuple[str, int], None]" = OrderedDict()
+        self.max_pending_echoes = max_pending_echoes
+        self.echoes_skipped = 0
+        self.thread = threading.Thread(target=self._run, name="broker-realtime", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                asyncio.run(self._listen())
+            except Exception as e:
+                print(f"Realtime listener error, reconnecting: {e}")
+            time.sleep(self.reconnect_seconds)
+
+    def publish(self, channel: str, message_id: Optional[int] = None) -> None:
+        if message_id is not None:
+            with self.condition:
+                self.pending_echoes[(channel, message_id)] = None
+                if len(self.pending_echoes) > self.max_pending_echoes:
+                    # Echoes lost while the listener was down would otherwise pile up
+                    self.pending_echoes.popitem(last=False)
+        super().publish(channel, message_id)
+
+    async def _listen(self):
+        from supabase import acreate_client
+        client = await acreate_client(self.url, self.key)
+        channel = client.channel("tca-messages")
+        for table in ("messages", "direct_messages"):
+            channel.on_postgres_changes("INSERT", callback=self._on_insert, table=table, schema="public")
+        await channel.subscribe()
+        # The realtime client delivers changes on its own tasks; just keep the loop alive
+        await asyncio.Event().wait()
+
+    def _on_insert(self, payload: Dict):
+        record = payload.get("data", {}).get("record")
+        if not record:
+            return
+        channel = message_channel(Message.from_row(record))
+        with self.condition:
+            self.received += 1
+            if self.pending_echoes.pop((channel, record.get("id")), False) is None:
+                # Our own insert, already delivered when it was published
+                self.echoes_skipped += 1
+                return
+        self._deliver(channel)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self.condition:
+            stats["echoes_skipped"] = self.echoes_skipped
+        return stats
+
+def create_broker() -> MessageBroker:
+    """Build the broker selected by the BROKER_BACKEND setting."""
+    backend_name = str(get_setting("BROKER_BACKEND", "memory")).lower()
+    try:
+        if backend_name == "postgres":
+            return PostgresNotifyBroker(get_setting("BROKER_POSTGRES_DSN"))
+        if backend_name == "supabase_realtime":
+            return SupabaseRealtimeBroker(get_setting("SUPABASE_URL"), get_setting("SUPABASE_KEY"))
+    except Exception as e:
+        print(f"Error starting {backend_name} broker, falling back to in-process delivery: {e}")
+        return MessageBroker()
+    if backend_name != "memory":
+        print(f"Unknown broker backend '{backend_name}', using in-process delivery")
+    return MessageBroker()
+
+@st.cache_resource
+def get_broker() -> MessageBroker:
+    """Return the message broker shared by all sessions of this server process."""
+    return create_broker()
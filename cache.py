@@ -0,0 +1,293 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+import streamlit as st
+
+from config import get_float_setting, get_int_setting
+from models import Message, Room
+
+# Rough per-record overhead of a slotted Message on top of its string contents
+MESSAGE_OVERHEAD_BYTES = 120
+
+def estimate_message_bytes(message: Message) -> int:
+    """Approximate the memory held by one cached message."""
+    return (MESSAGE_OVERHEAD_BYTES + len(message.username) + len(message.content)
+            + len(message.timestamp or "") + len(message.room or ""))
+
+class RoomTimeline:
+    """Bounded ring buffer of the most recent messages of one room, oldest first."""
+
+    def __init__(self, capacity: int):
+        self.messages = deque(maxlen=capacity)
+        self.ids = set()
+        self.bytes = 0
+        # The buffer holds every message of the room with id > floor_id
+        self.floor_id = 0
+        self.synced_id = 0
+        self.last_refresh = 0.0
+        self.refresh_lock = threading.Lock()
+
+    def add(self, message: Message) -> None:
+        """Insert a message in id order, evicting the oldest one when full.
+
+        Ids at or below floor_id are left to storage, and so is a message
+        older than everything in a full buffer: it would be evicted at once,
+        so it only raises the floor.
+        """
+        if message.id in self.ids or message.id <= self.floor_id:
+            return
+        if len(self.messages) == self.messages.maxlen:
+            if message.id < self.messages[0].id:
+                self.floor_id = message.id
+                return
+            evicted = self.messages.popleft()
+            self.ids.discard(evicted.id)
+            self.bytes -= estimate_message_bytes(evicted)
+            self.floor_id = evicted.id
+        if not self.messages or message.id > self.messages[-1].id:
+            self.messages.append(message)
+        else:
+            # Rows from other writers can arrive out of order; keep the buffer sorted
+            ordered = sorted(list(self.messages) + [message], key=lambda row: row.id)
+            self.messages.clear()
+            self.messages.extend(ordered)
+        self.ids.add(message.id)
+        self.bytes += estimate_message_bytes(message)
+
+    def remove(self, message_id: int) -> bool:
+        """Drop a message from the buffer if present."""
+        if message_id not in self.ids:
+            return False
+        for message in self.messages:
+            if message.id == message_id:
+                self.messages.remove(message)
+                self.ids.discard(message_id)
+                self.bytes -= estimate_message_bytes(message)
+                return True
+        return False
+
+    def read_since(self, after_id: Optional[int], limit: int) -> Optional[List[Message]]:
+        """Return up to limit messages newer than after_id, or None if the buffer can't tell."""
+        if after_id is None:
+            if len(self.messages) < limit and self.floor_id > 0:
+                return None
+            return list(self.messages)[-limit:]
+        if after_id < self.floor_id:
+            return None
+        result = []
+        for message in reversed(self.messages):
+            if message.id <= after_id:
+                break
+            result.append(message)
+        result.reverse()
+        return result[:limit]
+
+class TimelineCache:
+    """Process-wide cache of recent room messages shared by every session.
+
+    Sessions read from per-room ring buffers; a room's buffer is refreshed from
+    the backend at most once per refresh interval no matter how many sessions
+    are viewing it, and save_message writes new rows straight into it. Idle
+    rooms are evicted, and the least recently used rooms are dropped when the
+    total cached size exceeds max_bytes.
+    """
+
+    def __init__(self, room_capacity: int = 200, max_bytes: int = 32 * 1024 * 1024,
+                 idle_seconds: float = 600.0, refresh_seconds: float = 1.0):
+        self.room_capacity = room_capacity
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.refresh_seconds = refresh_seconds
+        self.rooms: "OrderedDict[str, RoomTimeline]" = OrderedDict()
+        self.last_access: Dict[str, float] = {}
+        self.lock = threading.RLock()
+        self.backend_reads = 0
+
+    def _timeline(self, room_name: str) -> RoomTimeline:
+        with self.lock:
+            timeline = self.rooms.get(room_name)
+            if timeline is None:
+                timeline = RoomTimeline(self.room_capacity)
+                self.rooms[room_name] = timeline
+            self.rooms.move_to_end(room_name)
+            self.last_access[room_name] = time.monotonic()
+            return timeline
+
+    def read_since(self, room_name: str, after_id: Optional[int], limit: int,
+                   fetch_since: Callable[[Optional[int], int], List[Message]]) -> List[Message]:
+        """Read messages newer than after_id, refreshing the room from the backend if stale.
+
+        fetch_since(after_id, limit) must return backend messages oldest first; it
+        is called with None to load the newest page when a room is first cached.
+        """
+        timeline = self._timeline(room_name)
+        if time.monotonic() - timeline.last_refresh >= self.refresh_seconds:
+            with timeline.refresh_lock:
+                # Another session may have refreshed while we waited for the lock
+                if time.monotonic() - timeline.last_refresh >= self.refresh_seconds:
+                    self._refresh(timeline, fetch_since)
+
+        with self.lock:
+            cached = timeline.read_since(after_id, limit)
+        if cached is not None:
+            return cached
+        # The session is further behind than the buffer reaches
+        with self.lock:
+            self.backend_reads += 1
+        return fetch_since(after_id, limit)
+
+    def _refresh(self, timeline: RoomTimeline, fetch_since) -> None:
+        primed = timeline.last_refresh > 0
+        rows = fetch_since(timeline.synced_id if primed else None, self.room_capacity)
+        with self.lock:
+            self.backend_reads += 1
+            if not primed:
+                # A short first page means the buffer holds the whole room
+                timeline.floor_id = rows[0].id - 1 if len(rows) >= self.room_capacity else 0
+        while True:
+            with self.lock:
+                for row in rows:
+                    timeline.add(row)
+                    timeline.synced_id = max(timeline.synced_id, row.id)
+            if not primed or len(rows) < self.room_capacity:
+                break
+            # A full delta page means more rows are waiting behind it
+            rows = fetch_since(timeline.synced_id, self.room_capacity)
+            with self.lock:
+                self.backend_reads += 1
+        with self.lock:
+            timeline.last_refresh = time.monotonic()
+            self._enforce_limits()
+
+    def write_through(self, room_name: str, message: Message) -> None:
+        """Add a freshly stored message to its room's buffer if the room is cached."""
+        with self.lock:
+            timeline = self.rooms.get(room_name)
+            if timeline is not None and timeline.last_refresh > 0:
+                timeline.add(message)
+                self._enforce_limits()
+
+    def remove_message(self, message_id: int) -> None:
+        """Drop a deleted message from whichever room buffer holds it."""
+        with self.lock:
+            for timeline in self.rooms.values():
+                if timeline.remove(message_id):
+                    return
+
+    def drop_room(self, room_name: str) -> None:
+        """Forget a room entirely (e.g. after it was deleted)."""
+        with self.lock:
+            self.rooms.pop(room_name, None)
+            self.last_access.pop(room_name, None)
+
+    def clear(self) -> None:
+        """Forget every cached room."""
+        with self.lock:
+            self.rooms.clear()
+            self.last_access.clear()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(timeline.bytes for timeline in self.rooms.values())
+
+    def _enforce_limits(self) -> None:
+        """Evict idle rooms, then least recently used rooms until under the memory cap."""
+        now = time.monotonic()
+        for room_name in [name for name, seen in self.last_access.items() if now - seen > self.idle_seconds]:
+            self.drop_room(room_name)
+        total = self.total_bytes
+        while total > self.max_bytes and len(self.rooms) > 1:
+            room_name, timeline = next(iter(self.rooms.items()))
+            total -= timeline.bytes
+            self.drop_room(room_name)
+
+    def stats(self) -> Dict:
+        """Summary numbers for admin views and benchmarks."""
+        with self.lock:
+            return {
+                "rooms": len(self.rooms),
+                "messages": sum(len(timeline.messages) for timeline in self.rooms.values()),
+                "bytes": self.total_bytes,
+                "backend_reads": self.backend_reads
+            }
+
+@st.cache_resource
+def get_timeline_cache() -> TimelineCache:
+    """Return the timeline cache shared by all sessions of this server process."""
+    return TimelineCache(
+        room_capacity=get_int_setting("TIMELINE_ROOM_CAPACITY", 200),
+        max_bytes=get_int_setting("TIMELINE_MAX_BYTES", 32 * 1024 * 1024),
+        idle_seconds=get_float_setting("TIMELINE_IDLE_SECONDS", 600.0),
+        refresh_seconds=get_float_setting("TIMELINE_REFRESH_SECONDS", 1.0)
+    )
+
+class RoomAccessIndex:
+    """In-memory inverted index from username to accessible rooms.
+
+    The index is loaded from one rooms scan and then kept exact by
+    create_room, delete_room and grant_room_access applying their changes to
+    it directly. It is reloaded after ttl_seconds to pick up changes made by
+    other server processes.
+    """
+
+    def __init__(self, ttl_seconds: float = 300.0):
+        self.ttl_seconds = ttl_seconds
+        self.public_rooms = set()
+        self.user_rooms: Dict[str, set] = {}
+        self.loaded_at = None
+        self.lock = threading.RLock()
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl_seconds
+
+    def load(self, rooms: List[Room]) -> None:
+        """Rebuild the index from every room."""
+        public_rooms = set()
+        user_rooms: Dict[str, set] = {}
+        for room in rooms:
+            if room.is_public:
+                public_rooms.add(room.name)
+            for username in room.allowed_users:
+                user_rooms.setdefault(username, set()).add(room.name)
+        with self.lock:
+            self.public_rooms = public_rooms
+            self.user_rooms = user_rooms
+            self.loaded_at = time.monotonic()
+
+    def rooms_for(self, username: str) -> List[str]:
+        """Rooms the user may join: public rooms plus rooms listing them."""
+        with self.lock:
+            return sorted(self.public_rooms | self.user_rooms.get(username, set()))
+
+    def has_access(self, username: str, room_name: str) -> bool:
+        with self.lock:
+            return room_name in self.public_rooms or room_name in self.user_rooms.get(username, ())
+
+    def add_room(self, room_name: str, allowed_users: List[str], is_public: bool) -> None:
+        with self.lock:
+            if is_public:
+                self.public_rooms.add(room_name)
+            for username in allowed_users:
+                self.user_rooms.setdefault(username, set()).add(room_name)
+
+    def remove_room(self, room_name: str) -> None:
+        with self.lock:
+            self.public_rooms.discard(room_name)
+            for rooms in self.user_rooms.values():
+                rooms.discard(room_name)
+
+    def grant(self, room_name: str, usernames: List[str]) -> None:
+        with self.lock:
+            for username in usernames:
+                self.user_rooms.setdefault(username, set()).add(room_name)
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.loaded_at = None
+
+@st.cache_resource
+def get_room_access_index() -> RoomAccessIndex:
+    """Return the room access index shared by all sessions of this server process."""
+    return RoomAccessIndex(ttl_seconds=get_float_setting("ROOM_ACCESS_TTL_SECONDS", 300.0))
@@ -0,0 +1,186 @@
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Contexts that suggestion text is built for
+LOBBY = "lobby"
+CHAT = "chat"
+
+# How argument types are named in usage errors
+KIND_NAMES = {int: "a whole number", str: "text"}
+
+class CommandUsageError(ValueError):
+    """Raised when a command's arguments don't match its schema."""
+
+class Arg:
+    """One positional command argument: its name, type and whether it may be left out.
+
+    A rest argument takes the remainder of the command line verbatim.
+    """
+
+    def __init__(self, name: str, kind: type = str, optional: bool = False, default=None, rest: bool = False):
+        self.name = name
+        self.kind = kind
+        self.optional = optional
+        self.default = default
+        self.rest = rest
+
+    @property
+    def usage(self) -> str:
+        return f"[{self.name}]" if self.optional else f"<{self.name}>"
+
+class Command:
+    """Declarative description of one terminal command.
+
+    A user_only command is suggested only to non-admins; admins may still run it.
+    """
+
+    def __init__(self, name: str, args: Tuple[Arg, ...], description: str, hint: Optional[str] = None,
+                 admin_only: bool = False, batchable: bool = True, user_only: bool = False):
+        self.name = name
+        self.args = args
+        self.description = description
+        self.hint = hint or description
+        self.admin_only = admin_only
+        self.batchable = batchable
+        self.user_only = user_only
+        self.usage = " ".join([name] + [arg.usage for arg in args])
+
+    def allowed(self, role: str) -> bool:
+        return role == "admin" or not self.admin_only
+
+    def suggested_to(self, role: str) -> bool:
+        return self.allowed(role) and not (self.user_only and role == "admin")
+
+    def parse(self, text: str) -> List:
+        """Split the text after the command name into typed arguments.
+
+        Extra words after the last argument are ignored, as they always were.
+        """
+        values = []
+        remaining = text.strip()
+        for arg in self.args:
+            if arg.rest:
+                word, remaining = remaining, ""
+            else:
+                word, _, remaining = remaining.partition(" ")
+                remaining = remaining.strip()
+            if not word:
+                if not arg.optional:
+                    raise CommandUsageError(f"Usage: {self.usage}")
+                values.append(arg.default)
+                continue
+            try:
+                values.append(arg.kind(word))
+            except ValueError:
+                raise CommandUsageError(f"Usage: {self.usage} ({arg.name} must be {KIND_NAMES.get(arg.kind, arg.kind.__name__)})")
+        return values
+
+class CommandRegistry:
+    """Commands by name, with help and suggestion text built once per role and context."""
+
+    def __init__(self, commands: List[Command], suggestions: Dict[str, List[str]], help_footer: str = ""):
+        self.commands = {command.name: command for command in commands}
+        self.order = [command.name for command in commands]
+        self.suggestion_names = suggestions
+        self.help_footer = help_footer
+
+    def resolve(self, name: str, role: str) -> Optional[Command]:
+        """The command a role may run under name, or None."""
+        command = self.commands.get(name.lower())
+        return command if command is not None and command.allowed(role) else None
+
+    @lru_cache(maxsize=None)
+    def help_text(self) -> str:
+        lines = ["TCA v2.0 Terminal Commands:", "========================"]
+        for name in self.order:
+            command = self.commands[name]
+            prefix = "(Admin) " if command.admin_only else ""
+            lines.append(f"{command.usage:<46} - {prefix}{command.description}")
+        return "\n".join(lines) + "\n" + self.help_footer
+
+    @lru_cache(maxsize=None)
+    def suggestions(self, role: str, context: str) -> Tuple[Tuple[str, str], ...]:
+        """(usage, hint) of the commands suggested to a role in a context."""
+        commands = [self.commands[name] for name in self.suggestion_names.get(context, [])]
+        return tuple((command.usage, command.hint) for command in commands if command.suggested_to(role))
+
+    @lru_cache(maxsize=None)
+    def suggestions_text(self, role: str, context: str) -> str:
+        lines = ["", "Available commands in current context:"]
+        lines += [f"  {usage:<50} - {hint}" for usage, hint in self.suggestions(role, context)]
+        return "\n".join(lines)
+
+    def split_batch(self, text: str, role: str) -> List[Tuple[Command, List]]:
+        """Parse the ';'-separated commands of a /batch line.
+
+        Raises CommandUsageError naming the first command that is unknown,
+        not allowed in a batch or malformed, so nothing runs half-parsed.
+        """
+        parsed = []
+        for part in text.split(";"):
+            part = part.strip()
+            if not part:
+                continue
+            name, _, rest = part.partition(" ")
+            command = self.resolve(name, role)
+            if command is None or not command.batchable:
+                raise CommandUsageError(f"Cannot run '{name}' in a batch.")
+            parsed.append((command, command.parse(rest)))
+        if not parsed:
+            raise CommandUsageError(f"Usage: {self.commands['/batch'].usage}")
+        return parsed
+
+HELP_FOOTER = """
+Additional Information:
+- All commands start with '/'
+- Administrative commands require a security key
+- Direct messages are private between two users
+- Rooms can be public or private (access controlled)
+- /search matches every word as a prefix, best matches first; add #room to search a single room
+- /batch runs several commands from one line, e.g. /batch /createroom ops <key>; /giveaccess ann,bo ops <key>
+"""
+
+COMMANDS = [
+    Command("/help", (), "Show this help", hint="Show help information", batchable=False),
+    Command("/listrooms", (), "List available rooms"),
+    Command("/join", (Arg("room"),), "Join a room", hint="Join a chat room", batchable=False),
+    Command("/users", (), "List users in current room"),
+    Command("/dm", (Arg("username"),), "Start direct message", hint="Start a direct message with a user",
+            batchable=False),
+    Command("/exit", (), "Exit DM or leave room", batchable=False),
+    Command("/history", (Arg("n", int, optional=True),), "Load n older messages (default 20)",
+            hint="Load older messages", batchable=False),
+    Command("/search", (Arg("terms [#room]", rest=True),), "Search your rooms and direct messages",
+            hint="Search message history", batchable=False),
+    Command("/more", (), "Show the next page of search results", batchable=False),
+    Command("/logout", (), "Logout", hint="Log out of the application", batchable=False),
+    Command("/changepass", (Arg("newpass"),), "Change your password (authenticated users)",
+            hint="Change your password", batchable=False, user_only=True),
+    Command("/resetpass", (Arg("username"), Arg("oldpass"), Arg("newpass")),
+            "Reset password (unauthenticated users)", batchable=False),
+    Command("/adduser", (Arg("username"), Arg("password"), Arg("securitykey")), "Create new user",
+            hint="Create a new user", admin_only=True),
+    Command("/addmultipleusers", (Arg("user1:pass1,user2:pass2,..."), Arg("securitykey")),
+            "Create several users", admin_only=True),
+    Command("/createroom", (Arg("roomname"), Arg("securitykey")), "Create new room",
+            hint="Create a new room", admin_only=True),
+    Command("/deleteroom", (Arg("roomname"), Arg("securitykey")), "Delete a room", admin_only=True),
+    Command("/deletemessage", (Arg("message_id", int), Arg("securitykey")), "Delete a message",
+            admin_only=True),
+    Command("/cleanup", (Arg("securitykey"),), "Cleanup old messages", admin_only=True),
+    Command("/giveaccess", (Arg("user1,user2,..."), Arg("roomname"), Arg("securitykey")),
+            "Grant room access to users", hint="Grant room access", admin_only=True),
+    Command("/stats", (), "Show operation latency statistics", admin_only=True),
+    Command("/batch", (Arg("command; command; ...", rest=True),), "Run several commands in one go",
+            hint="Run several ';'-separated commands at once", batchable=False),
+    Command("/quit", (), "Quit the app", hint="Leave the current room or DM", batchable=False)
+]
+
+SUGGESTIONS = {
+    LOBBY: ["/dm", "/join", "/listrooms", "/search", "/help", "/logout"],
+    CHAT: ["/quit", "/history", "/search", "/help", "/logout", "/adduser", "/createroom", "/deleteroom", "/deletemessage",
+           "/cleanup", "/giveaccess", "/stats", "/batch", "/changepass"]
+}
+
+# Built once per process; help and suggestion text are cached on first use per (role, context)
+registry = CommandRegistry(COMMANDS, SUGGESTIONS, HELP_FOOTER)
@@ -0,0 +1,30 @@
+import os
+import streamlit as st
+
+def get_setting(name: str, default=None):
+    """Read a setting from Streamlit secrets, falling back to environment variables."""
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        # No secrets.toml available (local runs, benchmarks, tests)
+        pass
+    return os.environ.get(name, default)
+
+def get_int_setting(name: str, default: int) -> int:
+    """Read an integer setting, falling back to the default on bad values."""
+    value = get_setting(name, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        print(f"Invalid integer for setting {name}: {value!r}, using {default}")
+        return default
+
+def get_float_setting(name: str, default: float) -> float:
+    """Read a float setting, falling back to the default on bad values."""
+    value = get_setting(name, default)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        print(f"Invalid number for setting {name}: {value!r}, using {default}")
+        return default
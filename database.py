@@ -1,49 +1,118 @@
+import os
+import re
+import threading
+import time
 import streamlit as st
-import bcrypt
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-from supabase import create_client, Client
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+from config import get_float_setting, get_int_setting, get_setting
+from metrics import get_metrics, instrument_methods
+from models import Message, User
+
+# Other subsystems are imported by the methods that build or use them,
+# so importing this module loads only config, metrics and models
+if TYPE_CHECKING:
+    from admission import AuthAdmission
+    from archive import MessageArchive
+    from broker import MessageBroker
+    from cache import RoomAccessIndex, TimelineCache
+    from storage import StorageBackend
+    from write_queue import WriteBehindQueue
 
 # Configurable bcrypt cost factor (12 is a good balance of security and performance)
 BCRYPT_ROUNDS = 12
 
+# Parallel hashing for batch user creation (USER_BATCH_HASH_WORKERS), leaving cores for everything else
+HASH_WORKERS = max(1, (os.cpu_count() or 4) // 2)
+USER_BATCH_CHUNK_SIZE = 500
+# Longest a hashed user waits for its chunk to be inserted, so progress keeps moving
+USER_BATCH_FLUSH_SECONDS = 0.5
+
+# Words of a search query beyond this many are ignored
+MAX_SEARCH_TERMS = 8
+
+def _hash_password(password: str) -> str:
+    """Hash a password with the configured bcrypt cost."""
+    import bcrypt
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+def _check_password(password: str, hashed_password: str) -> bool:
+    """Verify a password against a stored bcrypt hash."""
+    import bcrypt
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
 class DatabaseManager:
-    """Manages database connections and operations for the TCA application using Supabase."""
+    """Manages database connections and operations for the TCA application.
+
+    Storage is delegated to a pluggable backend (Supabase or embedded SQLite),
+    selected by the STORAGE_BACKEND setting unless one is passed in explicitly.
+    Room reads go through an optional process-wide TimelineCache, and room
+    membership checks through an optional RoomAccessIndex. Password checks
+    and hashes for logins and password changes are rate limited and run in
+    bounded slots by an optional AuthAdmission controller. Every stored
+    message is announced on its room or conversation channel of an optional
+    MessageBroker.
+    """
     
-    def __init__(self):
-        """Initialize Supabase client."""
-        self.supabase: Client = None
-        self.connect()
+    def __init__(self, backend: Optional["StorageBackend"] = None, timeline: Optional["TimelineCache"] = None,
+                 room_access: Optional["RoomAccessIndex"] = None, auth_admission: Optional["AuthAdmission"] = None,
+                 broker: Optional["MessageBroker"] = None):
+        """Initialize the storage backend."""
+        from archive import create_archive
+        from retention import RetentionEngine
+        self.backend: Optional["StorageBackend"] = backend
+        self.timeline = timeline
+        self.room_access = room_access
+        self.auth_admission = auth_admission
+        self.broker = broker
+        self.write_queue: Optional["WriteBehindQueue"] = None
+        if self.backend is None:
+            self.connect()
+        self.archive: Optional["MessageArchive"] = create_archive()
+        self.retention = RetentionEngine(
+            self.backend,
+            batch_size=get_int_setting("RETENTION_BATCH_SIZE", 1000),
+            pause_seconds=get_float_setting("RETENTION_PAUSE_SECONDS", 0.05),
+            checkpoint_path=get_setting("RETENTION_CHECKPOINT_PATH"),
+            archive=self.archive
+        )
     
     def connect(self):
-        """Connect to Supabase database using Streamlit secrets."""
-        try:
-            # Use Streamlit secrets instead of environment variables
-            url = st.secrets["SUPABASE_URL"]
-            key = st.secrets["SUPABASE_KEY"]
-            if url and key:
-                self.supabase = create_client(url, key)
-            else:
-                print("Supabase credentials not found in Streamlit secrets")
-        except Exception as e:
-            print(f"Supabase connection error: {e}")
+        """Connect to the configured storage backend.
+        
+        The backend is wrapped so that it connects lazily, reconnects after a
+        failed connection, retries reads and fails fast while it is down.
+        """
+        from resilience import CircuitBreaker, ResilientBackend
+        from storage import create_backend
+        self.backend = ResilientBackend(
+            create_backend,
+            CircuitBreaker(
+                failure_threshold=get_int_setting("CIRCUIT_FAILURE_THRESHOLD", 5),
+                reset_seconds=get_float_setting("CIRCUIT_RESET_SECONDS", 15.0)
+            ),
+            retry_attempts=get_int_setting("DB_RETRY_ATTEMPTS", 3),
+            retry_base_seconds=get_float_setting("DB_RETRY_BASE_SECONDS", 0.1),
+            deadline_seconds=get_float_setting("DB_CALL_DEADLINE_SECONDS", 8.0),
+            metrics=get_metrics()
+        )
     
     def create_user(self, username: str, password: str, role: str = "user") -> bool:
         """Create a new user in the database."""
         try:
             # Check if user already exists
-            existing_user = self.supabase.table("users").select("*").eq("username", username).execute()
-            if existing_user.data:
+            if self.backend.user_exists(username):
                 return False  # User already exists
             
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
             user_data = {
                 "username": username,
-                "password": hashed_password.decode('utf-8'),
+                "password": _hash_password(password),
                 "role": role,
                 "created_at": datetime.utcnow().isoformat()
             }
-            self.supabase.table("users").insert(user_data).execute()
+            self.backend.insert_user(user_data)
             return True
         except Exception as e:
             print(f"Error creating user: {e}")
@@ -52,78 +121,189 @@ class DatabaseManager:
     def create_multiple_users(self, users_data: List[Dict[str, str]], admin_role: str = "user") -> Dict[str, bool]:
         """Create multiple users in the database."""
         results = {}
+        for username, success, _, _ in self.create_multiple_users_iter(users_data, admin_role):
+            results[username] = success
+        return results
+    
+    def create_multiple_users_iter(self, users_data: List[Dict[str, str]], admin_role: str = "user",
+                                   chunk_size: int = USER_BATCH_CHUNK_SIZE,
+                                   flush_seconds: float = USER_BATCH_FLUSH_SECONDS) -> Iterator[Tuple[str, bool, int, int]]:
+        """Create multiple users, yielding (username, success, completed, total) as results arrive.
+        
+        Existing usernames are found with one query and passwords are hashed
+        in parallel (bcrypt releases the GIL), in the auth admission slots
+        when admission control is enabled, so logins keep a share of them
+        during a large batch. Hashed users are bulk inserted
+        once chunk_size of them are ready or the oldest has waited
+        flush_seconds, so results stream in while hashing goes on. If the
+        batch fails, every user without a result yet is reported as failed.
+        """
+        total = len(users_data)
+        completed = 0
+        pending = []
+        # Position of each user that has no result yet, and of each user being created
+        unreported = {index: user_info.get("username") for index, user_info in enumerate(users_data)}
+        positions: Dict[str, int] = {}
         try:
-            for user_info in users_data:
+            candidates = [
+                user_info.get("username") for user_info in users_data
+                if user_info.get("username") and user_info.get("password")
+            ]
+            existing = self.backend.find_existing_usernames(candidates) if candidates else set()
+            
+            seen = set()
+            for index, user_info in enumerate(users_data):
                 username = user_info.get("username")
                 password = user_info.get("password")
-                
-                if not username or not password:
-                    results[username] = False
-                    continue
-                
-                # Check if user already exists
-                existing_user = self.supabase.table("users").select("*").eq("username", username).execute()
-                if existing_user.data:
-                    results[username] = False  # User already exists
+                if not username or not password or username in existing or username in seen:
+                    unreported.pop(index)
+                    completed += 1
+                    yield username, False, completed, total  # Invalid, existing or duplicate
                     continue
-                
-                hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
-                user_data = {
-                    "username": username,
-                    "password": hashed_password.decode('utf-8'),
-                    "role": admin_role,
-                    "created_at": datetime.utcnow().isoformat()
+                seen.add(username)
+                pending.append((username, password))
+                positions[username] = index
+            
+            executor = ThreadPoolExecutor(max_workers=get_int_setting("USER_BATCH_HASH_WORKERS", HASH_WORKERS))
+            try:
+                hashing = {
+                    executor.submit(self._run_bcrypt, _hash_password, password, background=True): username
+                    for username, password in pending
                 }
-                self.supabase.table("users").insert(user_data).execute()
-                results[username] = True
+                chunk = []
+                chunk_started = 0.0
+                for future in as_completed(hashing):
+                    username = hashing[future]
+                    try:
+                        hashed_password = future.result()
+                    except Exception as e:
+                        print(f"Error hashing password for {username}: {e}")
+                        unreported.pop(positions[username])
+                        completed += 1
+                        yield username, False, completed, total
+                        continue
+                    if not chunk:
+                        chunk_started = time.monotonic()
+                    chunk.append({
+                        "username": username,
+                        "password": hashed_password,
+                        "role": admin_role,
+                        "created_at": datetime.utcnow().isoformat()
+                    })
+                    if len(chunk) >= chunk_size or time.monotonic() - chunk_started >= flush_seconds:
+                        for username_done, success in self._insert_user_chunk(chunk):
+                            unreported.pop(positions[username_done])
+                            completed += 1
+                            yield username_done, success, completed, total
+                        chunk = []
+                for username_done, success in self._insert_user_chunk(chunk):
+                    unreported.pop(positions[username_done])
+                    completed += 1
+                    yield username_done, success, completed, total
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
         except Exception as e:
             print(f"Error creating multiple users: {e}")
-        
+            for username in list(unreported.values()):
+                completed += 1
+                yield username, False, completed, total
+    
+    def _insert_user_chunk(self, rows: List[Dict]) -> List[Tuple[str, bool]]:
+        """Bulk insert user rows, falling back to single inserts if the batch is rejected."""
+        if not rows:
+            return []
+        try:
+            self.backend.insert_users(rows)
+            return [(row["username"], True) for row in rows]
+        except Exception as e:
+            print(f"Bulk user insert failed, retrying individually: {e}")
+        results = []
+        for row in rows:
+            try:
+                self.backend.insert_user(row)
+                results.append((row["username"], True))
+            except Exception as e:
+                print(f"Error creating user {row['username']}: {e}")
+                results.append((row["username"], False))
         return results
     
-    def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
-        """Authenticate a user and return user data if successful."""
+    def _admit(self, username: str, client_id: Optional[str]):
+        """Apply auth rate limits before any lookup or hashing (raises AuthRejected)."""
+        if self.auth_admission is not None:
+            self.auth_admission.check_limits(username, client_id)
+    
+    def _run_bcrypt(self, fn, *args, background: bool = False):
+        """Run a bcrypt operation in an admission slot when admission control is enabled.
+        
+        Background (batch) work waits for a slot without a deadline instead of being rejected.
+        """
+        if self.auth_admission is None:
+            return fn(*args)
+        if background:
+            return self.auth_admission.run_background(fn, *args)
+        return self.auth_admission.run(fn, *args)
+    
+    def authenticate_user(self, username: str, password: str, client_id: Optional[str] = None) -> Optional[User]:
+        """Authenticate a user and return the user if successful.
+        
+        Raises AuthRejected when the attempt is shed by admission control.
+        """
+        from admission import AuthRejected
         try:
-            response = self.supabase.table("users").select("*").eq("username", username).execute()
-            if response.data:
-                user = response.data[0]
-                if bcrypt.checkpw(password.encode('utf-8'), user["password"].encode('utf-8')):
-                    # Return user data without password
-                    user_data = user.copy()
-                    del user_data["password"]
-                    return user_data
+            self._admit(username, client_id)
+            credentials = self.backend.get_user_credentials(username)
+            if credentials:
+                user, hashed_password = credentials
+                if self._run_bcrypt(_check_password, password, hashed_password):
+                    return user
             return None
+        except AuthRejected:
+            raise
         except Exception as e:
             print(f"Error authenticating user: {e}")
             return None
     
-    def change_user_password_authenticated(self, username: str, new_password: str) -> bool:
-        """Change a user's password without requiring old password (for authenticated users)."""
+    def change_user_password_authenticated(self, username: str, new_password: str, client_id: Optional[str] = None) -> bool:
+        """Change a user's password without requiring old password (for authenticated users).
+        
+        Raises AuthRejected when the attempt is shed by admission control.
+        """
+        from admission import AuthRejected
         try:
+            self._admit(username, client_id)
             # Hash and update the new password
-            hashed_new_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
-            self.supabase.table("users").update({"password": hashed_new_password.decode('utf-8')}).eq("username", username).execute()
+            hashed_new_password = self._run_bcrypt(_hash_password, new_password)
+            self.backend.update_user_password(username, hashed_new_password)
             return True
+        except AuthRejected:
+            raise
         except Exception as e:
             print(f"Error changing user password: {e}")
             return False
     
-    def reset_user_password_unauthenticated(self, username: str, old_password: str, new_password: str) -> bool:
-        """Reset a user's password with old password verification (for unauthenticated users)."""
+    def reset_user_password_unauthenticated(self, username: str, old_password: str, new_password: str,
+                                            client_id: Optional[str] = None) -> bool:
+        """Reset a user's password with old password verification (for unauthenticated users).
+        
+        Raises AuthRejected when the attempt is shed by admission control.
+        """
+        from admission import AuthRejected
         try:
+            self._admit(username, client_id)
             # First verify the old password
-            response = self.supabase.table("users").select("*").eq("username", username).execute()
-            if not response.data:
+            hashed_password = self.backend.get_password_hash(username)
+            if not hashed_password:
                 return False
             
-            user = response.data[0]
-            if not bcrypt.checkpw(old_password.encode('utf-8'), user["password"].encode('utf-8')):
+            if not self._run_bcrypt(_check_password, old_password, hashed_password):
                 return False  # Old password is incorrect
             
             # Hash and update the new password
-            hashed_new_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
-            self.supabase.table("users").update({"password": hashed_new_password.decode('utf-8')}).eq("username", username).execute()
+            hashed_new_password = self._run_bcrypt(_hash_password, new_password)
+            self.backend.update_user_password(username, hashed_new_password)
             return True
+        except AuthRejected:
+            raise
         except Exception as e:
             print(f"Error resetting user password: {e}")
             return False
@@ -131,35 +311,137 @@ class DatabaseManager:
     def get_user_rooms(self, username: str) -> List[str]:
         """Get list of rooms the user has access to."""
         try:
-            # Get all rooms where user is in allowed_users or room is public
-            response = self.supabase.table("rooms").select("name, allowed_users, is_public").execute()
-            user_rooms = []
+            if self.room_access is not None:
+                self._load_room_access()
+                return self.room_access.rooms_for(username)
             
-            for room in response.data:
-                if room.get("is_public", False) or username in room.get("allowed_users", []):
-                    user_rooms.append(room["name"])
-                    
-            return user_rooms
+            # Let the backend filter to public rooms and rooms listing the user
+            return self.backend.list_user_rooms(username)
         except Exception as e:
             print(f"Error fetching user rooms: {e}")
             return []
     
-    def get_room_messages(self, room_name: str, limit: int = 50) -> List[Dict]:
-        """Get recent messages from a room."""
+    def has_room_access(self, username: str, room_name: str) -> bool:
+        """Check whether a user may join a room."""
         try:
-            response = (self.supabase.table("messages")
-                       .select("*")
-                       .eq("room", room_name)
-                       .order("timestamp", desc=True)
-                       .limit(limit)
-                       .execute())
-            return response.data
+            if self.room_access is not None:
+                self._load_room_access()
+                return self.room_access.has_access(username, room_name)
+            return room_name in self.get_user_rooms(username)
+        except Exception as e:
+            print(f"Error checking room access: {e}")
+            return False
+    
+    def _load_room_access(self):
+        """Rebuild the room access index from the backend once its TTL has expired."""
+        if self.room_access.is_stale():
+            self.room_access.load(self.backend.list_rooms())
+    
+    def get_room_messages(self, room_name: str, limit: int = 50, before_id: Optional[int] = None) -> List[Message]:
+        """Get recent messages from a room, newest first.
+        
+        Passing before_id pages backwards through older history by keyset
+        (id < before_id), which costs the same at any depth. Pages reaching
+        past the oldest stored message continue into the archive.
+        """
+        try:
+            if before_id is not None:
+                rows = self.backend.get_room_messages(room_name, limit, before_id)
+            elif self.timeline is not None:
+                fetch = partial(self._fetch_room_messages_since, room_name)
+                rows = list(reversed(self.timeline.read_since(room_name, None, limit, fetch)))
+            else:
+                rows = self.backend.get_room_messages(room_name, limit)
+            return self._with_archived("messages", room_name, rows, limit, before_id)
         except Exception as e:
             print(f"Error fetching room messages: {e}")
             return []
     
-    def save_message(self, room: str, username: str, content: str) -> bool:
-        """Save a message to the database."""
+    def _with_archived(self, table: str, partition: str, rows: List[Message], limit: int,
+                       before_id: Optional[int]) -> List[Message]:
+        """Fill a short newest-first page with archived messages older than its last row."""
+        if self.archive is None or len(rows) >= limit:
+            return rows
+        older_than = rows[-1].id if rows else before_id
+        archived = self.archive.read_before(table, partition, older_than, limit - len(rows))
+        return rows + [Message.from_row(row) for row in archived]
+    
+    def get_room_messages_since(self, room_name: str, after_id: Optional[int] = None, limit: int = 100) -> List[Message]:
+        """Get messages newer than after_id from a room, oldest first.
+        
+        Without a cursor the newest page is returned, so callers can start
+        polling from an empty buffer and pass the last id they have seen.
+        """
+        try:
+            if self.timeline is not None:
+                fetch = partial(self._fetch_room_messages_since, room_name)
+                return self.timeline.read_since(room_name, after_id, limit, fetch)
+            return self._fetch_room_messages_since(room_name, after_id, limit)
+        except Exception as e:
+            print(f"Error fetching new room messages: {e}")
+            return []
+    
+    def _fetch_room_messages_since(self, room_name: str, after_id: Optional[int], limit: int) -> List[Message]:
+        """Read messages newer than after_id straight from the backend, oldest first."""
+        if after_id is None:
+            return list(reversed(self.backend.get_room_messages(room_name, limit)))
+        return self.backend.get_room_messages_since(room_name, after_id, limit)
+    
+    def enable_write_behind(self, max_batch: int = 100, flush_interval: float = 0.005, max_pending: int = 10000):
+        """Route message saves through a write-behind queue flushed as bulk inserts."""
+        from write_queue import WriteBehindQueue
+        self.write_queue = WriteBehindQueue(
+            self._flush_writes, max_batch, flush_interval, max_pending,
+            on_stored=self._stored_batch, is_rejection=self._insert_rejected
+        )
+    
+    def _flush_writes(self, table: str, rows: List[Dict]) -> List[Message]:
+        """Bulk insert a batch of queued rows."""
+        if table == "messages":
+            return self.backend.insert_messages(rows)
+        return self.backend.insert_direct_messages(rows)
+    
+    @staticmethod
+    def _insert_rejected(error: Exception) -> bool:
+        """Whether the backend refused an insert, so none of its rows were stored."""
+        from resilience import CircuitOpenError, is_transient
+        return isinstance(error, CircuitOpenError) or not is_transient(error)
+    
+    def _stored_batch(self, stored: List[Message]):
+        """Write a stored batch through to the timeline and announce it."""
+        for message in stored:
+            self._stored(message)
+    
+    def _stored(self, message: Message):
+        """Write a stored message through to the timeline cache and publish it to subscribers."""
+        if self.timeline is not None and not message.is_direct:
+            self.timeline.write_through(message.room, message)
+        if self.broker is not None:
+            from broker import message_channel
+            self.broker.publish(message_channel(message), message.id)
+    
+    @staticmethod
+    def _queued_write_done(table: str, submitted: float, on_failure: Optional[Callable[[Exception], None]],
+                           future: Future):
+        """Report a queued message that could not be stored, which its sender would otherwise never learn."""
+        error = future.exception()
+        if error is None:
+            return
+        print(f"Error storing queued {table} row: {error}")
+        get_metrics().observe(f"write_behind.{table}", time.perf_counter() - submitted, error=True)
+        if on_failure is not None:
+            on_failure(error)
+    
+    def save_message(self, room: str, username: str, content: str, wait: bool = False,
+                     on_failure: Optional[Callable[[Exception], None]] = None) -> bool:
+        """Save a message to the database.
+        
+        With write-behind enabled the message is queued and True means it was
+        accepted; pass wait=True to block until it has been stored. A queued
+        message that then fails to store is logged, counted as a
+        write_behind.<table> error and passed to on_failure, which runs on
+        the write-behind thread.
+        """
         try:
             message_data = {
                 "room": room,
@@ -167,49 +449,109 @@ class DatabaseManager:
                 "content": content,
                 "timestamp": datetime.utcnow().isoformat()
             }
-            self.supabase.table("messages").insert(message_data).execute()
+            if self.write_queue is not None:
+                future = self.write_queue.submit("messages", message_data)
+                future.add_done_callback(partial(self._queued_write_done, "messages", time.perf_counter(), on_failure))
+                if wait:
+                    future.result()
+                return True
+            self._stored(self.backend.insert_message(message_data))
             return True
         except Exception as e:
             print(f"Error saving message: {e}")
             return False
     
-    def save_direct_message(self, sender: str, recipient: str, content: str) -> bool:
-        """Save a direct message to the database."""
+    def save_direct_message(self, sender: str, recipient: str, content: str, wait: bool = False,
+                            on_failure: Optional[Callable[[Exception], None]] = None) -> bool:
+        """Save a direct message to the database (queued when write-behind is enabled, see save_message)."""
+        from storage import conversation_key
         try:
             dm_data = {
                 "sender": sender,
                 "recipient": recipient,
+                "conversation": conversation_key(sender, recipient),
                 "content": content,
                 "timestamp": datetime.utcnow().isoformat()
             }
-            self.supabase.table("direct_messages").insert(dm_data).execute()
+            if self.write_queue is not None:
+                future = self.write_queue.submit("direct_messages", dm_data)
+                future.add_done_callback(
+                    partial(self._queued_write_done, "direct_messages", time.perf_counter(), on_failure)
+                )
+                if wait:
+                    future.result()
+                return True
+            self._stored(self.backend.insert_direct_message(dm_data))
             return True
         except Exception as e:
             print(f"Error saving direct message: {e}")
             return False
     
-    def get_direct_messages(self, user1: str, user2: str, limit: int = 50) -> List[Dict]:
-        """Get direct messages between two users."""
+    def get_direct_messages(self, user1: str, user2: str, limit: int = 50, before_id: Optional[int] = None) -> List[Message]:
+        """Get direct messages between two users, newest first, optionally older than before_id."""
+        from storage import conversation_key
         try:
-            response = (self.supabase.table("direct_messages")
-                       .select("*")
-                       .or_(f"sender.eq.{user1},recipient.eq.{user1}")
-                       .or_(f"sender.eq.{user2},recipient.eq.{user2}")
-                       .order("timestamp", desc=True)
-                       .limit(limit)
-                       .execute())
-            return response.data
+            conversation = conversation_key(user1, user2)
+            rows = self.backend.get_direct_messages(conversation, limit, before_id)
+            return self._with_archived("direct_messages", conversation, rows, limit, before_id)
         except Exception as e:
             print(f"Error fetching direct messages: {e}")
             return []
     
+    def get_direct_messages_since(self, user1: str, user2: str, after_id: Optional[int] = None, limit: int = 100) -> List[Message]:
+        """Get direct messages between two users newer than after_id, oldest first."""
+        from storage import conversation_key
+        try:
+            if after_id is None:
+                return list(reversed(self.backend.get_direct_messages(conversation_key(user1, user2), limit)))
+            return self.backend.get_direct_messages_since(conversation_key(user1, user2), after_id, limit)
+        except Exception as e:
+            print(f"Error fetching new direct messages: {e}")
+            return []
+    
+    def get_dm_inbox(self, username: str, limit: int = 20) -> List[Message]:
+        """Get the newest direct messages sent or received by a user, newest first."""
+        try:
+            return self.backend.get_recent_direct_messages(username, limit)
+        except Exception as e:
+            print(f"Error fetching direct message inbox: {e}")
+            return []
+    
+    def search_messages(self, username: str, query: str, room: Optional[str] = None,
+                        page: int = 1, page_size: int = 20) -> Tuple[List[Message], bool]:
+        """Search the rooms a user may read and their own direct messages, best match first.
+        
+        Every word of the query must appear (as a word prefix). Passing room
+        limits the search to that room and leaves out direct messages.
+        Returns one page of results and whether another page follows.
+        """
+        try:
+            terms = re.findall(r"\w+", query.lower())[:MAX_SEARCH_TERMS]
+            if not terms or page < 1:
+                return [], False
+            rooms = self.get_user_rooms(username)
+            member = username
+            if room is not None:
+                if room not in rooms:
+                    return [], False
+                rooms, member = [room], None
+            # One extra row tells whether there is a next page
+            hits = self.backend.search_messages(terms, rooms, member, page_size + 1, (page - 1) * page_size)
+            return hits[:page_size], len(hits) > page_size
+        except Exception as e:
+            print(f"Error searching messages: {e}")
+            return [], False
+    
     def create_room(self, room_name: str, allowed_users: List[str] = None, is_public: bool = False) -> bool:
         """Create a new room."""
         try:
             # Check if room already exists
-            existing_room = self.supabase.table("rooms").select("*").eq("name", room_name).execute()
-            if existing_room.data:
+            if self.backend.room_exists(room_name):
                 return False  # Room already exists
+            
+            # A deleted room's old messages must be gone before its name is reused
+            if room_name in self.retention.pending_rooms():
+                return False
                 
             room_data = {
                 "name": room_name,
@@ -217,30 +559,102 @@ class DatabaseManager:
                 "is_public": is_public,
                 "created_at": datetime.utcnow().isoformat()
             }
-            self.supabase.table("rooms").insert(room_data).execute()
+            self.backend.insert_room(room_data)
+            if self.room_access is not None:
+                self.room_access.add_room(room_name, room_data["allowed_users"], is_public)
             return True
         except Exception as e:
             print(f"Error creating room: {e}")
             return False
     
+    def create_rooms(self, rooms: List[Tuple[str, List[str], bool]]) -> Dict[str, bool]:
+        """Create several rooms given as (name, allowed_users, is_public) with one lookup and one insert.
+        
+        Returns whether each room name was created; existing or repeated names, and names
+        of deleted rooms whose messages are still being purged, are not.
+        """
+        results = {name: False for name, _, _ in rooms}
+        try:
+            existing = self.backend.find_existing_room_names(list(results))
+            existing.update(self.retention.pending_rooms())
+            created_at = datetime.utcnow().isoformat()
+            rows = []
+            for name, allowed_users, is_public in rooms:
+                if name in existing:
+                    continue
+                existing.add(name)
+                rows.append({
+                    "name": name,
+                    "allowed_users": allowed_users or [],
+                    "is_public": is_public,
+                    "created_at": created_at
+                })
+            if rows:
+                self.backend.insert_rooms(rows)
+            for row in rows:
+                results[row["name"]] = True
+                if self.room_access is not None:
+                    self.room_access.add_room(row["name"], row["allowed_users"], row["is_public"])
+        except Exception as e:
+            print(f"Error creating rooms: {e}")
+        return results
+    
     def delete_room(self, room_name: str) -> bool:
-        """Delete a room (admin only)."""
+        """Delete a room (admin only).
+        
+        Returns False while its messages are not all deleted yet, e.g. when
+        cleanup is paused; the purge is finished by resume_cleanup or the
+        next cleanup_old_messages, and the name can't be reused until then.
+        """
         try:
             # Delete the room
-            self.supabase.table("rooms").delete().eq("name", room_name).execute()
+            self.backend.delete_room(room_name)
+            if self.room_access is not None:
+                self.room_access.remove_room(room_name)
             
-            # Also delete all messages in that room
-            self.supabase.table("messages").delete().eq("room", room_name).execute()
-            
-            return True
+            # Also delete all messages in that room, in bounded batches
+            self.retention.purge_room(room_name)
+            return self._finish_room_deletion(room_name)
         except Exception as e:
             print(f"Error deleting room: {e}")
             return False
     
+    def _finish_room_deletion(self, room_name: str) -> bool:
+        """Drop what is left of a deleted room once its purge is done; False while it is unfinished."""
+        if room_name in self.retention.pending_rooms():
+            return False
+        if self.archive is not None:
+            # The archive is a record of expired messages, so it outlives the room unless told otherwise
+            if str(get_setting("ARCHIVE_DROP_DELETED_ROOMS", "false")).lower() == "true":
+                self.archive.drop("messages", room_name)
+            else:
+                self.archive.retire("messages", room_name)
+        if self.timeline is not None:
+            self.timeline.drop_room(room_name)
+        return True
+    
+    def finish_room_deletions(self, max_batches: Optional[int] = None) -> int:
+        """Continue the message purges of deleted rooms that stopped early and return how many were deleted."""
+        deleted = 0
+        try:
+            for room_name in self.retention.pending_rooms():
+                deleted += self.retention.purge_room(room_name, max_batches)
+                self._finish_room_deletion(room_name)
+        except Exception as e:
+            print(f"Error finishing room deletions: {e}")
+        return deleted
+    
+    def resume_cleanup(self):
+        """Let cleanup run again and finish the room deletions it left pending."""
+        self.retention.resume()
+        self.finish_room_deletions()
+    
     def delete_message(self, message_id: int) -> bool:
         """Delete a specific message (admin only)."""
         try:
-            self.supabase.table("messages").delete().eq("id", message_id).execute()
+            self.backend.delete_message(message_id)
+            if self.timeline is not None:
+                self.timeline.remove_message(message_id)
             return True
         except Exception as e:
             print(f"Error deleting message: {e}")
@@ -249,40 +663,139 @@ class DatabaseManager:
     def grant_room_access(self, room_name: str, usernames: List[str]) -> bool:
         """Grant access to users for a room."""
         try:
-            # Get current room data
-            response = self.supabase.table("rooms").select("allowed_users").eq("name", room_name).execute()
-            if not response.data:
+            # Get the current access list
+            current_users = self.backend.get_room_allowed_users(room_name)
+            if current_users is None:
                 return False
                 
-            current_users = response.data[0].get("allowed_users", [])
             # Add new users to allowed users list
             updated_users = list(set(current_users + usernames))
             
             # Update room with new allowed users
-            self.supabase.table("rooms").update({"allowed_users": updated_users}).eq("name", room_name).execute()
+            self.backend.update_room_allowed_users(room_name, updated_users)
+            if self.room_access is not None:
+                self.room_access.grant(room_name, usernames)
             return True
         except Exception as e:
             print(f"Error granting room access: {e}")
             return False
     
-    def cleanup_old_messages(self) -> int:
-        """Delete messages older than 3 days (72 hours)."""
+    def grant_room_access_many(self, grants: Dict[str, List[str]]) -> Dict[str, bool]:
+        """Grant access to several rooms (room name -> usernames) with one read and one write.
+        
+        Returns whether access was granted for each room; rooms that don't exist are not.
+        """
+        results = {room_name: False for room_name in grants}
         try:
+            current = self.backend.get_rooms_allowed_users(list(grants))
+            updated = {
+                room_name: list(set(current_users + grants[room_name]))
+                for room_name, current_users in current.items()
+            }
+            if updated:
+                self.backend.update_rooms_allowed_users(updated)
+            for room_name in updated:
+                results[room_name] = True
+                if self.room_access is not None:
+                    self.room_access.grant(room_name, grants[room_name])
+        except Exception as e:
+            print(f"Error granting room access: {e}")
+        return results
+    
+    def cleanup_old_messages(self, max_batches: Optional[int] = None) -> int:
+        """Delete messages older than 3 days (72 hours), archiving them first if ARCHIVE_PATH is set.
+        
+        Rows are deleted in bounded id-range batches that only return counts.
+        A purge stopped by max_batches or a pause resumes from its checkpoint
+        on the next call.
+        """
+        try:
+            # Deleted rooms come first, so their names can be reused
+            self.finish_room_deletions(max_batches)
+            
             # Calculate the cutoff date (3 days ago)
             cutoff_date = datetime.utcnow() - timedelta(days=3)
             
             # Delete old messages from rooms
-            room_response = self.supabase.table("messages").delete().lt("timestamp", cutoff_date.isoformat()).execute()
-            room_deleted_count = len(room_response.data) if room_response.data else 0
+            room_deleted_count = self.retention.purge_expired("messages", cutoff_date.isoformat(), max_batches)
             
             # Delete old direct messages
-            dm_response = self.supabase.table("direct_messages").delete().lt("timestamp", cutoff_date.isoformat()).execute()
-            dm_deleted_count = len(dm_response.data) if dm_response.data else 0
+            dm_deleted_count = self.retention.purge_expired("direct_messages", cutoff_date.isoformat(), max_batches)
+            
+            # Expired rows may still sit in the shared room buffers
+            if self.timeline is not None and room_deleted_count:
+                self.timeline.clear()
+            
+            # Merge the search index segments left sparse by the deletes
+            if room_deleted_count or dm_deleted_count:
+                self.backend.optimize_search_index()
             
             return room_deleted_count + dm_deleted_count
         except Exception as e:
             print(f"Error cleaning up old messages: {e}")
             return 0
 
-# Global database instance
-db_manager = DatabaseManager()
\ No newline at end of file
+# Time every public DatabaseManager call as db.<method>
+instrument_methods(DatabaseManager, "db", get_metrics)
+
+# Startup timings of this server process, for admin views
+STARTUP_METRICS: Dict[str, float] = {}
+
+@st.cache_resource
+def get_db_manager() -> DatabaseManager:
+    """Build the DatabaseManager shared by all sessions of this server process.
+    
+    Construction only wires up caches and queues; the backend connects on
+    first use (see warm_up).
+    """
+    from admission import get_auth_admission
+    from broker import get_broker
+    from cache import get_room_access_index, get_timeline_cache
+    started = time.perf_counter()
+    manager = DatabaseManager(
+        timeline=get_timeline_cache(),
+        room_access=get_room_access_index(),
+        auth_admission=get_auth_admission(),
+        broker=get_broker()
+    )
+    if str(get_setting("WRITE_BEHIND_ENABLED", "true")).lower() == "true":
+        manager.enable_write_behind(
+            max_batch=get_int_setting("WRITE_BEHIND_MAX_BATCH", 100),
+            flush_interval=get_float_setting("WRITE_BEHIND_FLUSH_SECONDS", 0.005),
+            max_pending=get_int_setting("WRITE_BEHIND_MAX_PENDING", 10000)
+        )
+    STARTUP_METRICS["manager_build_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return manager
+
+def warm_up() -> bool:
+    """Connect the shared manager's backend and load the room access index ahead of the first request."""
+    started = time.perf_counter()
+    manager = get_db_manager()
+    try:
+        if manager.room_access is not None:
+            manager._load_room_access()
+        else:
+            manager.backend.list_rooms()
+        return True
+    except Exception as e:
+        print(f"Error warming up database: {e}")
+        return False
+    finally:
+        STARTUP_METRICS["warm_up_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"Database warm-up finished in {STARTUP_METRICS['warm_up_ms']} ms")
+
+@st.cache_resource
+def start_warm_up() -> threading.Thread:
+    """Run warm_up once per server process on a background thread, so the first page isn't blocked."""
+    thread = threading.Thread(target=warm_up, name="db-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+class LazyDatabaseManager:
+    """Stand-in for the shared DatabaseManager that builds it on first attribute access."""
+    
+    def __getattr__(self, name):
+        return getattr(get_db_manager(), name)
+
+# Global database instance (built lazily, once per server process)
+db_manager = LazyDatabaseManager()
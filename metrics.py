@@ -0,0 +1,235 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+import streamlit as st
+
+from config import get_float_setting, get_int_setting, get_setting
+
+# Upper bounds (seconds) of the exported latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+class OperationStats:
+    """Latency, error and result row-count statistics of one operation.
+
+    Percentiles come from a rolling window of the most recent samples, so
+    they follow regressions instead of averaging them away; counts, sums
+    and histogram buckets are cumulative, as Prometheus expects.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.samples = deque(maxlen=window)
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.rows = 0
+        self.sized = 0
+
+    def observe(self, seconds: float, error: bool = False, rows: Optional[int] = None) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+        self.total_seconds += seconds
+        if error:
+            self.errors += 1
+        if rows is not None:
+            self.rows += rows
+            self.sized += 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+
+    def summary(self) -> Dict:
+        ordered = sorted(self.samples)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+            "avg_rows": round(self.rows / self.sized, 1) if self.sized else None
+        }
+
+class MetricsRegistry:
+    """Process-wide latency and error statistics keyed by operation name."""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.operations: Dict[str, OperationStats] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, error: bool = False, rows: Optional[int] = None) -> None:
+        with self.lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats(self.window)
+            stats.observe(seconds, error, rows)
+
+    @contextmanager
+    def timed(self, name: str):
+        """Time a block; an exception escaping it counts as an error."""
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, error)
+
+    def summary(self) -> List[Dict]:
+        """Per-operation stats, slowest p95 first."""
+        with self.lock:
+            rows = [dict(operation=name, **stats.summary()) for name, stats in self.operations.items()]
+        return sorted(rows, key=lambda row: row["p95_ms"], reverse=True)
+
+    def prometheus_text(self) -> str:
+        """Render every operation in the Prometheus text exposition format."""
+        lines = [
+            "# HELP tca_operation_seconds Latency of instrumented operations.",
+            "# TYPE tca_operation_seconds histogram"
+        ]
+        quantiles, errors, rows = [], [], []
+        with self.lock:
+            operations = sorted(self.operations.items())
+            for name, stats in operations:
+                label = f'op="{name}"'
+                cumulative = 0
+                for bound, bucket in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += bucket
+                    lines.append(f'tca_operation_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'tca_operation_seconds_bucket{{{label},le="+Inf"}} {stats.count}')
+                lines.append(f"tca_operation_seconds_sum{{{label}}} {stats.total_seconds:.6f}")
+                lines.append(f"tca_operation_seconds_count{{{label}}} {stats.count}")
+                ordered = sorted(stats.samples)
+                for fraction in (0.5, 0.95, 0.99):
+                    quantiles.append(
+                        f'tca_operation_recent_seconds{{{label},quantile="{fraction}"}} {percentile(ordered, fraction):.6f}'
+                    )
+                errors.append(f"tca_operation_errors_total{{{label}}} {stats.errors}")
+                rows.append(f"tca_operation_rows_total{{{label}}} {stats.rows}")
+        lines += ["# HELP tca_operation_recent_seconds Latency percentiles over the most recent calls.",
+                  "# TYPE tca_operation_recent_seconds gauge"] + quantiles
+        lines += ["# HELP tca_operation_errors_total Failed calls.",
+                  "# TYPE tca_operation_errors_total counter"] + errors
+        lines += ["# HELP tca_operation_rows_total Rows returned by calls that return collections.",
+                  "# TYPE tca_operation_rows_total counter"] + rows
+        return "\n".join(lines) + "\n"
+
+def _result_rows(result) -> Optional[int]:
+    return len(result) if isinstance(result, (list, tuple, dict, set)) else None
+
+def instrument_methods(cls, prefix: str, registry: Callable[[], MetricsRegistry]) -> None:
+    """Wrap every public method of cls so each call records its latency and the number of rows it returned.
+
+    registry is called once, on the first timed call, so instrumenting a
+    class at import time doesn't build the registry. Generator methods are
+    left alone, since only their creation could be timed.
+    """
+    registry = functools.lru_cache(maxsize=1)(registry)
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.isfunction(method) or inspect.isgeneratorfunction(method):
+            continue
+        setattr(cls, name, _timed_method(method, f"{prefix}.{name}", registry))
+
+def _timed_method(method, operation: str, registry: Callable[[], MetricsRegistry]):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            registry().observe(operation, time.perf_counter() - started, error=True)
+            raise
+        registry().observe(operation, time.perf_counter() - started, rows=_result_rows(result))
+        return result
+    return wrapper
+
+@st.cache_resource
+def get_metrics() -> MetricsRegistry:
+    """Return the metrics registry shared by all sessions of this server process."""
+    return MetricsRegistry(window=get_int_setting("METRICS_WINDOW", 1024))
+
+class MetricsExporter:
+    """Publishes the registry in Prometheus format over HTTP and/or to a file.
+
+    The HTTP endpoint serves GET /metrics on port; the file is rewritten
+    every interval_seconds (atomically, for node_exporter's textfile
+    collector).
+    """
+
+    def __init__(self, registry: MetricsRegistry, port: Optional[int] = None, path: Optional[str] = None,
+                 interval_seconds: float = 15.0):
+        self.registry = registry
+        self.port = port
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.server: Optional[ThreadingHTTPServer] = None
+        if port:
+            self.server = ThreadingHTTPServer(("0.0.0.0", port), self._handler())
+            threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        if path:
+            threading.Thread(target=self._write_loop, name="metrics-file", daemon=True).start()
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def write_file(self) -> None:
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.registry.prometheus_text())
+        os.replace(temp_path, self.path)
+
+    def _write_loop(self):
+        while True:
+            try:
+                self.write_file()
+            except Exception as e:
+                print(f"Error writing metrics file: {e}")
+            time.sleep(self.interval_seconds)
+
+@st.cache_resource
+def start_metrics_exporter(_registry: MetricsRegistry) -> Optional[MetricsExporter]:
+    """Start the Prometheus exporter once per server process if METRICS_PORT or METRICS_EXPORT_PATH is set."""
+    port = get_int_setting("METRICS_PORT", 0)
+    path = get_setting("METRICS_EXPORT_PATH")
+    if not port and not path:
+        return None
+    try:
+        return MetricsExporter(_registry, port=port or None, path=path,
+                               interval_seconds=get_float_setting("METRICS_EXPORT_SECONDS", 15.0))
+    except Exception as e:
+        print(f"Error starting metrics exporter: {e}")
+        return None
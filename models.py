@@ -0,0 +1,99 @@
+from typing import Dict, List, Optional
+
+class User:
+    """A user account as seen by the app (never carries the password hash)."""
+
+    __slots__ = ("id", "username", "role", "created_at")
+
+    def __init__(self, id: Optional[int], username: str, role: str = "user", created_at: Optional[str] = None):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.created_at = created_at
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "User":
+        return cls(row.get("id"), row["username"], row.get("role") or "user", row.get("created_at"))
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == "admin"
+
+    def to_dict(self) -> Dict:
+        return {"id": self.id, "username": self.username, "role": self.role, "created_at": self.created_at}
+
+    def __repr__(self) -> str:
+        return f"User({self.username!r}, role={self.role!r})"
+
+class Room:
+    """A chat room and its access list."""
+
+    __slots__ = ("name", "allowed_users", "is_public")
+
+    def __init__(self, name: str, allowed_users: Optional[List[str]] = None, is_public: bool = False):
+        self.name = name
+        self.allowed_users = allowed_users or []
+        self.is_public = is_public
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "Room":
+        return cls(row["name"], row.get("allowed_users") or [], bool(row.get("is_public", False)))
+
+    def __repr__(self) -> str:
+        return f"Room({self.name!r}, public={self.is_public})"
+
+class Message:
+    """A room message or direct message.
+
+    For direct messages `username` is the sender, and `recipient` and
+    `conversation` are set; for room messages `room` is set.
+    """
+
+    __slots__ = ("id", "username", "content", "timestamp", "room", "recipient", "conversation")
+
+    def __init__(self, id: int, username: str, content: str, timestamp: Optional[str],
+                 room: Optional[str] = None, recipient: Optional[str] = None, conversation: Optional[str] = None):
+        self.id = id
+        self.username = username
+        self.content = content
+        self.timestamp = timestamp
+        self.room = room
+        self.recipient = recipient
+        self.conversation = conversation
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "Message":
+        if "sender" in row:
+            return cls(row["id"], row["sender"], row["content"], row.get("timestamp"),
+                       recipient=row.get("recipient"), conversation=row.get("conversation"))
+        return cls(row["id"], row["username"], row["content"], row.get("timestamp"), room=row.get("room"))
+
+    @property
+    def sender(self) -> str:
+        return self.username
+
+    @property
+    def is_direct(self) -> bool:
+        return self.recipient is not None
+
+    def to_dict(self) -> Dict:
+        if self.is_direct:
+            return {"id": self.id, "sender": self.username, "recipient": self.recipient,
+                    "conversation": self.conversation, "content": self.content, "timestamp": self.timestamp}
+        return {"id": self.id, "room": self.room, "username": self.username,
+                "content": self.content, "timestamp": self.timestamp}
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Message) and self.id == other.id and self.is_direct == other.is_direct
+
+    def __hash__(self) -> int:
+        return hash((self.id, self.is_direct))
+
+    def __repr__(self) -> str:
+        return f"Message({self.id}, {self.username!r}, {self.content!r})"
+
+# Columns each query needs, so backends never fetch more than the records hold
+USER_COLUMNS = "id, username, role, created_at"
+ROOM_COLUMNS = "name, allowed_users, is_public"
+MESSAGE_COLUMNS = "id, room, username, content, timestamp"
+DIRECT_MESSAGE_COLUMNS = "id, sender, recipient, conversation, content, timestamp"
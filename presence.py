@@ -0,0 +1,238 @@
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+import streamlit as st
+
+from config import get_float_setting, get_setting
+
+# Location of sessions that are logged in but not in a room or DM
+LOBBY_LOCATION = "lobby"
+
+class PresenceEntry:
+    """Where one session is and which expiry bucket it is filed under."""
+
+    __slots__ = ("session", "username", "location", "bucket", "synced_location", "synced_until")
+
+    def __init__(self, session: str, username: str, location: str, bucket: int):
+        self.session = session
+        self.username = username
+        self.location = location
+        self.bucket = bucket
+        self.synced_location: Optional[str] = None
+        self.synced_until = 0.0
+
+class PresenceTracker:
+    """In-memory record of which users are where, kept alive by heartbeats.
+
+    Each session is filed in the expiry bucket its last heartbeat's TTL ends
+    in. Expiring drops whole buckets as time passes them, so heartbeats and
+    expiry each cost O(1) per session no matter how many are online; a
+    session lingers at most bucket_seconds past its TTL. Presence reported
+    by other server processes (see PresenceSync) is merged into reads.
+    """
+
+    def __init__(self, ttl_seconds: float = 30.0, bucket_seconds: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.bucket_seconds = bucket_seconds
+        self.clock = clock
+        self.entries: Dict[str, PresenceEntry] = {}
+        self.buckets: Dict[int, Set[str]] = {}
+        # location -> username -> number of that user's sessions there
+        self.locations: Dict[str, Dict[str, int]] = {}
+        self.remote: Dict[str, Set[str]] = {}
+        self.left: Set[str] = set()
+        self.next_bucket = self._bucket(self.clock())
+        self.lock = threading.Lock()
+        self.counters = {"heartbeats": 0, "expired": 0}
+
+    def _bucket(self, moment: float) -> int:
+        return int(moment // self.bucket_seconds)
+
+    def _place(self, entry: PresenceEntry) -> None:
+        users = self.locations.setdefault(entry.location, {})
+        users[entry.username] = users.get(entry.username, 0) + 1
+
+    def _unplace(self, entry: PresenceEntry) -> None:
+        users = self.locations.get(entry.location, {})
+        remaining = users.get(entry.username, 0) - 1
+        if remaining > 0:
+            users[entry.username] = remaining
+        else:
+            users.pop(entry.username, None)
+            if not users:
+                self.locations.pop(entry.location, None)
+
+    def _remove(self, session: str) -> Optional[PresenceEntry]:
+        entry = self.entries.pop(session, None)
+        if entry is not None:
+            self.buckets.get(entry.bucket, set()).discard(session)
+            self._unplace(entry)
+        return entry
+
+    def _expire(self, now: float) -> None:
+        """Drop every session filed in a bucket that time has passed."""
+        current = self._bucket(now)
+        if current - self.next_bucket > len(self.buckets):
+            # Idle for a long time: visit only the buckets that exist
+            due = sorted(bucket for bucket in self.buckets if bucket < current)
+        else:
+            due = range(self.next_bucket, current)
+        for bucket in due:
+            for session in self.buckets.pop(bucket, ()):
+                entry = self.entries.pop(session)
+                self._unplace(entry)
+                self.counters["expired"] += 1
+        self.next_bucket = max(self.next_bucket, current)
+
+    def heartbeat(self, session: str, username: str, location: str) -> None:
+        """Record that a session is active at location; cheap enough to call on every rerun."""
+        now = self.clock()
+        bucket = self._bucket(now + self.ttl_seconds) + 1
+        with self.lock:
+            self._expire(now)
+            self.counters["heartbeats"] += 1
+            self.left.discard(session)
+            entry = self.entries.get(session)
+            if entry is not None and entry.username == username and entry.location == location:
+                if entry.bucket != bucket:
+                    self.buckets.get(entry.bucket, set()).discard(session)
+                    self.buckets.setdefault(bucket, set()).add(session)
+                    entry.bucket = bucket
+                return
+            if entry is not None:
+                self._remove(session)
+            entry = PresenceEntry(session, username, location, bucket)
+            self.entries[session] = entry
+            self.buckets.setdefault(bucket, set()).add(session)
+            self._place(entry)
+
+    def leave(self, session: str) -> None:
+        """Forget a session right away, e.g. on logout."""
+        with self.lock:
+            if self._remove(session) is not None:
+                self.left.add(session)
+
+    def occupants(self, location: str) -> List[str]:
+        """Names of the users present at a location, on this or any synced server process."""
+        with self.lock:
+            self._expire(self.clock())
+            names = set(self.locations.get(location, {})) | self.remote.get(location, set())
+        return sorted(names)
+
+    def occupancy(self) -> Dict[str, int]:
+        """Number of distinct users present at each location."""
+        with self.lock:
+            self._expire(self.clock())
+            locations = set(self.locations) | set(self.remote)
+            return {
+                location: len(set(self.locations.get(location, {})) | self.remote.get(location, set()))
+                for location in locations
+            }
+
+    def online_count(self) -> int:
+        with self.lock:
+            self._expire(self.clock())
+            names = set()
+            for users in self.locations.values():
+                names.update(users)
+            for users in self.remote.values():
+                names.update(users)
+            return len(names)
+
+    def sync_batch(self, horizon_seconds: float) -> Dict:
+        """Entries whose shared copy is missing, outdated or expires within horizon_seconds, and sessions that left.
+
+        Marks the returned entries as synced until their new expiry.
+        """
+        wall_now = time.time()
+        with self.lock:
+            self._expire(self.clock())
+            upserts = []
+            for entry in self.entries.values():
+                if entry.synced_location == entry.location and entry.synced_until - wall_now > horizon_seconds:
+                    continue
+                entry.synced_location = entry.location
+                entry.synced_until = wall_now + self.ttl_seconds
+                upserts.append({
+                    "session": entry.session,
+                    "username": entry.username,
+                    "location": entry.location,
+                    "expires_at": datetime.utcfromtimestamp(entry.synced_until).isoformat()
+                })
+            left, self.left = list(self.left), set()
+        return {"upserts": upserts, "left": left}
+
+    def set_remote(self, rows: List[Dict]) -> None:
+        """Replace the presence reported by other server processes."""
+        remote: Dict[str, Set[str]] = {}
+        for row in rows:
+            remote.setdefault(row["location"], set()).add(row["username"])
+        with self.lock:
+            self.remote = remote
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return dict(self.counters, sessions=len(self.entries), buckets=len(self.buckets),
+                        remote_locations=len(self.remote))
+
+class PresenceSync:
+    """Shares presence between server processes through the storage backend.
+
+    Every interval_seconds one batch upsert refreshes only the sessions
+    whose shared row is new, moved or about to expire, one delete removes
+    sessions that left, and one read brings in the other processes' live
+    sessions. With a single server process there is nothing to share and
+    this never runs. The backend is taken from manager (the shared
+    DatabaseManager) on each sync, so starting this doesn't connect.
+    """
+
+    def __init__(self, tracker: PresenceTracker, manager, interval_seconds: float = 5.0):
+        self.tracker = tracker
+        self.manager = manager
+        self.interval_seconds = interval_seconds
+        self.origin = uuid.uuid4().hex[:8]
+        self.counters = {"syncs": 0, "rows_written": 0, "errors": 0}
+        self.thread = threading.Thread(target=self._run, name="presence-sync", daemon=True)
+        self.thread.start()
+
+    def sync(self) -> None:
+        backend = self.manager.backend
+        batch = self.tracker.sync_batch(horizon_seconds=2 * self.interval_seconds)
+        if batch["upserts"]:
+            backend.upsert_presence([dict(row, origin=self.origin) for row in batch["upserts"]])
+        if batch["left"]:
+            backend.delete_presence(batch["left"])
+        now = datetime.utcnow().isoformat()
+        backend.delete_expired_presence(now)
+        rows = backend.list_presence(now)
+        self.tracker.set_remote([row for row in rows if row["origin"] != self.origin])
+        self.counters["syncs"] += 1
+        self.counters["rows_written"] += len(batch["upserts"])
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"Error syncing presence: {e}")
+            time.sleep(self.interval_seconds)
+
+@st.cache_resource
+def get_presence_tracker() -> PresenceTracker:
+    """Return the presence tracker shared by all sessions of this server process."""
+    return PresenceTracker(
+        ttl_seconds=get_float_setting("PRESENCE_TTL_SECONDS", 30.0),
+        bucket_seconds=get_float_setting("PRESENCE_BUCKET_SECONDS", 5.0)
+    )
+
+@st.cache_resource
+def start_presence_sync(_tracker: PresenceTracker, _manager) -> Optional[PresenceSync]:
+    """Start sharing presence through the backend once per server process if PRESENCE_SYNC_ENABLED is set."""
+    if str(get_setting("PRESENCE_SYNC_ENABLED", "false")).lower() != "true":
+        return None
+    return PresenceSync(_tracker, _manager, interval_seconds=get_float_setting("PRESENCE_SYNC_SECONDS", 5.0))
@@ -0,0 +1,84 @@
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+from models import Message
+
+def format_timestamp(timestamp) -> str:
+    """Format a stored ISO timestamp as HH:MM:SS for display."""
+    try:
+        return datetime.fromisoformat(str(timestamp)).strftime("%H:%M:%S")
+    except ValueError:
+        return str(timestamp)
+
+def format_message(message: Message) -> str:
+    """Format one message as a terminal line."""
+    return f"[{format_timestamp(message.timestamp)}] {message.username}: {message.content}"
+
+class TerminalRenderer:
+    """Formats a session's message buffer into one preformatted block.
+
+    Formatted lines are cached per message, so a rerun only formats the
+    messages that arrived since the previous one, and only the newest
+    window_size messages (plus any scrollback the user asked for with
+    /history) are rendered, so the cost of a rerun doesn't grow with the
+    buffer.
+    """
+
+    def __init__(self, window_size: int = 100):
+        self.window_size = window_size
+        self.extra_lines = 0
+        self.lines: Dict[Message, str] = {}
+        self.block_key: Optional[Tuple] = None
+        self.block = ""
+        self.formatted = 0
+
+    def expand(self, count: int) -> None:
+        """Show count more older lines above the window (after /history)."""
+        self.extra_lines += count
+
+    def reset(self) -> None:
+        """Forget the scrollback and cached lines (e.g. when switching rooms)."""
+        self.extra_lines = 0
+        self.lines.clear()
+        self.block_key = None
+        self.block = ""
+
+    def hidden_count(self, messages) -> int:
+        """How many buffered messages are above the visible window."""
+        return max(0, len(messages) - self.window_size - self.extra_lines)
+
+    def _visible(self, messages) -> Tuple[List[Message], int]:
+        hidden = self.hidden_count(messages)
+        # Walk back from the newest end so the cost is bounded by the window
+        visible = list(islice(reversed(messages), len(messages) - hidden))
+        visible.reverse()
+        return visible, hidden
+
+    def _line(self, message: Message) -> str:
+        line = self.lines.get(message)
+        if line is None:
+            line = format_message(message)
+            self.lines[message] = line
+            self.formatted += 1
+        return line
+
+    def render(self, messages) -> str:
+        """Return the text block for the visible window of messages."""
+        visible, hidden = self._visible(messages)
+        if not visible:
+            return ""
+        key = (visible[0].id, visible[-1].id, len(visible), hidden)
+        if key == self.block_key:
+            return self.block
+
+        lines = [self._line(message) for message in visible]
+        if hidden:
+            lines.insert(0, f"... {hidden} earlier messages hidden (/history to show)")
+        if len(self.lines) > 2 * len(visible):
+            # Drop lines of messages that scrolled out of the window
+            keep = set(visible)
+            self.lines = {message: line for message, line in self.lines.items() if message in keep}
+        self.block_key = key
+        self.block = "\n".join(lines)
+        return self.block
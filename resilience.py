@@ -0,0 +1,193 @@
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from metrics import MetricsRegistry
+from storage import StorageBackend
+
+class CircuitOpenError(ConnectionError):
+    """Raised without calling the backend while the circuit breaker is open."""
+
+def is_transient(error: Exception) -> bool:
+    """Whether an error means the backend is unreachable or overloaded rather than the call being wrong."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, sqlite3.OperationalError):
+        # Only lock contention passes; missing tables or bad SQL fail the same way every time
+        message = str(error).lower()
+        return "database is locked" in message or "database is busy" in message
+    try:
+        import httpx
+        if isinstance(error, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    return str(getattr(error, "code", "")) in {"429", "500", "502", "503", "504"}
+
+class CircuitBreaker:
+    """Fails calls fast after repeated transient failures, then lets a trial call through.
+
+    After failure_threshold consecutive transient failures the circuit opens
+    and calls fail immediately with CircuitOpenError. Once reset_seconds have
+    passed, one trial call is allowed: success closes the circuit again,
+    failure keeps it open for another reset_seconds.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 15.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+        self.counters = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_seconds:
+                return "half_open"
+            return "open"
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go to the backend now."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at >= self.reset_seconds and not self.trial_running:
+                self.trial_running = True
+                return
+            self.counters["rejected"] += 1
+        raise CircuitOpenError("storage backend unavailable (circuit open)")
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.counters["opened"] += 1
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def stats(self) -> Dict:
+        state = self.state
+        with self.lock:
+            return dict(self.counters, state=state, consecutive_failures=self.failures)
+
+class ResilientBackend(StorageBackend):
+    """Storage backend wrapper adding reconnects, retries, deadlines and a circuit breaker.
+
+    The wrapped backend is built by connect_fn on first use and rebuilt
+    after a failed connection, so a backend that was down at startup comes
+    back by itself. Idempotent reads are retried on transient errors with
+    jittered exponential backoff, and no retry starts later than
+    deadline_seconds after the first attempt; writes are tried once so
+    nothing is stored twice. All calls go through one circuit breaker.
+    With a metrics registry, every call's total latency (retries included)
+    is recorded as backend.<method>, failed calls as errors.
+    """
+
+    READ_METHODS = frozenset({
+        "user_exists", "get_user_credentials", "get_password_hash", "find_existing_usernames",
+        "list_rooms", "list_user_rooms", "room_exists", "get_room_allowed_users",
+        "find_existing_room_names", "get_rooms_allowed_users",
+        "get_room_messages", "get_room_messages_since", "get_direct_messages",
+        "get_direct_messages_since", "get_recent_direct_messages", "find_purge_batch", "get_id_range", "list_job_runs",
+        "list_presence", "search_messages"
+    })
+
+    def __init__(self, connect_fn: Callable[[], Optional[StorageBackend]], breaker: Optional[CircuitBreaker] = None,
+                 retry_attempts: int = 3, retry_base_seconds: float = 0.1, deadline_seconds: float = 8.0,
+                 metrics: Optional[MetricsRegistry] = None):
+        self.connect_fn = connect_fn
+        self.metrics = metrics
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_attempts = retry_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.deadline_seconds = deadline_seconds
+        self.backend: Optional[StorageBackend] = None
+        self.connect_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "connects": 0}
+
+    @property
+    def name(self) -> str:
+        return self.backend.name if self.backend is not None else "disconnected"
+
+    def _connected(self) -> StorageBackend:
+        if self.backend is None:
+            with self.connect_lock:
+                if self.backend is None:
+                    backend = self.connect_fn()
+                    if backend is None:
+                        raise ConnectionError("storage backend is not configured or failed to connect")
+                    self.backend = backend
+                    with self.lock:
+                        self.counters["connects"] += 1
+        return self.backend
+
+    def _call(self, method_name: str, *args, **kwargs):
+        if self.metrics is None:
+            return self._attempt(method_name, *args, **kwargs)
+        with self.metrics.timed(f"backend.{method_name}"):
+            return self._attempt(method_name, *args, **kwargs)
+
+    def _attempt(self, method_name: str, *args, **kwargs):
+        attempts = self.retry_attempts if method_name in self.READ_METHODS else 1
+        deadline = time.monotonic() + self.deadline_seconds
+        with self.lock:
+            self.counters["calls"] += 1
+        for attempt in range(attempts):
+            self.breaker.before_call()
+            try:
+                result = getattr(self._connected(), method_name)(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # The backend answered; the call itself was rejected
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                with self.lock:
+                    self.counters["failures"] += 1
+                if self.backend is None or self.breaker.state != "closed":
+                    # Not connected, or this failure opened the circuit: retrying can't help
+                    raise
+                delay = min(self.retry_base_seconds * (2 ** attempt), 2.0) * random.uniform(0.5, 1.0)
+                if attempt + 1 >= attempts or time.monotonic() + delay >= deadline:
+                    raise
+                with self.lock:
+                    self.counters["retries"] += 1
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def stats(self) -> Dict:
+        """Call, retry and breaker counters for admin views."""
+        with self.lock:
+            counters = dict(self.counters)
+        return dict(counters, backend=self.name, breaker=self.breaker.stats())
+
+def _delegate(method_name: str):
+    def method(self, *args, **kwargs):
+        return self._call(method_name, *args, **kwargs)
+    method.__name__ = method_name
+    method.__doc__ = getattr(StorageBackend, method_name).__doc__
+    return method
+
+# Route every StorageBackend method through ResilientBackend._call
+for _method_name, _value in list(vars(StorageBackend).items()):
+    if callable(_value) and not _method_name.startswith("_"):
+        setattr(ResilientBackend, _method_name, _delegate(_method_name))
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from archive import MessageArchive
+from storage import StorageBackend
+
+class PurgeCheckpoint:
+    """Progress of one purge: which rows it targets and the last id range it deleted."""
+
+    def __init__(self, table: str, cutoff: Optional[str] = None, room: Optional[str] = None,
+                 last_id: int = 0, deleted: int = 0, done: bool = False):
+        self.table = table
+        self.cutoff = cutoff
+        self.room = room
+        self.last_id = last_id
+        self.deleted = deleted
+        self.done = done
+
+    @property
+    def key(self) -> str:
+        return f"{self.table}:room={self.room}" if self.room is not None else f"{self.table}:expired"
+
+    def to_dict(self) -> Dict:
+        return {"table": self.table, "cutoff": self.cutoff, "room": self.room,
+                "last_id": self.last_id, "deleted": self.deleted, "done": self.done}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PurgeCheckpoint":
+        return cls(**data)
+
+class RetentionEngine:
+    """Deletes rows in bounded id-range batches, asking the backend only for counts.
+
+    Each batch first reads just the ids of the next batch_size matching rows,
+    then deletes that id range, so no statement locks or returns more than
+    one batch. The engine sleeps pause_seconds between batches to leave room
+    for chat traffic. Unfinished purges keep a checkpoint (optionally saved
+    to checkpoint_path) and pick up where they stopped on the next run, and
+    pause() stops running purges after their current batch. With an
+    archive, each batch of expired rows is copied into it before the batch
+    is deleted; rows of deleted rooms are not archived.
+    """
+
+    def __init__(self, backend: StorageBackend, batch_size: int = 1000, pause_seconds: float = 0.05,
+                 checkpoint_path: Optional[str] = None, archive: Optional[MessageArchive] = None):
+        self.backend = backend
+        self.archive = archive
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.checkpoint_path = checkpoint_path
+        self.checkpoints: Dict[str, PurgeCheckpoint] = self._load_checkpoints()
+        self.paused = threading.Event()
+        self.lock = threading.Lock()
+
+    def _load_checkpoints(self) -> Dict[str, PurgeCheckpoint]:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return {}
+        try:
+            with open(self.checkpoint_path) as f:
+                return {key: PurgeCheckpoint.from_dict(data) for key, data in json.load(f).items()}
+        except Exception as e:
+            print(f"Error loading purge checkpoints: {e}")
+            return {}
+
+    def _save_checkpoints(self):
+        if not self.checkpoint_path:
+            return
+        try:
+            with open(self.checkpoint_path, "w") as f:
+                json.dump({key: checkpoint.to_dict() for key, checkpoint in self.checkpoints.items()}, f)
+        except Exception as e:
+            print(f"Error saving purge checkpoints: {e}")
+
+    def pause(self):
+        """Stop running purges after their current batch; their checkpoints are kept."""
+        self.paused.set()
+
+    def resume(self):
+        """Allow purges to run again."""
+        self.paused.clear()
+
+    def purge_expired(self, table: str, cutoff: str, max_batches: Optional[int] = None) -> int:
+        """Delete rows of table with timestamp before cutoff and return how many were deleted."""
+        return self._run(self._checkpoint_for(PurgeCheckpoint(table, cutoff=cutoff)), max_batches)
+
+    def purge_room(self, room: str, max_batches: Optional[int] = None) -> int:
+        """Delete every message of a room and return how many were deleted."""
+        return self._run(self._checkpoint_for(PurgeCheckpoint("messages", room=room)), max_batches)
+
+    def pending_rooms(self) -> List[str]:
+        """Rooms whose message purge stopped before it finished (paused or out of batches)."""
+        with self.lock:
+            return [checkpoint.room for checkpoint in self.checkpoints.values() if checkpoint.room is not None]
+
+    def _checkpoint_for(self, checkpoint: PurgeCheckpoint) -> PurgeCheckpoint:
+        """Resume an unfinished purge of the same rows from its last id, if there is one."""
+        with self.lock:
+            previous = self.checkpoints.get(checkpoint.key)
+        if previous is None or previous.done:
+            return checkpoint
+        previous.cutoff = checkpoint.cutoff
+        return previous
+
+    def _run(self, checkpoint: PurgeCheckpoint, max_batches: Optional[int]) -> int:
+        batches = 0
+        deleted = 0
+        while not self.paused.is_set() and (max_batches is None or batches < max_batches):
+            id_range = self.backend.find_purge_batch(
+                checkpoint.table, checkpoint.last_id, self.batch_size, checkpoint.cutoff, checkpoint.room
+            )
+            if id_range is None:
+                checkpoint.done = True
+                break
+            min_id, max_id = id_range
+            if self.archive is not None and checkpoint.cutoff is not None:
+                # A failed archive write raises before anything is deleted
+                self.archive.append(checkpoint.table, self.backend.get_id_range(
+                    checkpoint.table, min_id, max_id, checkpoint.cutoff, checkpoint.room
+                ))
+            count = self.backend.delete_id_range(
+                checkpoint.table, min_id, max_id, checkpoint.cutoff, checkpoint.room
+            )
+            deleted += count
+            checkpoint.deleted += count
+            checkpoint.last_id = max_id
+            batches += 1
+            with self.lock:
+                self.checkpoints[checkpoint.key] = checkpoint
+                self._save_checkpoints()
+            if self.pause_seconds:
+                time.sleep(self.pause_seconds)
+
+        with self.lock:
+            if checkpoint.done:
+                self.checkpoints.pop(checkpoint.key, None)
+            else:
+                self.checkpoints[checkpoint.key] = checkpoint
+            self._save_checkpoints()
+        return deleted
+
+    def status(self) -> Dict:
+        """Unfinished purges and whether the engine is paused, for admin views."""
+        with self.lock:
+            return {
+                "paused": self.paused.is_set(),
+                "pending": {key: checkpoint.to_dict() for key, checkpoint in self.checkpoints.items()}
+            }
@@ -0,0 +1,166 @@
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import streamlit as st
+
+from config import get_float_setting
+from storage import StorageBackend
+
+class Job:
+    """A periodic maintenance job."""
+
+    def __init__(self, name: str, fn: Callable[[], object], interval_seconds: float, jitter_seconds: float = 0.0):
+        self.name = name
+        self.fn = fn
+        self.interval_seconds = interval_seconds
+        self.jitter_seconds = jitter_seconds
+        # Spread the first run so replicas started together don't all race for the lease
+        self.next_run = time.monotonic() + random.uniform(0, jitter_seconds)
+        self.last_run: Optional[str] = None
+        self.last_status = "pending"
+        self.last_result: Optional[str] = None
+        self.last_duration_ms: Optional[float] = None
+
+    def schedule_next(self):
+        self.next_run = time.monotonic() + self.interval_seconds + random.uniform(0, self.jitter_seconds)
+
+class MaintenanceScheduler:
+    """Background thread that runs periodic jobs such as message cleanup.
+
+    Before running a job the scheduler takes a short lease on it in the
+    storage backend, which is only granted if no run has started within the
+    job's interval, so with several replicas only one of them runs each job
+    per interval. The lease lasts lease_seconds and is renewed every third
+    of that while the job runs, so if its holder dies another replica can
+    take the job over within lease_seconds rather than a whole interval.
+    Job outcomes are written next to the lease, which makes the last run
+    visible to admins on every replica.
+    """
+
+    def __init__(self, backend: StorageBackend, poll_seconds: float = 30.0, lease_seconds: float = 120.0):
+        self.backend = backend
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs: Dict[str, Job] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def add_job(self, name: str, fn: Callable[[], object], interval_seconds: float, jitter_seconds: float = 0.0):
+        """Register a job; it first runs within jitter_seconds of being added."""
+        with self.lock:
+            self.jobs[name] = Job(name, fn, interval_seconds, jitter_seconds)
+
+    def start(self):
+        """Start the scheduler thread (idempotent)."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="maintenance-scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            with self.lock:
+                due = [job for job in self.jobs.values() if job.next_run <= now]
+                next_wakeup = min([job.next_run for job in self.jobs.values()], default=now + self.poll_seconds)
+            for job in due:
+                self.run_job(job)
+            self.stopped.wait(max(0.0, min(self.poll_seconds, next_wakeup - time.monotonic())))
+
+    def run_job(self, job: Job) -> bool:
+        """Run a job now if this replica can take its lease; returns whether it ran."""
+        job.schedule_next()
+        try:
+            if not self.backend.acquire_lease(job.name, self.owner, self.lease_seconds, job.interval_seconds):
+                job.last_status = "skipped (run or leased by another replica)"
+                return False
+        except Exception as e:
+            print(f"Error acquiring lease for job {job.name}: {e}")
+            job.last_status = "error"
+            job.last_result = str(e)
+            return False
+
+        started = time.monotonic()
+        job.last_run = datetime.utcnow().isoformat()
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._renew_lease, args=(job.name, finished),
+                                     name=f"lease-{job.name}", daemon=True)
+        heartbeat.start()
+        try:
+            job.last_result = str(job.fn())
+            job.last_status = "ok"
+        except Exception as e:
+            print(f"Error running job {job.name}: {e}")
+            job.last_result = str(e)
+            job.last_status = "error"
+        finally:
+            finished.set()
+            heartbeat.join()
+        job.last_duration_ms = round((time.monotonic() - started) * 1000, 1)
+
+        try:
+            self.backend.record_job_run(job.name, self.owner, job.last_run, job.last_status, job.last_result)
+        except Exception as e:
+            print(f"Error recording run of job {job.name}: {e}")
+        return True
+
+    def _renew_lease(self, name: str, finished: threading.Event):
+        """Keep a running job's lease from expiring until finished is set."""
+        while not finished.wait(self.lease_seconds / 3):
+            try:
+                if not self.backend.renew_lease(name, self.owner, self.lease_seconds):
+                    print(f"Lost the lease on job {name} while running it")
+                    return
+            except Exception as e:
+                # Keep trying: the lease only lapses after lease_seconds without a renewal
+                print(f"Error renewing lease for job {name}: {e}")
+
+    def status(self) -> List[Dict]:
+        """Last-run status of every job, preferring the shared record written by whichever replica ran it."""
+        try:
+            shared = {row["name"]: row for row in self.backend.list_job_runs()}
+        except Exception as e:
+            print(f"Error reading job status: {e}")
+            shared = {}
+        result = []
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            record = shared.get(job.name, {})
+            result.append({
+                "job": job.name,
+                "interval_hours": round(job.interval_seconds / 3600, 2),
+                "last_run": record.get("last_run_at") or job.last_run,
+                "last_status": record.get("last_status") or job.last_status,
+                "last_result": record.get("last_result") or job.last_result,
+                "ran_by": record.get("owner"),
+                "next_run_in_minutes": round(max(0.0, job.next_run - time.monotonic()) / 60, 1)
+            })
+        return result
+
+@st.cache_resource
+def start_maintenance_scheduler(_manager) -> MaintenanceScheduler:
+    """Start the maintenance scheduler once per server process and register the periodic jobs."""
+    scheduler = MaintenanceScheduler(
+        _manager.backend,
+        poll_seconds=get_float_setting("MAINTENANCE_POLL_SECONDS", 30.0),
+        lease_seconds=get_float_setting("MAINTENANCE_LEASE_SECONDS", 120.0)
+    )
+    scheduler.add_job(
+        "message_cleanup",
+        _manager.cleanup_old_messages,
+        interval_seconds=get_float_setting("MAINTENANCE_CLEANUP_INTERVAL_SECONDS", 86400.0),
+        jitter_seconds=get_float_setting("MAINTENANCE_JITTER_SECONDS", 300.0)
+    )
+    scheduler.start()
+    return scheduler
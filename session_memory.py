@@ -0,0 +1,144 @@
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional
+
+import streamlit as st
+
+from cache import estimate_message_bytes
+from config import get_int_setting
+
+# Rough per-entry overhead of a command history string
+COMMAND_OVERHEAD_BYTES = 60
+
+def estimate_command_bytes(command: str) -> int:
+    """Approximate the memory held by one command history entry."""
+    return COMMAND_OVERHEAD_BYTES + len(command)
+
+class RingBuffer:
+    """Fixed-capacity list that drops its oldest entries and tracks their approximate size."""
+
+    def __init__(self, capacity: int, size_fn: Callable[[object], int]):
+        self.capacity = capacity
+        self.size_fn = size_fn
+        self.items = deque()
+        self.bytes = 0
+        self.evicted = 0
+
+    def append(self, item) -> None:
+        """Add a newest entry, evicting the oldest one when full."""
+        if len(self.items) >= self.capacity:
+            self.bytes -= self.size_fn(self.items.popleft())
+            self.evicted += 1
+        self.items.append(item)
+        self.bytes += self.size_fn(item)
+
+    def prepend(self, items: List) -> int:
+        """Insert older entries (oldest first) in front while there is room; returns how many fit.
+
+        Newer entries are never evicted to make room, so a full buffer keeps
+        the live end of the conversation.
+        """
+        room = max(0, self.capacity - len(self.items))
+        fitting = items[len(items) - room:] if room else []
+        for item in reversed(fitting):
+            self.items.appendleft(item)
+            self.bytes += self.size_fn(item)
+        return len(fitting)
+
+    @property
+    def is_full(self) -> bool:
+        return len(self.items) >= self.capacity
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __reversed__(self):
+        return reversed(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+class SessionMemory:
+    """The bounded message and command history of one browser session."""
+
+    def __init__(self, message_capacity: int = 500, command_capacity: int = 100):
+        self.session_key = uuid.uuid4().hex[:12]
+        self.messages = RingBuffer(message_capacity, estimate_message_bytes)
+        self.commands = RingBuffer(command_capacity, estimate_command_bytes)
+        self.username: Optional[str] = None
+        self.last_active = time.time()
+
+    def touch(self, username: Optional[str]) -> None:
+        """Record who owns the session and that it is still active."""
+        self.username = username
+        self.last_active = time.time()
+
+    @property
+    def bytes(self) -> int:
+        return self.messages.bytes + self.commands.bytes
+
+    def stats(self) -> Dict:
+        return {
+            "session": self.session_key,
+            "user": self.username,
+            "messages": len(self.messages),
+            "commands": len(self.commands),
+            "evicted": self.messages.evicted + self.commands.evicted,
+            "kb": round(self.bytes / 1024, 1),
+            "idle_minutes": round((time.time() - self.last_active) / 60, 1)
+        }
+
+class SessionRegistry:
+    """Weak index of every live session's memory, for admin views.
+
+    Entries disappear on their own once Streamlit drops a closed session's
+    state, so the registry never keeps a session alive.
+    """
+
+    def __init__(self, message_capacity: int = 500, command_capacity: int = 100):
+        self.message_capacity = message_capacity
+        self.command_capacity = command_capacity
+        self.sessions: "weakref.WeakValueDictionary[str, SessionMemory]" = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+
+    def create(self) -> SessionMemory:
+        """Create and register the memory of a new session."""
+        memory = SessionMemory(self.message_capacity, self.command_capacity)
+        with self.lock:
+            self.sessions[memory.session_key] = memory
+        return memory
+
+    def _live(self) -> Iterable[SessionMemory]:
+        with self.lock:
+            return list(self.sessions.values())
+
+    def heaviest(self, limit: int = 10) -> List[Dict]:
+        """Stats of the sessions holding the most memory, heaviest first."""
+        sessions = sorted(self._live(), key=lambda memory: memory.bytes, reverse=True)
+        return [memory.stats() for memory in sessions[:limit]]
+
+    def totals(self) -> Dict:
+        sessions = self._live()
+        return {
+            "sessions": len(sessions),
+            "messages": sum(len(memory.messages) for memory in sessions),
+            "kb": round(sum(memory.bytes for memory in sessions) / 1024, 1)
+        }
+
+@st.cache_resource
+def get_session_registry() -> SessionRegistry:
+    """Return the session registry shared by all sessions of this server process."""
+    return SessionRegistry(
+        message_capacity=get_int_setting("SESSION_MESSAGE_CAPACITY", 500),
+        command_capacity=get_int_setting("SESSION_COMMAND_HISTORY", 100)
+    )
@@ -0,0 +1,1038 @@
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from config import get_float_setting, get_int_setting, get_setting
+from models import (DIRECT_MESSAGE_COLUMNS, MESSAGE_COLUMNS, ROOM_COLUMNS, USER_COLUMNS,
+                    Message, Room, User)
+
+def conversation_key(user1: str, user2: str) -> str:
+    """Canonical key of the conversation between two users (order independent).
+
+    The JSON text of the sorted pair matches what Postgres produces for
+    json_build_array(least(a, b), greatest(a, b))::text with COLLATE "C",
+    which the README migration uses to backfill existing rows.
+    """
+    return json.dumps(sorted([user1, user2]), ensure_ascii=False)
+
+def search_hit(row: Dict) -> Message:
+    """Build a Message from a search result row, which carries the room and direct message columns side by side."""
+    if row.get("recipient"):
+        return Message(row["id"], row["username"], row["content"], row.get("timestamp"),
+                       recipient=row["recipient"], conversation=row.get("conversation"))
+    return Message(row["id"], row["username"], row["content"], row.get("timestamp"), room=row["room"])
+
+def starts_word(content: Optional[str], term: str) -> bool:
+    """Whether a word of content starts with term, ignoring case; what an FTS5 prefix query matches.
+
+    As in the FTS5 tokenizer, underscores separate words.
+    """
+    return content is not None and re.search(r"(?<![^\W_])" + re.escape(term), content, re.IGNORECASE) is not None
+
+class StorageBackend:
+    """Storage interface used by DatabaseManager.
+
+    Implementations only move rows in and out of the users, rooms, messages
+    and direct_messages tables; hashing, validation and access rules stay in
+    DatabaseManager so every backend behaves the same. Reads select just the
+    columns the models need and return User, Room and Message records.
+    """
+
+    name = "base"
+
+    # Users
+    def user_exists(self, username: str) -> bool:
+        """Return whether a user exists, without reading its row."""
+        raise NotImplementedError
+
+    def get_user_credentials(self, username: str) -> Optional[Tuple[User, str]]:
+        """Return the user and its password hash, or None."""
+        raise NotImplementedError
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        """Return only the password hash of a user, or None."""
+        raise NotImplementedError
+
+    def insert_user(self, user_data: Dict) -> None:
+        """Insert a single user row."""
+        raise NotImplementedError
+
+    def insert_users(self, users_data: List[Dict]) -> None:
+        """Insert several user rows in one statement."""
+        raise NotImplementedError
+
+    def find_existing_usernames(self, usernames: List[str]) -> set:
+        """Return the subset of usernames that already exist."""
+        raise NotImplementedError
+
+    def update_user_password(self, username: str, hashed_password: str) -> None:
+        """Replace a user's password hash."""
+        raise NotImplementedError
+
+    # Rooms
+    def list_rooms(self) -> List[Room]:
+        """Return every room with its allowed_users and is_public flag."""
+        raise NotImplementedError
+
+    def list_user_rooms(self, username: str) -> List[str]:
+        """Return the names of public rooms and rooms whose allowed_users contains username."""
+        raise NotImplementedError
+
+    def room_exists(self, room_name: str) -> bool:
+        """Return whether a room exists, without reading its row."""
+        raise NotImplementedError
+
+    def get_room_allowed_users(self, room_name: str) -> Optional[List[str]]:
+        """Return the allowed_users list of a room, or None if the room doesn't exist."""
+        raise NotImplementedError
+
+    def find_existing_room_names(self, room_names: List[str]) -> set:
+        """Return the subset of room names that already exist."""
+        raise NotImplementedError
+
+    def get_rooms_allowed_users(self, room_names: List[str]) -> Dict[str, List[str]]:
+        """Return the allowed_users list of each existing room among room_names."""
+        raise NotImplementedError
+
+    def insert_room(self, room_data: Dict) -> None:
+        """Insert a single room row."""
+        raise NotImplementedError
+
+    def insert_rooms(self, rooms_data: List[Dict]) -> None:
+        """Insert several room rows in one statement."""
+        raise NotImplementedError
+
+    def update_room_allowed_users(self, room_name: str, allowed_users: List[str]) -> None:
+        """Replace the allowed_users list of a room."""
+        raise NotImplementedError
+
+    def update_rooms_allowed_users(self, allowed_users: Dict[str, List[str]]) -> None:
+        """Replace the allowed_users lists of several existing rooms in one round trip."""
+        raise NotImplementedError
+
+    def delete_room(self, room_name: str) -> None:
+        """Delete a room row."""
+        raise NotImplementedError
+
+    # Messages
+    def insert_message(self, message_data: Dict) -> Message:
+        """Insert a room message and return the stored message."""
+        raise NotImplementedError
+
+    def insert_messages(self, messages: List[Dict]) -> List[Message]:
+        """Insert several room messages in one statement and return the stored messages in order."""
+        raise NotImplementedError
+
+    def get_room_messages(self, room_name: str, limit: int, before_id: Optional[int] = None) -> List[Message]:
+        """Return the newest messages of a room (optionally older than before_id), newest first."""
+        raise NotImplementedError
+
+    def get_room_messages_since(self, room_name: str, after_id: int, limit: int) -> List[Message]:
+        """Return messages of a room with id greater than after_id, oldest first."""
+        raise NotImplementedError
+
+    def delete_message(self, message_id: int) -> None:
+        """Delete a single room message."""
+        raise NotImplementedError
+
+    # Direct messages
+    def insert_direct_message(self, dm_data: Dict) -> Message:
+        """Insert a direct message and return the stored message."""
+        raise NotImplementedError
+
+    def insert_direct_messages(self, messages: List[Dict]) -> List[Message]:
+        """Insert several direct messages in one statement and return the stored messages in order."""
+        raise NotImplementedError
+
+    def get_direct_messages(self, conversation: str, limit: int, before_id: Optional[int] = None) -> List[Message]:
+        """Return the newest messages of a conversation (optionally older than before_id), newest first."""
+        raise NotImplementedError
+
+    def get_direct_messages_since(self, conversation: str, after_id: int, limit: int) -> List[Message]:
+        """Return messages of a conversation with id greater than after_id, oldest first."""
+        raise NotImplementedError
+
+    def get_recent_direct_messages(self, username: str, limit: int) -> List[Message]:
+        """Return the newest direct messages sent or received by a user, newest first."""
+        raise NotImplementedError
+
+    # Search
+    def search_messages(self, terms: List[str], rooms: List[str], member: Optional[str],
+                        limit: int, offset: int = 0) -> List[Message]:
+        """Return the messages of rooms, and the direct messages sent or received by member (if given),
+        that contain every term as a word prefix, best match first."""
+        raise NotImplementedError
+
+    def optimize_search_index(self) -> None:
+        """Compact the search index after bulk deletes."""
+        raise NotImplementedError
+
+    # Retention
+    def find_purge_batch(self, table: str, after_id: int, batch_size: int,
+                         cutoff: Optional[str] = None, room: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        """Return the (first, last) id of the next batch_size rows after after_id that match
+        timestamp < cutoff and/or room, reading only ids, or None when nothing is left."""
+        raise NotImplementedError
+
+    def get_id_range(self, table: str, min_id: int, max_id: int,
+                     cutoff: Optional[str] = None, room: Optional[str] = None) -> List[Dict]:
+        """Return the matching rows with min_id <= id <= max_id, oldest first, as stored (for archiving)."""
+        raise NotImplementedError
+
+    def delete_id_range(self, table: str, min_id: int, max_id: int,
+                        cutoff: Optional[str] = None, room: Optional[str] = None) -> int:
+        """Delete matching rows with min_id <= id <= max_id and return only the count."""
+        raise NotImplementedError
+
+    # Maintenance job leases
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: float, interval_seconds: float) -> bool:
+        """Take the lease on a job for ttl_seconds.
+
+        Fails while another owner holds an unexpired lease, or while the
+        last recorded run started less than interval_seconds ago.
+        """
+        raise NotImplementedError
+
+    def renew_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        """Extend a lease this owner still holds to ttl_seconds from now; False if it was lost."""
+        raise NotImplementedError
+
+    def record_job_run(self, name: str, owner: str, run_at: str, status: str, result: Optional[str]) -> None:
+        """Store the outcome of a job run next to its lease."""
+        raise NotImplementedError
+
+    def list_job_runs(self) -> List[Dict]:
+        """Return the lease and last-run record of every job."""
+        raise NotImplementedError
+
+    # Presence shared between server processes
+    def upsert_presence(self, rows: List[Dict]) -> None:
+        """Insert or refresh presence rows (session, origin, username, location, expires_at) in one statement."""
+        raise NotImplementedError
+
+    def delete_presence(self, sessions: List[str]) -> None:
+        """Delete the presence rows of sessions that left."""
+        raise NotImplementedError
+
+    def delete_expired_presence(self, now: str) -> None:
+        """Delete presence rows that expired before now."""
+        raise NotImplementedError
+
+    def list_presence(self, now: str) -> List[Dict]:
+        """Return the presence rows still live at now."""
+        raise NotImplementedError
+
+class SupabaseBackend(StorageBackend):
+    """Storage backend backed by a Supabase (PostgREST) project."""
+
+    name = "supabase"
+
+    def __init__(self, url: str, key: str, timeout_seconds: float = 5.0, max_connections: int = 20,
+                 keepalive_seconds: float = 30.0):
+        """Create the Supabase client on a pooled keep-alive HTTP client with bounded timeouts."""
+        import httpx
+        from supabase import ClientOptions, create_client
+        self.http = httpx.Client(
+            base_url=f"{url.rstrip('/')}/rest/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            timeout=httpx.Timeout(timeout_seconds, connect=min(timeout_seconds, 3.0)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                                keepalive_expiry=keepalive_seconds),
+            http2=True,
+            follow_redirects=True
+        )
+        self.supabase = create_client(url, key, options=ClientOptions(httpx_client=self.http))
+
+    def _exists(self, table: str, column: str, value: str) -> bool:
+        """HEAD request with an exact count: PostgREST sends back no rows at all."""
+        from postgrest import CountMethod
+        response = (self.supabase.table(table)
+                   .select(column, count=CountMethod.exact, head=True)
+                   .eq(column, value)
+                   .execute())
+        return bool(response.count)
+
+    def user_exists(self, username: str) -> bool:
+        return self._exists("users", "username", username)
+
+    def get_user_credentials(self, username: str) -> Optional[Tuple[User, str]]:
+        response = (self.supabase.table("users")
+                   .select(f"{USER_COLUMNS}, password")
+                   .eq("username", username)
+                   .execute())
+        if not response.data:
+            return None
+        row = response.data[0]
+        return User.from_row(row), row["password"]
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        response = self.supabase.table("users").select("password").eq("username", username).execute()
+        return response.data[0]["password"] if response.data else None
+
+    def insert_user(self, user_data: Dict) -> None:
+        self.supabase.table("users").insert(user_data).execute()
+
+    def insert_users(self, users_data: List[Dict]) -> None:
+        self.supabase.table("users").insert(users_data).execute()
+
+    def find_existing_usernames(self, usernames: List[str]) -> set:
+        existing = set()
+        # Keep each IN list well under URL length limits
+        for start in range(0, len(usernames), 200):
+            response = (self.supabase.table("users")
+                       .select("username")
+                       .in_("username", usernames[start:start + 200])
+                       .execute())
+            existing.update(row["username"] for row in response.data)
+        return existing
+
+    def update_user_password(self, username: str, hashed_password: str) -> None:
+        self.supabase.table("users").update({"password": hashed_password}).eq("username", username).execute()
+
+    def list_rooms(self) -> List[Room]:
+        response = self.supabase.table("rooms").select(ROOM_COLUMNS).execute()
+        return [Room.from_row(row) for row in response.data]
+
+    def list_user_rooms(self, username: str) -> List[str]:
+        response = (self.supabase.table("rooms")
+                   .select("name")
+                   .or_(f'is_public.eq.true,allowed_users.cs.{{"{username}"}}')
+                   .execute())
+        return [room["name"] for room in response.data]
+
+    def room_exists(self, room_name: str) -> bool:
+        return self._exists("rooms", "name", room_name)
+
+    def get_room_allowed_users(self, room_name: str) -> Optional[List[str]]:
+        response = self.supabase.table("rooms").select("allowed_users").eq("name", room_name).execute()
+        return (response.data[0]["allowed_users"] or []) if response.data else None
+
+    def find_existing_room_names(self, room_names: List[str]) -> set:
+        existing = set()
+        for start in range(0, len(room_names), 200):
+            response = (self.supabase.table("rooms")
+                       .select("name")
+                       .in_("name", room_names[start:start + 200])
+                       .execute())
+            existing.update(row["name"] for row in response.data)
+        return existing
+
+    def get_rooms_allowed_users(self, room_names: List[str]) -> Dict[str, List[str]]:
+        allowed = {}
+        for start in range(0, len(room_names), 200):
+            response = (self.supabase.table("rooms")
+                       .select("name, allowed_users")
+                       .in_("name", room_names[start:start + 200])
+                       .execute())
+            allowed.update((row["name"], row["allowed_users"] or []) for row in response.data)
+        return allowed
+
+    def insert_room(self, room_data: Dict) -> None:
+        self.supabase.table("rooms").insert(room_data).execute()
+
+    def insert_rooms(self, rooms_data: List[Dict]) -> None:
+        self.supabase.table("rooms").insert(rooms_data).execute()
+
+    def update_room_allowed_users(self, room_name: str, allowed_users: List[str]) -> None:
+        self.supabase.table("rooms").update({"allowed_users": allowed_users}).eq("name", room_name).execute()
+
+    def update_rooms_allowed_users(self, allowed_users: Dict[str, List[str]]) -> None:
+        # An upsert on the unique name updates only the columns sent; the rooms were just read
+        rows = [{"name": name, "allowed_users": users} for name, users in allowed_users.items()]
+        self.supabase.table("rooms").upsert(rows, on_conflict="name").execute()
+
+    def delete_room(self, room_name: str) -> None:
+        self.supabase.table("rooms").delete().eq("name", room_name).execute()
+
+    def insert_message(self, message_data: Dict) -> Message:
+        response = self.supabase.table("messages").insert(message_data).execute()
+        return Message.from_row(response.data[0])
+
+    def insert_messages(self, messages: List[Dict]) -> List[Message]:
+        response = self.supabase.table("messages").insert(messages).execute()
+        return [Message.from_row(row) for row in response.data]
+
+    def get_room_messages(self, room_name: str, limit: int, before_id: Optional[int] = None) -> List[Message]:
+        query = (self.supabase.table("messages")
+                .select(MESSAGE_COLUMNS)
+                .eq("room", room_name))
+        if before_id is not None:
+            query = query.lt("id", before_id)
+        response = query.order("id", desc=True).limit(limit).execute()
+        return [Message.from_row(row) for row in response.data]
+
+    def get_room_messages_since(self, room_name: str, after_id: int, limit: int) -> List[Message]:
+        response = (self.supabase.table("messages")
+                   .select(MESSAGE_COLUMNS)
+                   .eq("room", room_name)
+                   .gt("id", after_id)
+                   .order("id")
+                   .limit(limit)
+                   .execute())
+        return [Message.from_row(row) for row in response.data]
+
+    def delete_message(self, message_id: int) -> None:
+        self.supabase.table("messages").delete().eq("id", message_id).execute()
+
+    def insert_direct_message(self, dm_data: Dict) -> Message:
+        response = self.supabase.table("direct_messages").insert(dm_data).execute()
+        return Message.from_row(response.data[0])
+
+    def insert_direct_messages(self, messages: List[Dict]) -> List[Message]:
+        response = self.supabase.table("direct_messages").insert(messages).execute()
+        return [Message.from_row(row) for row in response.data]
+
+    def get_direct_messages(self, conversation: str, limit: int, before_id: Optional[int] = None) -> List[Message]:
+        query = (self.supabase.table("direct_messages")
+                .select(DIRECT_MESSAGE_COLUMNS)
+                .eq("conversation", conversation))
+        if before_id is not None:
+            query = query.lt("id", before_id)
+        response = query.order("id", desc=True).limit(limit).execute()
+        return [Message.from_row(row) for row in response.data]
+
+    def get_direct_messages_since(self, conversation: str, after_id: int, limit: int) -> List[Message]:
+        response = (self.supabase.table("direct_messages")
+                   .select(DIRECT_MESSAGE_COLUMNS)
+                   .eq("conversation", conversation)
+                   .gt("id", after_id)
+                   .order("id")
+                   .limit(limit)
+                   .execute())
+        return [Message.from_row(row) for row in response.data]
+
+    def get_recent_direct_messages(self, username: str, limit: int) -> List[Message]:
+        response = (self.supabase.table("direct_messages")
+                   .select(DIRECT_MESSAGE_COLUMNS)
+                   .or_(f"sender.eq.{username},recipient.eq.{username}")
+                   .order("id", desc=True)
+                   .limit(limit)
+                   .execute())
+        return [Message.from_row(row) for row in response.data]
+
+    def search_messages(self, terms: List[str], rooms: List[str], member: Optional[str],
+                        limit: int, offset: int = 0) -> List[Message]:
+        # Ranked with ts_rank over the GIN-indexed search columns, see search_messages in the README
+        response = self.supabase.rpc("search_messages", {
+            "terms": " & ".join(f"{term}:*" for term in terms),
+            "rooms": rooms,
+            "member": member,
+            "max_rows": limit,
+            "skip": offset
+        }).execute()
+        return [search_hit(row) for row in response.data]
+
+    def optimize_search_index(self) -> None:
+        # GIN entries go away with their rows and autovacuum reclaims the space
+        pass
+
+    @staticmethod
+    def _purge_filters(query, cutoff: Optional[str], room: Optional[str]):
+        if cutoff is not None:
+            query = query.lt("timestamp", cutoff)
+        if room is not None:
+            query = query.eq("room", room)
+        return query
+
+    def find_purge_batch(self, table: str, after_id: int, batch_size: int,
+                         cutoff: Optional[str] = None, room: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        query = self.supabase.table(table).select("id").gt("id", after_id)
+        response = self._purge_filters(query, cutoff, room).order("id").limit(batch_size).execute()
+        if not response.data:
+            return None
+        return response.data[0]["id"], response.data[-1]["id"]
+
+    def get_id_range(self, table: str, min_id: int, max_id: int,
+                     cutoff: Optional[str] = None, room: Optional[str] = None) -> List[Dict]:
+        columns = MESSAGE_COLUMNS if table == "messages" else DIRECT_MESSAGE_COLUMNS
+        query = self.supabase.table(table).select(columns).gte("id", min_id).lte("id", max_id)
+        return self._purge_filters(query, cutoff, room).order("id").execute().data
+
+    def delete_id_range(self, table: str, min_id: int, max_id: int,
+                        cutoff: Optional[str] = None, room: Optional[str] = None) -> int:
+        from postgrest import CountMethod, ReturnMethod
+        query = (self.supabase.table(table)
+                .delete(count=CountMethod.exact, returning=ReturnMethod.minimal)
+                .gte("id", min_id)
+                .lte("id", max_id))
+        response = self._purge_filters(query, cutoff, room).execute()
+        return response.count or 0
+
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: float, interval_seconds: float) -> bool:
+        now = datetime.utcnow()
+        expires_at = (now + timedelta(seconds=ttl_seconds)).isoformat()
+        last_run_before = (now - timedelta(seconds=interval_seconds)).isoformat()
+        response = (self.supabase.table("job_leases")
+                   .upsert({"name": name, "owner": None, "expires_at": now.isoformat()},
+                           on_conflict="name", ignore_duplicates=True)
+                   .execute())
+        # The conditional update is atomic: only one replica sees an expired lease
+        response = (self.supabase.table("job_leases")
+                   .update({"owner": owner, "expires_at": expires_at})
+                   .eq("name", name)
+                   .lte("expires_at", now.isoformat())
+                   .or_(f"last_run_at.is.null,last_run_at.lte.{last_run_before}")
+                   .execute())
+        return bool(response.data)
+
+    def renew_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        now = datetime.utcnow()
+        response = (self.supabase.table("job_leases")
+                   .update({"expires_at": (now + timedelta(seconds=ttl_seconds)).isoformat()})
+                   .eq("name", name)
+                   .eq("owner", owner)
+                   .gt("expires_at", now.isoformat())
+                   .execute())
+        return bool(response.data)
+
+    def record_job_run(self, name: str, owner: str, run_at: str, status: str, result: Optional[str]) -> None:
+        (self.supabase.table("job_leases")
+            .update({"last_run_at": run_at, "last_status": status, "last_result": result})
+            .eq("name", name)
+            .eq("owner", owner)
+            .execute())
+
+    def list_job_runs(self) -> List[Dict]:
+        response = (self.supabase.table("job_leases")
+                   .select("name, owner, last_run_at, last_status, last_result")
+                   .execute())
+        return response.data
+
+    def upsert_presence(self, rows: List[Dict]) -> None:
+        self.supabase.table("presence").upsert(rows, on_conflict="session").execute()
+
+    def delete_presence(self, sessions: List[str]) -> None:
+        self.supabase.table("presence").delete().in_("session", sessions).execute()
+
+    def delete_expired_presence(self, now: str) -> None:
+        self.supabase.table("presence").delete().lt("expires_at", now).execute()
+
+    def list_presence(self, now: str) -> List[Dict]:
+        response = (self.supabase.table("presence")
+                   .select("origin, username, location")
+                   .gte("expires_at", now)
+                   .execute())
+        return response.data
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username TEXT UNIQUE NOT NULL,
+  password TEXT NOT NULL,
+  role TEXT DEFAULT 'user',
+  created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS rooms (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name TEXT UNIQUE NOT NULL,
+  allowed_users TEXT DEFAULT '[]',
+  is_public INTEGER DEFAULT 0,
+  created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  room TEXT NOT NULL,
+  username TEXT NOT NULL,
+  content TEXT NOT NULL,
+  timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_room_id_idx ON messages (room, id);
+CREATE INDEX IF NOT EXISTS messages_timestamp_idx ON messages (timestamp);
+
+CREATE TABLE IF NOT EXISTS direct_messages (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  sender TEXT NOT NULL,
+  recipient TEXT NOT NULL,
+  conversation TEXT,
+  content TEXT NOT NULL,
+  timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS direct_messages_timestamp_idx ON direct_messages (timestamp);
+CREATE INDEX IF NOT EXISTS direct_messages_sender_id_idx ON direct_messages (sender, id);
+CREATE INDEX IF NOT EXISTS direct_messages_recipient_id_idx ON direct_messages (recipient, id);
+
+CREATE TABLE IF NOT EXISTS job_leases (
+  name TEXT PRIMARY KEY,
+  owner TEXT,
+  expires_at TEXT NOT NULL,
+  last_run_at TEXT,
+  last_status TEXT,
+  last_result TEXT
+);
+
+CREATE TABLE IF NOT EXISTS presence (
+  session TEXT PRIMARY KEY,
+  origin TEXT NOT NULL,
+  username TEXT NOT NULL,
+  location TEXT NOT NULL,
+  expires_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS presence_expires_at_idx ON presence (expires_at);
+"""
+
+# Full-text indexes over message content, kept in step with their tables by triggers
+SQLITE_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+  content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+  INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+  INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+  INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+  INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS direct_messages_fts USING fts5 (
+  content, content='direct_messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS direct_messages_fts_insert AFTER INSERT ON direct_messages BEGIN
+  INSERT INTO direct_messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS direct_messages_fts_delete AFTER DELETE ON direct_messages BEGIN
+  INSERT INTO direct_messages_fts (direct_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS direct_messages_fts_update AFTER UPDATE OF content ON direct_messages BEGIN
+  INSERT INTO direct_messages_fts (direct_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+  INSERT INTO direct_messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+class SQLiteBackend(StorageBackend):
+    """Embedded SQLite backend for local development, benchmarks and single-node deployments.
+
+    The default path ``:memory:`` keeps everything in process memory. A single
+    connection is shared by all Streamlit sessions and serialized with a lock.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = ":memory:"):
+        """Open the database and create the schema if needed."""
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Bring databases created by older versions up to the current schema."""
+        dm_columns = {row["name"] for row in self._query("PRAGMA table_info(direct_messages)")}
+        if "conversation" not in dm_columns:
+            self.conn.execute("ALTER TABLE direct_messages ADD COLUMN conversation TEXT")
+        for row in self._query("SELECT id, sender, recipient FROM direct_messages WHERE conversation IS NULL"):
+            self.conn.execute("UPDATE direct_messages SET conversation = ? WHERE id = ?",
+                              (conversation_key(row["sender"], row["recipient"]), row["id"]))
+        self.conn.execute("DROP INDEX IF EXISTS direct_messages_sender_idx")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS direct_messages_conversation_idx ON direct_messages (conversation, id)"
+        )
+        self._create_search_index()
+
+    def _create_search_index(self):
+        """Create the FTS5 indexes, filling them from existing rows the first time.
+
+        SQLite builds without FTS5 fall back to scanning the tables with
+        starts_word, which matches the same word prefixes, unranked.
+        """
+        indexed = {row["name"] for row in self._query(
+            "SELECT name FROM sqlite_master WHERE name IN ('messages_fts', 'direct_messages_fts')"
+        )}
+        try:
+            self.conn.executescript(SQLITE_SEARCH_SCHEMA)
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search unavailable, falling back to a table scan: {e}")
+            self.conn.create_function("starts_word", 2, starts_word, deterministic=True)
+            self.full_text = False
+            return
+        for table in ("messages_fts", "direct_messages_fts"):
+            if table not in indexed:
+                self.conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+        self.full_text = True
+
+    def _query(self, sql: str, params: tuple = ()) -> List[Dict]:
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self.lock:
+            return self.conn.execute(sql, params)
+
+    def _insert(self, table: str, data: Dict) -> Dict:
+        columns = ", ".join(data)
+        placeholders = ", ".join("?" for _ in data)
+        with self.lock:
+            cursor = self.conn.execute(
+                f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", tuple(data.values())
+            )
+            row = dict(data)
+            row["id"] = cursor.lastrowid
+        return row
+
+    def _insert_many(self, table: str, rows: List[Dict]) -> List[Dict]:
+        """Insert rows in one transaction, returning them with their new ids."""
+        stored = []
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for data in rows:
+                    columns = ", ".join(data)
+                    placeholders = ", ".join("?" for _ in data)
+                    cursor = self.conn.execute(
+                        f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", tuple(data.values())
+                    )
+                    stored.append(dict(data, id=cursor.lastrowid))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return stored
+
+    def _messages(self, sql: str, params: tuple) -> List[Message]:
+        return [Message.from_row(row) for row in self._query(sql, params)]
+
+    def _exists(self, table: str, column: str, value: str) -> bool:
+        with self.lock:
+            return self.conn.execute(f"SELECT 1 FROM {table} WHERE {column} = ? LIMIT 1", (value,)).fetchone() is not None
+
+    def user_exists(self, username: str) -> bool:
+        return self._exists("users", "username", username)
+
+    def get_user_credentials(self, username: str) -> Optional[Tuple[User, str]]:
+        rows = self._query(f"SELECT {USER_COLUMNS}, password FROM users WHERE username = ?", (username,))
+        return (User.from_row(rows[0]), rows[0]["password"]) if rows else None
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        rows = self._query("SELECT password FROM users WHERE username = ?", (username,))
+        return rows[0]["password"] if rows else None
+
+    def insert_user(self, user_data: Dict) -> None:
+        self._insert("users", user_data)
+
+    def insert_users(self, users_data: List[Dict]) -> None:
+        if not users_data:
+            return
+        columns = list(users_data[0])
+        placeholders = ", ".join("?" for _ in columns)
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    f"INSERT INTO users ({', '.join(columns)}) VALUES ({placeholders})",
+                    [tuple(row[column] for column in columns) for row in users_data]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def find_existing_usernames(self, usernames: List[str]) -> set:
+        existing = set()
+        # SQLite limits the number of bound parameters per statement
+        for start in range(0, len(usernames), 500):
+            batch = usernames[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            rows = self._query(f"SELECT username FROM users WHERE username IN ({placeholders})", tuple(batch))
+            existing.update(row["username"] for row in rows)
+        return existing
+
+    def update_user_password(self, username: str, hashed_password: str) -> None:
+        self._execute("UPDATE users SET password = ? WHERE username = ?", (hashed_password, username))
+
+    def list_rooms(self) -> List[Room]:
+        rows = self._query(f"SELECT {ROOM_COLUMNS} FROM rooms")
+        return [Room(row["name"], json.loads(row["allowed_users"] or "[]"), bool(row["is_public"])) for row in rows]
+
+    def list_user_rooms(self, username: str) -> List[str]:
+        rows = self._query(
+            "SELECT name FROM rooms WHERE is_public = 1 "
+            "OR EXISTS (SELECT 1 FROM json_each(rooms.allowed_users) WHERE value = ?)",
+            (username,)
+        )
+        return [row["name"] for row in rows]
+
+    def room_exists(self, room_name: str) -> bool:
+        return self._exists("rooms", "name", room_name)
+
+    def get_room_allowed_users(self, room_name: str) -> Optional[List[str]]:
+        rows = self._query("SELECT allowed_users FROM rooms WHERE name = ?", (room_name,))
+        return json.loads(rows[0]["allowed_users"] or "[]") if rows else None
+
+    def find_existing_room_names(self, room_names: List[str]) -> set:
+        return set(self.get_rooms_allowed_users(room_names))
+
+    def get_rooms_allowed_users(self, room_names: List[str]) -> Dict[str, List[str]]:
+        allowed = {}
+        for start in range(0, len(room_names), 500):
+            batch = room_names[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            rows = self._query(f"SELECT name, allowed_users FROM rooms WHERE name IN ({placeholders})", tuple(batch))
+            allowed.update((row["name"], json.loads(row["allowed_users"] or "[]")) for row in rows)
+        return allowed
+
+    @staticmethod
+    def _room_row(room_data: Dict) -> Dict:
+        row = dict(room_data)
+        row["allowed_users"] = json.dumps(row.get("allowed_users") or [])
+        row["is_public"] = int(bool(row.get("is_public")))
+        return row
+
+    def insert_room(self, room_data: Dict) -> None:
+        self._insert("rooms", self._room_row(room_data))
+
+    def insert_rooms(self, rooms_data: List[Dict]) -> None:
+        self._insert_many("rooms", [self._room_row(room_data) for room_data in rooms_data])
+
+    def update_room_allowed_users(self, room_name: str, allowed_users: List[str]) -> None:
+        self._execute("UPDATE rooms SET allowed_users = ? WHERE name = ?", (json.dumps(allowed_users), room_name))
+
+    def update_rooms_allowed_users(self, allowed_users: Dict[str, List[str]]) -> None:
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "UPDATE rooms SET allowed_users = ? WHERE name = ?",
+                    [(json.dumps(users), name) for name, users in allowed_users.items()]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def delete_room(self, room_name: str) -> None:
+        self._execute("DELETE FROM rooms WHERE name = ?", (room_name,))
+
+    def insert_message(self, message_data: Dict) -> Message:
+        return Message.from_row(self._insert("messages", message_data))
+
+    def insert_messages(self, messages: List[Dict]) -> List[Message]:
+        return [Message.from_row(row) for row in self._insert_many("messages", messages)]
+
+    def get_room_messages(self, room_name: str, limit: int, before_id: Optional[int] = None) -> List[Message]:
+        if before_id is None:
+            return self._messages(
+                f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE room = ? ORDER BY id DESC LIMIT ?", (room_name, limit)
+            )
+        return self._messages(
+            f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE room = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (room_name, before_id, limit)
+        )
+
+    def get_room_messages_since(self, room_name: str, after_id: int, limit: int) -> List[Message]:
+        return self._messages(
+            f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE room = ? AND id > ? ORDER BY id LIMIT ?",
+            (room_name, after_id, limit)
+        )
+
+    def delete_message(self, message_id: int) -> None:
+        self._execute("DELETE FROM messages WHERE id = ?", (message_id,))
+
+    def insert_direct_message(self, dm_data: Dict) -> Message:
+        return Message.from_row(self._insert("direct_messages", dm_data))
+
+    def insert_direct_messages(self, messages: List[Dict]) -> List[Message]:
+        return [Message.from_row(row) for row in self._insert_many("direct_messages", messages)]
+
+    def get_direct_messages(self, conversation: str, limit: int, before_id: Optional[int] = None) -> List[Message]:
+        if before_id is None:
+            return self._messages(
+                f"SELECT {DIRECT_MESSAGE_COLUMNS} FROM direct_messages WHERE conversation = ? ORDER BY id DESC LIMIT ?",
+                (conversation, limit)
+            )
+        return self._messages(
+            f"SELECT {DIRECT_MESSAGE_COLUMNS} FROM direct_messages "
+            "WHERE conversation = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (conversation, before_id, limit)
+        )
+
+    def get_direct_messages_since(self, conversation: str, after_id: int, limit: int) -> List[Message]:
+        return self._messages(
+            f"SELECT {DIRECT_MESSAGE_COLUMNS} FROM direct_messages WHERE conversation = ? AND id > ? ORDER BY id LIMIT ?",
+            (conversation, after_id, limit)
+        )
+
+    def get_recent_direct_messages(self, username: str, limit: int) -> List[Message]:
+        return self._messages(
+            "SELECT * FROM ("
+            f"SELECT {DIRECT_MESSAGE_COLUMNS} FROM direct_messages WHERE sender = ? "
+            f"UNION SELECT {DIRECT_MESSAGE_COLUMNS} FROM direct_messages WHERE recipient = ?"
+            ") ORDER BY id DESC LIMIT ?",
+            (username, username, limit)
+        )
+
+    def search_messages(self, terms: List[str], rooms: List[str], member: Optional[str],
+                        limit: int, offset: int = 0) -> List[Message]:
+        if self.full_text:
+            # Every term as a quoted prefix; FTS5 ANDs them
+            match = " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+            room_hits = (
+                "SELECT m.id, m.room, m.username, NULL AS recipient, NULL AS conversation, m.content, m.timestamp, "
+                "bm25(messages_fts) AS rank FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                "WHERE messages_fts MATCH ? AND m.room IN (SELECT value FROM json_each(?))"
+            )
+            dm_hits = (
+                "SELECT d.id, NULL, d.sender, d.recipient, d.conversation, d.content, d.timestamp, "
+                "bm25(direct_messages_fts) FROM direct_messages_fts JOIN direct_messages d "
+                "ON d.id = direct_messages_fts.rowid "
+                "WHERE direct_messages_fts MATCH ? AND (d.sender = ? OR d.recipient = ?)"
+            )
+            room_params, dm_params = (match, json.dumps(rooms)), (match, member, member)
+        else:
+            # Without FTS5 every match ranks the same, newest first
+            matches = " AND ".join("starts_word(content, ?)" for _ in terms)
+            patterns = tuple(terms)
+            room_hits = (
+                "SELECT id, room, username, NULL AS recipient, NULL AS conversation, content, timestamp, 0 AS rank "
+                f"FROM messages WHERE {matches} AND room IN (SELECT value FROM json_each(?))"
+            )
+            dm_hits = (
+                "SELECT id, NULL, sender, recipient, conversation, content, timestamp, 0 "
+                f"FROM direct_messages WHERE {matches} AND (sender = ? OR recipient = ?)"
+            )
+            room_params, dm_params = patterns + (json.dumps(rooms),), patterns + (member, member)
+        sql, params = room_hits, room_params
+        if member is not None:
+            sql, params = f"{room_hits} UNION ALL {dm_hits}", room_params + dm_params
+        rows = self._query(f"SELECT * FROM ({sql}) ORDER BY rank, id DESC LIMIT ? OFFSET ?",
+                           params + (limit, offset))
+        return [search_hit(row) for row in rows]
+
+    def optimize_search_index(self) -> None:
+        if not self.full_text:
+            return
+        with self.lock:
+            for table in ("messages_fts", "direct_messages_fts"):
+                self.conn.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+
+    @staticmethod
+    def _purge_filters(cutoff: Optional[str], room: Optional[str]) -> Tuple[str, tuple]:
+        clauses, params = [], []
+        if cutoff is not None:
+            clauses.append("timestamp < ?")
+            params.append(cutoff)
+        if room is not None:
+            clauses.append("room = ?")
+            params.append(room)
+        return "".join(f" AND {clause}" for clause in clauses), tuple(params)
+
+    def find_purge_batch(self, table: str, after_id: int, batch_size: int,
+                         cutoff: Optional[str] = None, room: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        filters, params = self._purge_filters(cutoff, room)
+        rows = self._query(
+            f"SELECT MIN(id) AS first_id, MAX(id) AS last_id FROM ("
+            f"SELECT id FROM {table} WHERE id > ?{filters} ORDER BY id LIMIT ?)",
+            (after_id,) + params + (batch_size,)
+        )
+        if not rows or rows[0]["first_id"] is None:
+            return None
+        return rows[0]["first_id"], rows[0]["last_id"]
+
+    def get_id_range(self, table: str, min_id: int, max_id: int,
+                     cutoff: Optional[str] = None, room: Optional[str] = None) -> List[Dict]:
+        columns = MESSAGE_COLUMNS if table == "messages" else DIRECT_MESSAGE_COLUMNS
+        filters, params = self._purge_filters(cutoff, room)
+        return self._query(
+            f"SELECT {columns} FROM {table} WHERE id BETWEEN ? AND ?{filters} ORDER BY id", (min_id, max_id) + params
+        )
+
+    def delete_id_range(self, table: str, min_id: int, max_id: int,
+                        cutoff: Optional[str] = None, room: Optional[str] = None) -> int:
+        filters, params = self._purge_filters(cutoff, room)
+        return self._execute(
+            f"DELETE FROM {table} WHERE id BETWEEN ? AND ?{filters}", (min_id, max_id) + params
+        ).rowcount
+
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: float, interval_seconds: float) -> bool:
+        now = datetime.utcnow()
+        expires_at = (now + timedelta(seconds=ttl_seconds)).isoformat()
+        last_run_before = (now - timedelta(seconds=interval_seconds)).isoformat()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO job_leases (name, owner, expires_at) VALUES (?, NULL, ?)",
+                (name, now.isoformat())
+            )
+            cursor = self.conn.execute(
+                "UPDATE job_leases SET owner = ?, expires_at = ? WHERE name = ? AND expires_at <= ? "
+                "AND (last_run_at IS NULL OR last_run_at <= ?)",
+                (owner, expires_at, name, now.isoformat(), last_run_before)
+            )
+        return cursor.rowcount == 1
+
+    def renew_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        now = datetime.utcnow()
+        return self._execute(
+            "UPDATE job_leases SET expires_at = ? WHERE name = ? AND owner = ? AND expires_at > ?",
+            ((now + timedelta(seconds=ttl_seconds)).isoformat(), name, owner, now.isoformat())
+        ).rowcount == 1
+
+    def record_job_run(self, name: str, owner: str, run_at: str, status: str, result: Optional[str]) -> None:
+        self._execute(
+            "UPDATE job_leases SET last_run_at = ?, last_status = ?, last_result = ? WHERE name = ? AND owner = ?",
+            (run_at, status, result, name, owner)
+        )
+
+    def list_job_runs(self) -> List[Dict]:
+        return self._query("SELECT name, owner, last_run_at, last_status, last_result FROM job_leases")
+
+    def upsert_presence(self, rows: List[Dict]) -> None:
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO presence (session, origin, username, location, expires_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (session) DO UPDATE SET origin = excluded.origin, username = excluded.username, "
+                    "location = excluded.location, expires_at = excluded.expires_at",
+                    [(row["session"], row["origin"], row["username"], row["location"], row["expires_at"])
+                     for row in rows]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def delete_presence(self, sessions: List[str]) -> None:
+        for start in range(0, len(sessions), 500):
+            batch = sessions[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            self._execute(f"DELETE FROM presence WHERE session IN ({placeholders})", tuple(batch))
+
+    def delete_expired_presence(self, now: str) -> None:
+        self._execute("DELETE FROM presence WHERE expires_at < ?", (now,))
+
+    def list_presence(self, now: str) -> List[Dict]:
+        return self._query("SELECT origin, username, location FROM presence WHERE expires_at >= ?", (now,))
+
+def create_backend() -> Optional[StorageBackend]:
+    """Build the storage backend selected by the STORAGE_BACKEND setting."""
+    backend_name = str(get_setting("STORAGE_BACKEND", "supabase")).lower()
+
+    if backend_name == "sqlite":
+        return SQLiteBackend(get_setting("SQLITE_PATH", ":memory:"))
+
+    if backend_name != "supabase":
+        print(f"Unknown storage backend '{backend_name}', falling back to supabase")
+
+    url = get_setting("SUPABASE_URL")
+    key = get_setting("SUPABASE_KEY")
+    if url and key:
+        return SupabaseBackend(
+            url, key,
+            timeout_seconds=get_float_setting("SUPABASE_TIMEOUT_SECONDS", 5.0),
+            max_connections=get_int_setting("SUPABASE_MAX_CONNECTIONS", 20),
+            keepalive_seconds=get_float_setting("SUPABASE_KEEPALIVE_SECONDS", 30.0)
+        )
+    print("Supabase credentials not found in Streamlit secrets")
+    return None
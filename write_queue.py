@@ -0,0 +1,140 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+class WriteBehindQueue:
+    """In-process write-behind queue that turns single-row inserts into bulk inserts.
+
+    Rows from every session are collected on one background thread and
+    flushed per table as soon as max_batch rows are waiting or flush_interval
+    seconds have passed since the first one arrived. Each submitted row gets
+    a Future that resolves to the stored record (or the insert error).
+    on_stored runs for every stored batch before its Futures resolve; its
+    errors are logged and never cause a retry. A failed bulk insert is
+    retried row by row only when is_rejection says the backend refused it,
+    since after a timeout the rows may already be stored. At most
+    max_pending rows may wait; submit blocks for up to put_timeout seconds
+    when the queue is full and then raises queue.Full, which pushes back on
+    senders instead of growing memory. Pending rows are flushed on close(),
+    which also runs at interpreter exit.
+    """
+
+    def __init__(self, flush_fn: Callable[[str, List[Dict]], List], max_batch: int = 100,
+                 flush_interval: float = 0.005, max_pending: int = 10000, put_timeout: float = 1.0,
+                 on_stored: Optional[Callable[[List], None]] = None,
+                 is_rejection: Callable[[Exception], bool] = lambda error: True):
+        self.flush_fn = flush_fn
+        self.on_stored = on_stored
+        self.is_rejection = is_rejection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.pending: "queue.Queue[Tuple[str, Dict, Future]]" = queue.Queue(maxsize=max_pending)
+        self.closed = threading.Event()
+        self.lock = threading.Lock()
+        self.counters = {"submitted": 0, "flushed_rows": 0, "batches": 0, "failed_rows": 0, "rejected": 0}
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, table: str, row: Dict) -> Future:
+        """Queue a row for insertion and return a Future for the stored record."""
+        if self.closed.is_set():
+            raise RuntimeError("write-behind queue is closed")
+        future: Future = Future()
+        try:
+            self.pending.put((table, row, future), timeout=self.put_timeout)
+        except queue.Full:
+            with self.lock:
+                self.counters["rejected"] += 1
+            raise
+        with self.lock:
+            self.counters["submitted"] += 1
+        return future
+
+    def _run(self):
+        while not (self.closed.is_set() and self.pending.empty()):
+            try:
+                first = self.pending.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: List[Tuple[str, Dict, Future]]):
+        by_table: Dict[str, List[Tuple[Dict, Future]]] = {}
+        for table, row, future in batch:
+            by_table.setdefault(table, []).append((row, future))
+
+        for table, items in by_table.items():
+            rows = [row for row, _ in items]
+            try:
+                stored = self.flush_fn(table, rows)
+            except Exception as e:
+                if self.is_rejection(e):
+                    print(f"Bulk insert into {table} failed, retrying rows individually: {e}")
+                    self._flush_individually(table, items)
+                else:
+                    # The rows may have been stored before the failure; inserting them again could duplicate them
+                    print(f"Bulk insert into {table} failed: {e}")
+                    self._fail(items, e)
+                continue
+            self._stored(stored)
+            for (_, future), stored_row in zip(items, stored):
+                future.set_result(stored_row)
+            with self.lock:
+                self.counters["flushed_rows"] += len(rows)
+                self.counters["batches"] += 1
+
+    def _flush_individually(self, table: str, items: List[Tuple[Dict, Future]]):
+        for row, future in items:
+            try:
+                stored = self.flush_fn(table, [row])
+            except Exception as e:
+                self._fail([(row, future)], e)
+                continue
+            self._stored(stored)
+            future.set_result(stored[0])
+            with self.lock:
+                self.counters["flushed_rows"] += 1
+
+    def _stored(self, stored: List):
+        if self.on_stored is None:
+            return
+        try:
+            self.on_stored(stored)
+        except Exception as e:
+            print(f"Error handling stored rows: {e}")
+
+    def _fail(self, items: List[Tuple[Dict, Future]], error: Exception):
+        for _, future in items:
+            future.set_exception(error)
+        with self.lock:
+            self.counters["failed_rows"] += len(items)
+
+    def close(self, timeout: float = 10.0):
+        """Stop accepting rows and flush everything still pending."""
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.thread.join(timeout)
+
+    def metrics(self) -> Dict:
+        """Queue depth and flush counters for admin views and benchmarks."""
+        with self.lock:
+            metrics = dict(self.counters)
+        metrics["pending"] = self.pending.qsize()
+        metrics["avg_batch_rows"] = round(metrics["flushed_rows"] / metrics["batches"], 1) if metrics["batches"] else 0.0
+        return metrics